@@ -0,0 +1,5 @@
+"""
+Stage-level microbenchmarks of the parsing pipeline. Run with:
+
+    $ poetry run python -m benchmarks run --fsts-dir work/fsts -o results.json
+"""
@@ -0,0 +1,106 @@
+import platform
+import sys
+import time
+from os.path import dirname, join as pjoin
+
+import click
+import click_log
+import orjson
+
+from wikiparse.cmd.parse import add_rev, fsts_dir_opt, mod_data_opt
+
+DEFAULT_CORPUS = pjoin(dirname(dirname(__file__)), "test", "data", "words")
+
+
+@click.group()
+def benchmarks():
+    pass
+
+
+def load_results(path):
+    with open(path, "rb") as inf:
+        return orjson.loads(inf.read())
+
+
+def print_results(results):
+    for stage, result in results["stages"].items():
+        calls = result["calls"]
+        secs = result["seconds"]
+        per_call = secs / calls * 1e6 if calls else 0
+        print(f"{stage:20} {calls:6} calls {secs:10.4f}s {per_call:10.1f}us/call")
+
+
+def report_regressions(baseline, results, tolerance):
+    from .stages import compare
+
+    regressions = compare(baseline, results, tolerance)
+    for stage, before, after in regressions:
+        print(
+            f"REGRESSION {stage}: {before:.4f}s -> {after:.4f}s "
+            f"({(after / before - 1) * 100:+.0f}%)"
+        )
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+
+
+tolerance_opt = click.option(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="Flag stages which are more than this fraction slower than the baseline.",
+)
+
+
+@benchmarks.command()
+@mod_data_opt
+@fsts_dir_opt
+@click.option("--corpus", type=click.Path(exists=True), default=DEFAULT_CORPUS)
+@click.option("--repeats", type=int, default=5)
+@click.option(
+    "--warm-caches/--cold-caches",
+    help="Keep the FST lookup and language ID caches between repeats.",
+)
+@click.option("-o", "--output", type=click.Path(), help="Write results as JSON here.")
+@click.option("--baseline", type=click.Path(exists=True))
+@tolerance_opt
+def run(corpus, repeats, warm_caches, output, baseline, tolerance):
+    """
+    Time each stage of the pipeline on the pages in --corpus.
+    """
+    from .stages import capture, read_corpus, time_stages
+
+    captured = capture(read_corpus(corpus))
+    results = {
+        "meta": {
+            "corpus": corpus,
+            "repeats": repeats,
+            "warm_caches": warm_caches,
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": time_stages(captured, repeats, warm_caches),
+    }
+    add_rev(results["meta"], "rev")
+    print_results(results)
+    if output is not None:
+        with open(output, "wb") as outf:
+            outf.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    if baseline is not None:
+        report_regressions(load_results(baseline), results, tolerance)
+
+
+@benchmarks.command()
+@click.argument("baseline", type=click.Path(exists=True))
+@click.argument("results", type=click.Path(exists=True))
+@tolerance_opt
+def compare(baseline, results, tolerance):
+    """
+    Compare stored RESULTS against a stored BASELINE.
+    """
+    report_regressions(load_results(baseline), load_results(results), tolerance)
+
+
+if __name__ == "__main__":
+    click_log.basic_config()
+    benchmarks()
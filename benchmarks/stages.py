@@ -0,0 +1,333 @@
+"""
+Timing of the individual stages of the parsing pipeline.
+
+`capture` runs the whole pipeline over a corpus of pages once, recording the
+input each stage was called with. Since several stages consume or mutate
+their input, inputs are recorded as wikitext and each case is rebuilt before
+it is timed. `time_stages` then times each stage on its own over all of its
+recorded inputs.
+"""
+import contextlib
+import copy
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+import orjson
+from mwparserfromhell import parse as mwparse
+
+import wikiparse.assoc
+import wikiparse.parse
+from wikiparse.assoc.interpret import interpret_trees
+from wikiparse.assoc.lex import lex_span
+from wikiparse.assoc.models import AssocSpan
+from wikiparse.assoc.parse import parse as pratt_parse
+from wikiparse.context import ParseContext
+from wikiparse.exceptions import (
+    InterpretException,
+    ParseException,
+    UnknownStructureException,
+)
+from wikiparse.parse_defn import get_senses
+from wikiparse.parse_deriv import get_deriv
+from wikiparse.parse_ety import get_ety
+from wikiparse.utils.json import dumps
+from wikiparse.utils.wikicode import parse_nested_list
+
+STAGES = [
+    "page_parse",
+    "parse_nested_list",
+    "get_senses",
+    "get_ety",
+    "get_deriv",
+    "lex_span",
+    "pratt_parse",
+    "interpret_trees",
+    "json_dump",
+    "insert_defns",
+]
+
+PIPELINE_EXCEPTIONS = (UnknownStructureException, ParseException, InterpretException)
+
+
+@dataclass
+class Stage:
+    """
+    `setup` rebuilds the arguments of `run` from one of `inputs`, untimed.
+    """
+
+    inputs: List[Any]
+    setup: Callable[[Any], Tuple]
+    run: Callable[..., Any]
+
+
+def wikicode(src: str):
+    return mwparse(src, skip_style_tags=True)
+
+
+@dataclass
+class SpanInput:
+    ctx: ParseContext
+    span_type: Any
+    src: str
+    is_template: bool
+
+    def build(self) -> Tuple[ParseContext, AssocSpan]:
+        payload = wikicode(self.src)
+        if self.is_template:
+            payload = payload.nodes[0]
+        return copy.deepcopy(self.ctx), AssocSpan(self.span_type, payload)
+
+    def lex(self):
+        return list(lex_span(*self.build()))
+
+
+@dataclass
+class Captured:
+    pages: List[Tuple[str, str]] = field(default_factory=list)
+    nested_lists: List[str] = field(default_factory=list)
+    senses: List[Tuple[ParseContext, str]] = field(default_factory=list)
+    etys: List[str] = field(default_factory=list)
+    derivs: List[Tuple[ParseContext, str]] = field(default_factory=list)
+    spans: List[SpanInput] = field(default_factory=list)
+    results: List[Tuple[str, Any]] = field(default_factory=list)
+
+
+def read_corpus(corpus_dir: str) -> List[Tuple[str, str]]:
+    pages = []
+    for name in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, name)) as inf:
+            pages.append((name, inf.read()))
+    return pages
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline logs ignored exceptions and prints failed pages
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def capture(pages: List[Tuple[str, str]]) -> Captured:
+    """
+    Run the pipeline over `pages`, recording the input of every stage.
+    """
+    captured = Captured(pages=pages)
+    last_nested_list: List[Optional[str]] = [None]
+
+    def rec_parse_nested_list(definitions):
+        last_nested_list[0] = str(definitions)
+        captured.nested_lists.append(last_nested_list[0])
+        return parse_nested_list(definitions)
+
+    def rec_get_senses(ctx, nested_list):
+        captured.senses.append((copy.deepcopy(ctx), last_nested_list[0]))
+        return get_senses(ctx, nested_list)
+
+    def rec_get_ety(etymology):
+        captured.etys.append(str(etymology))
+        return get_ety(etymology)
+
+    def rec_get_deriv(ctx, section):
+        captured.derivs.append((copy.deepcopy(ctx), str(section)))
+        return get_deriv(ctx, section)
+
+    orig_pipeline_span = wikiparse.assoc.pipeline_span
+
+    def rec_pipeline_span(ctx, span):
+        captured.spans.append(
+            SpanInput(
+                copy.deepcopy(ctx),
+                span.typ,
+                str(span.payload),
+                not hasattr(span.payload, "nodes"),
+            )
+        )
+        return orig_pipeline_span(ctx, span)
+
+    with contextlib.ExitStack() as stack:
+        for name, rec in [
+            ("parse_nested_list", rec_parse_nested_list),
+            ("get_senses", rec_get_senses),
+            ("get_ety", rec_get_ety),
+            ("get_deriv", rec_get_deriv),
+        ]:
+            stack.enter_context(mock.patch.object(wikiparse.parse, name, rec))
+        stack.enter_context(
+            mock.patch.object(wikiparse.assoc, "pipeline_span", rec_pipeline_span)
+        )
+        stack.enter_context(quiet())
+        for title, content in pages:
+            result = wikiparse.parse.proc_text(title, content)
+            if result is not None and isinstance(result[1], dict):
+                captured.results.append(result)
+    return captured
+
+
+def consume(gen):
+    try:
+        for _ in gen:
+            pass
+    except PIPELINE_EXCEPTIONS:
+        pass
+
+
+def try_lex(span: SpanInput):
+    try:
+        return span.lex()
+    except PIPELINE_EXCEPTIONS:
+        return None
+
+
+def first_tree(lexed):
+    try:
+        return next(iter(pratt_parse(lexed)), None)
+    except PIPELINE_EXCEPTIONS:
+        return None
+
+
+def mk_inserter():
+    from wikiparse.db.bulk import BulkInserter
+    from wikiparse.db.tables import metadata
+    from wikiparse.utils.db import get_session
+
+    session = get_session("sqlite://")
+    metadata.create_all(session().get_bind().engine)
+    return BulkInserter(session)
+
+
+def mk_stages(captured: Captured) -> Dict[str, Stage]:
+    from wikiparse.db.insert import insert_defns
+
+    lexable = [span for span in captured.spans if try_lex(span) is not None]
+    parseable = [span for span in lexable if first_tree(span.lex()) is not None]
+    inserter = mk_inserter()
+    headword_id_map: Dict[str, int] = {}
+
+    def run_insert_defns(lemma, defns):
+        insert_defns(inserter, lemma, defns, headword_id_map)
+        inserter.flush()
+
+    return {
+        "page_parse": Stage(
+            [content for _, content in captured.pages],
+            lambda content: (content,),
+            wikicode,
+        ),
+        "parse_nested_list": Stage(
+            captured.nested_lists, lambda src: (wikicode(src),), parse_nested_list,
+        ),
+        "get_senses": Stage(
+            captured.senses,
+            lambda inp: (copy.deepcopy(inp[0]), parse_nested_list(wikicode(inp[1]))),
+            lambda ctx, nested_list: consume(get_senses(ctx, nested_list)),
+        ),
+        "get_ety": Stage(
+            captured.etys,
+            lambda src: (wikicode(src),),
+            lambda code: consume(get_ety(code)),
+        ),
+        "get_deriv": Stage(
+            captured.derivs,
+            lambda inp: (copy.deepcopy(inp[0]), wikicode(inp[1])),
+            lambda ctx, code: consume(get_deriv(ctx, code)),
+        ),
+        "lex_span": Stage(
+            captured.spans,
+            SpanInput.build,
+            lambda ctx, span: consume(lex_span(ctx, span)),
+        ),
+        "pratt_parse": Stage(lexable, lambda span: (span.lex(),), first_tree),
+        "interpret_trees": Stage(
+            parseable,
+            lambda span: (copy.deepcopy(span.ctx), first_tree(span.lex())),
+            lambda ctx, tree: next(interpret_trees(ctx, iter([tree])), None),
+        ),
+        "json_dump": Stage(
+            [result for _, result in captured.results], lambda result: (result,), dumps
+        ),
+        "insert_defns": Stage(
+            [
+                (lemma, dumps(result["defns"]))
+                for lemma, result in captured.results
+                if "defns" in result
+            ],
+            lambda inp: (inp[0], orjson.loads(inp[1])),
+            run_insert_defns,
+        ),
+    }
+
+
+def reset_caches():
+    from wikiparse.utils.fst import LazyFst
+    from wikiparse.utils.langid import cached_detect
+
+    LazyFst.lookup_cache.clear()
+    cached_detect.cache_clear()
+
+
+def time_stage(stage: Stage, warm_caches: bool) -> float:
+    total = 0.0
+    if not warm_caches:
+        reset_caches()
+    for inp in stage.inputs:
+        args = stage.setup(inp)
+        start = time.perf_counter()
+        try:
+            stage.run(*args)
+        except PIPELINE_EXCEPTIONS:
+            pass
+        total += time.perf_counter() - start
+    return total
+
+
+def time_stages(
+    captured: Captured, repeats: int = 5, warm_caches: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Time each stage over all its captured inputs `repeats` times. The
+    minimum over the repeats is the least noisy estimate so is what gets
+    compared. Unless `warm_caches` is set, the memo caches of the FST and
+    language ID lookups are cleared before each repeat.
+    """
+    results = {}
+    with quiet():
+        stages = mk_stages(captured)
+        for name in STAGES:
+            stage = stages[name]
+            timings = [time_stage(stage, warm_caches) for _ in range(repeats)]
+            results[name] = {
+                "calls": len(stage.inputs),
+                "seconds": min(timings),
+                "timings": timings,
+            }
+    return results
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    tolerance: float = 0.2,
+    min_seconds: float = 0.001,
+) -> List[Tuple[str, float, float]]:
+    """
+    Find the stages which have got more than `tolerance` slower than in
+    `baseline`. Differences of less than `min_seconds` are ignored as noise.
+    """
+    regressions = []
+    for stage, result in current["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        before = base["seconds"]
+        after = result["seconds"]
+        if after > before * (1 + tolerance) and after - before > min_seconds:
+            regressions.append((stage, before, after))
+    return regressions
@@ -1,4 +1,4 @@
 #!/usr/bin/env bash
 
-python parse.py create
-python parse.py insert-dir $*
+python parse.py create --fast-load
+python parse.py insert-dir --fast-load $*
@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+
+poetry run python -m benchmarks run "$@"
@@ -1 +1 @@
-poetry run black test wikiparse
+poetry run black test wikiparse benchmarks
@@ -1 +1 @@
-poetry run flake8 test wikiparse
+poetry run flake8 test wikiparse benchmarks
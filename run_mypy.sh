@@ -1 +1 @@
-poetry run mypy wikiparse parse.py test && poetry run mypy -m wikiparse
+poetry run mypy wikiparse parse.py test benchmarks && poetry run mypy -m wikiparse
@@ -0,0 +1,26 @@
+from benchmarks.stages import STAGES, capture, compare, time_stages
+from .test_parse import read_data
+
+
+def results(**stages):
+    return {
+        "stages": {
+            stage: {"calls": 1, "seconds": secs} for stage, secs in stages.items()
+        }
+    }
+
+
+def test_compare():
+    baseline = results(page_parse=1.0, get_senses=0.001, lex_span=1.0)
+    current = results(page_parse=1.5, get_senses=0.0015, lex_span=1.1, new_stage=1.0)
+    assert compare(baseline, current, tolerance=0.2) == [("page_parse", 1.0, 1.5)]
+
+
+def test_time_stages():
+    captured = capture([("kertoa", read_data("kertoa"))])
+    assert captured.spans
+    timed = time_stages(captured, repeats=2)
+    assert list(timed.keys()) == STAGES
+    assert timed["page_parse"]["calls"] == 1
+    assert timed["lex_span"]["calls"] == len(captured.spans)
+    assert all(len(stage["timings"]) == 2 for stage in timed.values())
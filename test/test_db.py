@@ -0,0 +1,419 @@
+import asyncio
+import io
+import os
+import shutil
+from os.path import join as pjoin
+import orjson
+import pytest
+from sqlalchemy.sql import select, func
+from wikiparse.cmd.lookup import lookup_batch
+from wikiparse.cmd.parse import insert_dir_inner, update_dir_inner
+from wikiparse.db import tables
+from wikiparse.db.bulk import copy_columns, copy_text_rows
+from wikiparse.db.counts import refresh_rels_counts
+from wikiparse.db.entries import get_entries, get_entry
+from wikiparse.db.insert import insert_defns_safe
+from wikiparse.db.lookup import lookup_lemmas, lookup_lemmas_batch
+from wikiparse.db.queries import RELATED, headword_rels_counts_query
+from wikiparse.db.update import get_headword_ids
+from wikiparse.enums import DerivationType
+from wikiparse.exceptions import exception_filter
+from wikiparse.form_index import (
+    FormIndex,
+    FormLemma,
+    export_form_index,
+    write_form_index,
+)
+from wikiparse.parse import proc_text
+from wikiparse.serve import LookupServer
+from wikiparse.utils.db import existing_indexes, fast_load, get_engine, get_session
+from wikiparse.utils.json import dumps
+from .test_parse import filter_unk, read_data
+
+
+WORDS = ["vuotta", "voima", "aivojuovio", "armo"]
+
+
+@exception_filter(filter_unk)
+def write_parsed(outdir, words):
+    for word in words:
+        _, results = proc_text(word, read_data(word))
+        with open(pjoin(outdir, word), "wb") as outf:
+            outf.write(dumps(results))
+    return str(outdir)
+
+
+@pytest.fixture(scope="module")
+def parsed_dir(tmpdir_factory):
+    return write_parsed(tmpdir_factory.mktemp("parsed"), WORDS)
+
+
+@pytest.fixture
+def session(tmpdir):
+    session = get_session("sqlite:///" + os.path.join(tmpdir, "defns.db"))
+    tables.metadata.create_all(session().get_bind().engine)
+    return session
+
+
+def count(session, table):
+    return session.execute(select([func.count()]).select_from(table)).scalar()
+
+
+def test_insert_dir(parsed_dir, session):
+    insert_dir_inner(session, parsed_dir)
+    names = {
+        name: (hw_id, redlink)
+        for hw_id, name, redlink in session.execute(select([tables.headword]))
+    }
+    for word in WORDS:
+        assert not names[word][1]
+    assert count(session, tables.word_sense) > 0
+    assert count(session, tables.etymology) > 0
+    # vuotta is a form of vuosi; the link should be resolved without a dangling id
+    vuosi_id = names["vuosi"][0]
+    inflections = session.execute(
+        select([tables.word_sense.c.extra, tables.inflection_of.c.inflection])
+        .select_from(
+            tables.word_sense.join(
+                tables.inflection_of,
+                tables.word_sense.c.inflection_of_id == tables.inflection_of.c.id,
+            )
+        )
+        .where(tables.inflection_of.c.lemma_id == vuosi_id)
+    ).fetchall()
+    assert len(inflections) >= 1
+    for extra, inflection in inflections:
+        assert extra["morph"]["lemma"] == "vuosi"
+        assert "lemma" not in inflection
+
+
+def test_insert_defns_safe(parsed_dir, session):
+    insert_dir_inner(session, parsed_dir)
+    with open(pjoin(parsed_dir, "vuotta"), "rb") as inf:
+        defns = orjson.loads(inf.read())["defns"]
+    before = count(session, tables.headword)
+    # vuosi is already in the database, so is reused rather than inserted
+    insert_defns_safe(session, "vuotta2", defns)
+    assert count(session, tables.headword) == before + 1
+
+
+def test_insert_dir_fast_load(parsed_dir, session):
+    engine = session().get_bind().engine
+    with fast_load(session, tables.metadata):
+        assert not existing_indexes(engine, tables.etymology)
+        insert_dir_inner(session, parsed_dir, commit_batches=False)
+    assert "ix_etymology_headword_id" in existing_indexes(engine, tables.etymology)
+    assert "ix_relation_parent_id" in existing_indexes(engine, tables.relation)
+    assert count(session, tables.word_sense) > 0
+    assert count(session, tables.headword_rels_count) == count(session, tables.headword)
+    assert session.execute("PRAGMA journal_mode").scalar() == "delete"
+
+
+def test_fast_load_failure_keeps_indexes(parsed_dir, session):
+    engine = session().get_bind().engine
+    with pytest.raises(RuntimeError):
+        with fast_load(session, tables.metadata):
+            insert_dir_inner(session, parsed_dir, commit_batches=False)
+            raise RuntimeError("load failed")
+    assert "ix_etymology_headword_id" in existing_indexes(engine, tables.etymology)
+    assert "ix_relation_parent_id" in existing_indexes(engine, tables.relation)
+
+
+def test_rels_counts(parsed_dir, session):
+    insert_dir_inner(session, parsed_dir)
+    counts = {
+        row[0]: row[1:] for row in session.execute(select([tables.headword_rels_count]))
+    }
+    assert len(counts) == count(session, tables.headword)
+    for headword_id, row_counts in counts.items():
+        for (_, table, col, _), row_count in zip(RELATED, row_counts):
+            assert (
+                row_count
+                == session.execute(
+                    select([func.count()])
+                    .select_from(table)
+                    .where(getattr(table.c, col) == headword_id)
+                ).scalar()
+            )
+    (voima,) = session.execute(headword_rels_counts_query(["voima"])).fetchall()
+    assert tuple(voima[1:]) == counts[get_headword_ids(session)["voima"]]
+
+
+def test_lookup_uncounted(parsed_dir, session):
+    insert_dir_inner(session, parsed_dir)
+    # As if loaded before the counts were kept
+    session.execute(tables.headword_rels_count.delete())
+    session.commit()
+    entries = lookup_lemmas(session, ["voima"])
+    assert entries["voima"]["counts"] is None
+    assert entries["voima"]["senses"]
+    refresh_rels_counts(session)
+    assert lookup_lemmas(session, ["voima"])["voima"]["counts"]["Word senses"] > 0
+
+
+def test_entries(parsed_dir, session, tmpdir):
+    insert_dir_inner(session, parsed_dir, entries=True)
+    assert count(session, tables.headword_entry) == count(session, tables.headword)
+    voima = get_entry(session, "voima")
+    assert voima["headword"] == "voima"
+    assert sorted(sense["sense_id"] for sense in voima["senses"]) == sorted(
+        sense["sense_id"]
+        for sense in lookup_lemmas(session, ["voima"])["voima"]["senses"]
+    )
+    segments = [
+        seg["headword"]
+        for ety in get_entry(session, "aivojuovio")["etymologies"]
+        for deriv in ety["derivations"]
+        for seg in deriv["segments"]
+    ]
+    assert segments
+    assert any(
+        sense["inflection_of"] and sense["inflection_of"]["lemma"] == "vuosi"
+        for sense in get_entry(session, "vuotta")["senses"]
+    )
+    assert get_entry(session, "ei sanaa") is None
+
+    compressed = get_session("sqlite:///" + str(tmpdir.join("compressed.db")))
+    tables.metadata.create_all(compressed().get_bind().engine)
+    insert_dir_inner(compressed, parsed_dir, entries=True, compress_entries=True)
+    names = ["voima", "aivojuovio", "vuosi"]
+    assert get_entries(compressed, names) == get_entries(session, names)
+    assert (
+        session.execute(
+            select([func.sum(func.length(tables.headword_entry.c.data))])
+        ).scalar()
+        > compressed.execute(
+            select([func.sum(func.length(tables.headword_entry.c.data))])
+        ).scalar()
+    )
+
+
+def test_copy_text_rows():
+    rows = [
+        {
+            "id": 1,
+            "etymology_id": 2,
+            "type": DerivationType.compound,
+            "extra": {"raw_frag": "a\tb\\c\n"},
+        },
+    ]
+    buf = copy_text_rows(tables.derivation, list(rows[0].keys()), rows)
+    assert buf.read() == '1\t2\tcompound\t{"raw_frag":"a\\\\tb\\\\\\\\c\\\\n"}\n'
+    buf = copy_text_rows(
+        tables.derived_term, ["derived_id", "disp"], [{"derived_id": None, "disp": ""}],
+    )
+    assert buf.read() == "\\N\t\n"
+
+
+def test_copy_columns():
+    # Keys in any order, some rows leaving out a column with a default
+    rows = [
+        {"redlink": True, "name": "a"},
+        {"name": "b"},
+    ]
+    columns = copy_columns(tables.headword, rows)
+    assert columns == ["name", "redlink"]
+    assert copy_text_rows(tables.headword, columns, rows).read() == "a\tt\nb\tf\n"
+    with pytest.raises(ValueError):
+        copy_columns(tables.headword, [{"name": "a", "nimi": "a"}])
+
+
+@pytest.mark.skipif(
+    "TEST_POSTGRES_URL" not in os.environ,
+    reason="Set TEST_POSTGRES_URL to a scratch PostgreSQL database to run",
+)
+def test_copy_loader_round_trip(parsed_dir, session):
+    """
+    Loading with COPY into PostgreSQL should give the same contents as
+    loading with INSERT. Drops all tables in TEST_POSTGRES_URL afterwards.
+    """
+    insert_dir_inner(session, parsed_dir)
+    pg_session = get_session(os.environ["TEST_POSTGRES_URL"])
+    engine = pg_session().get_bind().engine
+    tables.metadata.drop_all(engine)
+    tables.metadata.create_all(engine)
+    try:
+        insert_dir_inner(pg_session, parsed_dir, loader="copy")
+        assert dump_contents(pg_session) == dump_contents(session)
+    finally:
+        pg_session.close()
+        tables.metadata.drop_all(engine)
+
+
+def dump_contents(session):
+    """
+    Contents of the database with ids resolved to headword names, so two
+    databases can be compared regardless of the ids they were given.
+    """
+    queries = [
+        "select name, redlink from headword",
+        "select h.name, ws.sense_id, ws.extra, io.inflection, h2.name"
+        " from word_sense ws join headword h on h.id = ws.headword_id"
+        " left join inflection_of io on io.id = ws.inflection_of_id"
+        " left join headword h2 on h2.id = io.lemma_id",
+        "select h.name, h2.name, dt.disp from derived_term dt"
+        " join headword h on h.id = dt.headword_id"
+        " left join headword h2 on h2.id = dt.derived_id",
+        "select h.name, e.poses, d.type, h2.name, s.alt from derivation_seg s"
+        " join derivation d on d.id = s.derivation_id"
+        " join etymology e on e.id = d.etymology_id"
+        " join headword h on h.id = e.headword_id"
+        " join headword h2 on h2.id = s.derived_seg_id",
+        "select h.name, s.hash from headword_source s"
+        " join headword h on h.id = s.headword_id",
+        "select h.name, c.inflections, c.etymologies, c.derivation_segs,"
+        " c.parent_relations, c.child_relations, c.word_senses"
+        " from headword_rels_count c join headword h on h.id = c.headword_id",
+        "select name, compressed, data from headword_entry",
+    ]
+    return [
+        sorted((tuple(row) for row in session.execute(query)), key=repr)
+        for query in queries
+    ]
+
+
+def test_update_dir(parsed_dir, session, tmpdir, capsys):
+    insert_dir_inner(session, parsed_dir, entries=True)
+    ids_before = get_headword_ids(session)
+
+    new_dir = str(tmpdir.join("parsed_new"))
+    shutil.copytree(parsed_dir, new_dir)
+    os.unlink(pjoin(new_dir, "armo"))
+    with open(pjoin(new_dir, "voima"), "wb") as outf:
+        outf.write(b'{"heads": []}')
+    with open(pjoin(new_dir, "tyhja"), "wb") as outf:
+        outf.write(b'{"heads": []}')
+    with open(pjoin(new_dir, "__metadata__.json"), "wb") as outf:
+        outf.write(b'{"dump": "new"}')
+    write_parsed(new_dir, ["ammattikorkeakoulu"])
+    update_dir_inner(session, new_dir)
+    assert "2 lemmas unchanged, 3 changed or new, 1 removed" in capsys.readouterr().out
+
+    ids_after = get_headword_ids(session)
+    assert ids_after["vuotta"] == ids_before["vuotta"]
+    assert ids_after["aivojuovio"] == ids_before["aivojuovio"]
+    # Nothing was inserted from it, so it should not get a headword
+    assert "tyhja" not in ids_after
+    assert (
+        session.execute(
+            select([tables.meta.c.value]).where(tables.meta.c.key == "dump")
+        ).scalar()
+        == "new"
+    )
+
+    fresh = get_session("sqlite:///" + str(tmpdir.join("fresh.db")))
+    tables.metadata.create_all(fresh().get_bind().engine)
+    insert_dir_inner(fresh, new_dir, entries=True)
+    assert dump_contents(session) == dump_contents(fresh)
+
+
+async def http_get(reader, writer, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("latin-1"))
+    status = int((await reader.readline()).split()[1])
+    length = None
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, orjson.loads(await reader.readexactly(length))
+
+
+def test_serve(parsed_dir, tmpdir):
+    dbfn = "sqlite:///" + str(tmpdir.join("defns.db"))
+    session = get_session(dbfn)
+    tables.metadata.create_all(session().get_bind().engine)
+    insert_dir_inner(session, parsed_dir, entries=True)
+    server = LookupServer(get_engine(dbfn, pool_size=2), cache_size=2, pool_size=2)
+
+    async def run():
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = []
+        for path in [
+            "/lookup/voima",
+            "/lookup/voima",
+            "/lookup/ei%20sanaa",
+            "/entry/voima",
+        ]:
+            responses.append(await http_get(reader, writer, path))
+        stats = await http_get(reader, writer, "/stats")
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return responses, stats
+
+    try:
+        responses, (stats_status, stats) = asyncio.run(run())
+    finally:
+        server.close()
+    (
+        (status, voima),
+        (status_again, voima_again),
+        (missing_status, missing),
+        (entry_status, entry),
+    ) = responses
+    assert status == status_again == 200
+    assert voima == voima_again
+    assert voima["headword"] == "voima"
+    assert voima["counts"]["Word senses"] == len(voima["senses"]) > 0
+    assert missing_status == 404
+    assert missing["headword"] == "ei sanaa"
+    assert entry_status == 200
+    assert len(entry["senses"]) == len(voima["senses"])
+    assert stats_status == 200
+    assert stats["cache"]["hits"] == 1
+    assert stats["cache"]["misses"] == 3
+    assert stats["latency"]["hit"]["count"] == 1
+    assert stats["latency"]["miss"]["count"] == 3
+
+
+def test_lookup_batch(parsed_dir, session):
+    insert_dir_inner(session, parsed_dir)
+    lemmas = ["voima", "ei sanaa", "armo", "voima", "vuosi"]
+    results = list(lookup_lemmas_batch(session, iter(lemmas), chunk_size=2))
+    assert [lemma for lemma, _ in results] == lemmas
+    assert results[1][1] is None
+    assert results[0][1] == results[3][1] == lookup_lemmas(session, ["voima"])["voima"]
+    assert results[4][1]["counts"]["Inflections"] >= 1
+
+    outf = io.BytesIO()
+    lookup_batch(io.StringIO("voima\n\nei sanaa\n"), outf, session)
+    lines = [orjson.loads(line) for line in outf.getvalue().splitlines()]
+    assert [(line["headword"], line["found"]) for line in lines] == [
+        ("voima", True),
+        ("ei sanaa", False),
+    ]
+
+
+def test_form_index(parsed_dir, session, tmpdir):
+    path = str(tmpdir.join("forms.idx"))
+    form_lemmas = [
+        ("taloissa", FormLemma(1, "talo", {"case": "inessive", "pl": "plural"})),
+        ("taloissa", FormLemma(1, "talo", {"case": "inessive", "pl": "plural"})),
+        ("äiti", FormLemma(2, "äiti", {"case": "nominative"})),
+        ("talo", FormLemma(3, "talo", {})),
+        ("vuotta", FormLemma(4, "vuo", {"case": "abessive"})),
+        ("vuotta", FormLemma(5, "vuosi", {"case": "partitive"})),
+    ]
+    assert write_form_index(path, form_lemmas) == 4
+    with FormIndex(path) as forms:
+        assert len(forms) == 4
+        assert forms.get("taloissa") == [form_lemmas[0][1]]
+        assert forms.get("äiti") == [form_lemmas[2][1]]
+        assert [lemma.lemma for lemma in forms.get("vuotta")] == ["vuo", "vuosi"]
+        for missing in ["", "a", "talois", "taloissaa", "ö"]:
+            assert missing not in forms
+            assert forms.get(missing) == []
+
+    assert write_form_index(path, []) == 0
+    with FormIndex(path) as forms:
+        assert forms.get("talo") == []
+
+    insert_dir_inner(session, parsed_dir)
+    export_form_index(session, path)
+    with FormIndex(path) as forms:
+        assert "vuosi" in [lemma.lemma for lemma in forms.get("vuotta")]
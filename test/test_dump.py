@@ -0,0 +1,170 @@
+import bz2
+import io
+import os
+import orjson
+import pytest
+from wikiparse.multistream import find_index
+from wikiparse.parse import process_dump
+from wikiparse.utils.std import IterDirOrTar, shard_paths
+
+
+def page(title, text, ns=0):
+    return f"""
+  <page>
+    <title>{title}</title>
+    <ns>{ns}</ns>
+    <id>{abs(hash(title)) % 100000}</id>
+    <revision>
+      <id>1</id>
+      <timestamp>2020-01-01T00:00:00Z</timestamp>
+      <contributor><username>x</username><id>1</id></contributor>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text xml:space="preserve">{text}</text>
+    </revision>
+  </page>"""
+
+
+def mk_dump(pages):
+    return f"""<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wiktionary</sitename>
+    <dbname>enwiktionary</dbname>
+    <base>https://en.wiktionary.org/wiki/Wiktionary:Main_Page</base>
+    <generator>MediaWiki 1.35</generator>
+    <case>case-sensitive</case>
+    <namespaces>
+      <namespace key="0" case="case-sensitive" />
+      <namespace key="828" case="case-sensitive">Module</namespace>
+    </namespaces>
+  </siteinfo>{"".join(pages)}
+</mediawiki>
+"""
+
+
+FINNISH = "==Finnish==\n\n===Etymology===\nUnknown.\n"
+ENGLISH = "==English==\n\n===Noun===\n# A thing.\n"
+
+
+def test_process_dump_pool(tmpdir):
+    dump = mk_dump(
+        [page(f"sana{idx}", FINNISH) for idx in range(20)]
+        + [page("thing", ENGLISH), page("Module:sana", FINNISH, ns=828)]
+    )
+    outdir = str(tmpdir.join("out"))
+    process_dump(io.StringIO(dump), outdir, 2, max_pending=3)
+    assert sorted(
+        name for name in os.listdir(outdir) if not name.startswith(".")
+    ) == sorted(f"sana{idx}" for idx in range(20))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_process_dump_sharded(tmpdir, compress):
+    dump = mk_dump([page(f"sana{idx}", FINNISH) for idx in range(20)])
+    outdir = str(tmpdir.join("out"))
+    process_dump(io.StringIO(dump), outdir, 2, shards=3, compress=compress)
+    assert len(shard_paths(outdir)) == 3
+    words = IterDirOrTar(outdir)
+    assert len(words) == 20
+    results = {word: orjson.loads(wordf.read()) for word, wordf in words}
+    assert sorted(results) == sorted(f"sana{idx}" for idx in range(20))
+    assert all("heads" in result for result in results.values())
+
+
+def test_process_dump_sharded_rerun(tmpdir):
+    dump = mk_dump([page(f"sana{idx}", FINNISH) for idx in range(20)])
+    outdir = str(tmpdir.join("out"))
+    process_dump(io.StringIO(dump), outdir, 2, shards=4)
+    # Fewer shards, and compressed, so none of the old ones are overwritten
+    process_dump(io.StringIO(dump), outdir, 2, shards=2, compress=True)
+    assert sorted(name for name in os.listdir(outdir) if name.startswith("shard-")) == [
+        "shard-0000.jsonl.gz",
+        "shard-0001.jsonl.gz",
+    ]
+    words = [word for word, _ in IterDirOrTar(outdir)]
+    assert sorted(words) == sorted(f"sana{idx}" for idx in range(20))
+
+
+def mk_multistream(tmpdir, pages, per_stream=3):
+    header, footer = mk_dump(["<page>"]).split("<page>")
+    dump_path = str(tmpdir.join("enwiktionary-pages-articles-multistream.xml.bz2"))
+    index_lines = []
+    with open(dump_path, "wb") as dump:
+        dump.write(bz2.compress(header.encode("utf-8")))
+        for start in range(0, len(pages), per_stream):
+            offset = dump.tell()
+            for idx, (title, _) in enumerate(pages[start : start + per_stream]):
+                index_lines.append(f"{offset}:{start + idx}:{title}\n")
+            stream = "".join(page(*args) for args in pages[start : start + per_stream])
+            dump.write(bz2.compress(stream.encode("utf-8")))
+        dump.write(bz2.compress(footer.encode("utf-8")))
+    with bz2.open(find_index_path(dump_path), "wt") as index:
+        index.writelines(index_lines)
+    return dump_path
+
+
+def find_index_path(dump_path):
+    return dump_path.replace(".xml.bz2", "-index.txt.bz2")
+
+
+@pytest.mark.parametrize("shards", [None, 3])
+def test_process_multistream_dump(tmpdir, shards):
+    pages = [(f"sana{idx}", FINNISH) for idx in range(10)] + [
+        ("thing", ENGLISH),
+        ("sana:with:colons", FINNISH),
+    ]
+    dump_path = mk_multistream(tmpdir, pages)
+    index_path = find_index(dump_path)
+    assert index_path == find_index_path(dump_path)
+    outdir = str(tmpdir.join("out"))
+    process_dump(dump_path, outdir, 2, shards=shards, index=index_path)
+    words = IterDirOrTar(outdir)
+    expected = sorted([f"sana{idx}" for idx in range(10)] + ["sana:with:colons"])
+    assert sorted(word for word, _ in words if not word.startswith(".")) == expected
+
+
+def test_fetch_pages_by_title(tmpdir):
+    from wikiparse.title_index import build_title_index, fetch_pages
+
+    pages = [(f"sana{idx}", FINNISH + f"\n{idx}\n") for idx in range(7)] + [
+        ("thing", ENGLISH),
+        ("sana:with:colons", FINNISH),
+    ]
+    dump_path = mk_multistream(tmpdir, pages)
+    out = str(tmpdir.join("titles.sqlite"))
+    assert build_title_index(dump_path, find_index(dump_path), out, 2) == 8
+    titles = ["sana5", "thing", "sana0", "sana:with:colons", "sana4", "missing"]
+    fetched = dict(fetch_pages(dump_path, titles, out))
+    assert fetched.keys() == set(titles)
+    assert fetched["thing"] is None and fetched["missing"] is None
+    assert fetched["sana0"].endswith("\n0\n")
+    assert fetched["sana4"].endswith("\n4\n")
+    assert fetched["sana5"].endswith("\n5\n")
+    assert fetched["sana:with:colons"].startswith("==Finnish==")
+
+
+def test_process_multistream_dump_resume(tmpdir, capsys):
+    from wikiparse.checkpoint import JOURNAL_NAME
+
+    pages = [(f"sana{idx}", FINNISH) for idx in range(9)]
+    dump_path = mk_multistream(tmpdir, pages)
+    outdir = str(tmpdir.join("out"))
+    process_dump(dump_path, outdir, 2, shards=2, index=find_index(dump_path))
+    # Make it look as if the run died part way through the last stream, in
+    # the middle of writing a result
+    journal_path = os.path.join(outdir, JOURNAL_NAME)
+    with open(journal_path, "rb") as inf:
+        lines = [line for line in inf if b'"stream"' not in line]
+    with open(journal_path, "wb") as outf:
+        outf.writelines(lines[:7])
+    for path in shard_paths(outdir):
+        with open(path, "ab") as shard:
+            shard.write(b"sana8\t{")
+    capsys.readouterr()
+
+    process_dump(
+        dump_path, outdir, 2, shards=2, index=find_index(dump_path), resume=True
+    )
+    assert "Resuming with 9 pages done" in capsys.readouterr().out
+    titles = [word for word, _ in IterDirOrTar(outdir)]
+    assert sorted(titles) == sorted(title for title, _ in pages)
@@ -0,0 +1,274 @@
+import os
+import time
+import orjson
+from wikiparse.checkpoint import IN_FLIGHT_PREFIX, JOURNAL_NAME, QUARANTINE_NAME
+from wikiparse.incremental import load_manifest
+from wikiparse.parse import MIN_CHUNK_BYTES, process_pages, schedule_largest_first
+
+FINNISH = "==Finnish==\n\n===Etymology===\n{}\n"
+
+
+def write_pages(indir, pages):
+    for title, ety in pages.items():
+        with open(os.path.join(indir, title), "w") as outf:
+            outf.write(FINNISH.format(ety))
+
+
+def test_process_pages_incremental(tmpdir, capsys):
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    write_pages(indir, {"yksi": "Unknown.", "kaksi": "Unknown.", "kolme": "Unknown."})
+    process_pages(str(indir), str(outdir), processes=2)
+    assert "Reused 0 pages, reparsed 3 pages" in capsys.readouterr().out
+    manifest = load_manifest(outdir)
+    assert set(manifest.keys()) == {"yksi", "kaksi", "kolme"}
+    # Without a stats database there are no events to keep
+    assert manifest["yksi"]["events"] is None
+
+    write_pages(indir, {"kaksi": "Borrowed."})
+    os.unlink(os.path.join(indir, "kolme"))
+    process_pages(str(indir), str(outdir), processes=2, incremental=True)
+    assert "Reused 1 pages, reparsed 1 pages" in capsys.readouterr().out
+    assert set(load_manifest(outdir).keys()) == {"yksi", "kaksi"}
+    assert sorted(os.listdir(outdir)) == [
+        ".journal.jsonl",
+        ".manifest.json",
+        "kaksi",
+        "yksi",
+    ]
+
+    newdir = tmpdir.mkdir("parsed2")
+    process_pages(
+        str(indir), str(newdir), processes=2, incremental=True, prev_outdir=str(outdir)
+    )
+    assert "Reused 2 pages, reparsed 0 pages" in capsys.readouterr().out
+    assert os.path.samefile(os.path.join(outdir, "yksi"), os.path.join(newdir, "yksi"))
+
+
+def test_process_pages_incremental_stats(tmpdir, monkeypatch, capsys):
+    from wikiparse.utils import stats_log
+
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    write_pages(indir, {"yksi": "Unknown.", "kaksi": "Unknown."})
+    process_pages(str(indir), str(outdir), processes=2)
+    capsys.readouterr()
+
+    # The first run kept no events, so they cannot be replayed
+    dbfn = str(tmpdir.join("stats.db"))
+    monkeypatch.setattr(stats_log, "_stats_logger", stats_log.DbStatsLogger(dbfn))
+    process_pages(str(indir), str(outdir), processes=2, incremental=True)
+    assert "Reused 0 pages, reparsed 2 pages" in capsys.readouterr().out
+    assert load_manifest(outdir)["yksi"]["events"]
+
+    process_pages(str(indir), str(outdir), processes=2, incremental=True)
+    assert "Reused 2 pages, reparsed 0 pages" in capsys.readouterr().out
+    stats_log.get_stats_logger().flush()
+    records = list(stats_log.iter_stats_records(dbfn))
+    assert sum(record["type"] == "word_event" for record in records) == 4
+
+
+def test_process_pages_stats(tmpdir, monkeypatch):
+    from wikiparse.utils import stats_log
+
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    write_pages(indir, {f"sana{idx}": "Unknown." for idx in range(10)})
+    dbfn = str(tmpdir.join("stats.db"))
+    monkeypatch.setattr(stats_log, "_stats_logger", stats_log.DbStatsLogger(dbfn))
+    process_pages(str(indir), str(outdir), processes=2)
+    stats_log.get_stats_logger().flush()
+    records = list(stats_log.iter_stats_records(dbfn))
+    word_events = [record for record in records if record["type"] == "word_event"]
+    assert len(word_events) == 10
+    # Logged by the main process tagged with the page
+    assert all(record["page"] == record["word"] for record in word_events)
+    assert [
+        record["count"] for record in records if record["type"] == "total_count"
+    ] == [10]
+
+
+VERB = """==Finnish==
+
+===Verb===
+{{fi-verb}}
+
+# {{lb|fi|transitive|+ partitive}} to [[eat]]
+# (intransitive, + elative) to [[think]] about
+"""
+
+
+def test_process_pages_lookup_cache(tmpdir, monkeypatch):
+    from wikiparse.utils.fst import LazyFst
+    from wikiparse.utils.fst_cache import PersistentLookupCache
+
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    for title in ("syödä", "juoda", "ajatella"):
+        with open(os.path.join(indir, title), "w") as outf:
+            outf.write(VERB)
+    path = str(tmpdir.join("lookup-cache.json"))
+    cache = PersistentLookupCache(path)
+    monkeypatch.setattr(LazyFst, "lookup_cache", cache)
+    process_pages(str(indir), str(outdir), processes=2)
+    # Saves as if exiting, merging in what the workers saved
+    cache.finalizer()
+    assert not any(".worker-" in name for name in os.listdir(tmpdir))
+    assert len(cache) > 0
+
+    warm_cache = PersistentLookupCache(path)
+    warm_cache.load()
+    assert warm_cache.entries == cache.entries
+    key = next(iter(warm_cache.entries))
+    assert warm_cache.get(key) is not None
+    assert warm_cache.hits == 1
+
+    # Entries from other code are not used
+    monkeypatch.setattr("wikiparse.incremental.parser_version", lambda: "other")
+    changed_cache = PersistentLookupCache(path)
+    changed_cache.load()
+    assert len(changed_cache) == 0
+
+
+def test_lookup_cache_unknown_version(tmpdir, monkeypatch):
+    from wikiparse.utils.fst_cache import PersistentLookupCache
+
+    monkeypatch.setattr("wikiparse.incremental.fst_version", lambda: None)
+    path = str(tmpdir.join("lookup-cache.json"))
+    cache = PersistentLookupCache(path)
+    cache.load()
+    cache.put(("fst", ("token",), True), [])
+    cache.reopen()
+    assert not hasattr(cache, "finalizer")
+    assert not os.path.exists(path)
+
+
+def test_schedule_largest_first():
+    sizes = [MIN_CHUNK_BYTES * 4, 100, MIN_CHUNK_BYTES * 2] + [1000] * 500
+    chunks = schedule_largest_first([(size, idx) for idx, size in enumerate(sizes)], 4)
+    flat = [idx for chunk in chunks for idx in chunk]
+    assert sorted(flat) == list(range(len(sizes)))
+    assert [sizes[idx] for idx in flat] == sorted(sizes, reverse=True)
+    # Huge pages go first on their own, and small pages are batched
+    assert chunks[0] == [0]
+    assert chunks[1] == [2]
+    assert all(
+        sum(sizes[idx] for idx in chunk) >= MIN_CHUNK_BYTES for chunk in chunks[:-1]
+    )
+    assert len(chunks) < len(sizes) / 10
+
+
+def test_process_pages_utilisation(tmpdir, capsys):
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    write_pages(indir, {f"sana{idx}": "Unknown." * idx for idx in range(20)})
+    process_pages(str(indir), str(outdir), processes=2)
+    out = capsys.readouterr().out
+    assert "Reused 0 pages, reparsed 20 pages" in out
+    assert "Mean utilisation" in out
+    assert len(os.listdir(outdir)) == 22
+
+
+def test_process_pages_resume(tmpdir, monkeypatch, capsys):
+    from wikiparse.utils import stats_log
+
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    write_pages(indir, {f"sana{idx}": "Unknown." for idx in range(10)})
+    dbfn = str(tmpdir.join("stats.db"))
+    monkeypatch.setattr(stats_log, "_stats_logger", stats_log.DbStatsLogger(dbfn))
+    process_pages(str(indir), str(outdir), processes=2)
+    # Make it look as if the run died after finishing five pages while a
+    # worker was parsing sana9
+    journal_path = os.path.join(outdir, JOURNAL_NAME)
+    with open(journal_path, "rb") as inf:
+        lines = inf.readlines()
+    done = {orjson.loads(line)["title"] for line in lines[:5]}
+    assert "sana9" not in done
+    with open(journal_path, "wb") as outf:
+        outf.writelines(lines[:5])
+        outf.write(lines[5][:10])
+    os.unlink(os.path.join(outdir, sorted(done)[0]))
+    os.unlink(os.path.join(outdir, "sana9"))
+    with open(os.path.join(outdir, IN_FLIGHT_PREFIX + "1234"), "w") as outf:
+        outf.write("sana9")
+    capsys.readouterr()
+
+    process_pages(str(indir), str(outdir), processes=2, resume=True)
+    out = capsys.readouterr().out
+    assert "Resuming with 4 pages done and 1 quarantined" in out
+    assert "Reused 0 pages, reparsed 5 pages" in out
+    with open(os.path.join(outdir, QUARANTINE_NAME), "rb") as inf:
+        assert orjson.loads(inf.read()) == ["sana9"]
+    assert not any(name.startswith(IN_FLIGHT_PREFIX) for name in os.listdir(outdir))
+    assert sorted(
+        name for name in os.listdir(outdir) if not name.startswith(".")
+    ) == sorted(f"sana{idx}" for idx in range(9))
+    stats_log.get_stats_logger().flush()
+    records = list(stats_log.iter_stats_records(dbfn))
+    assert [
+        record["count"] for record in records if record["type"] == "total_count"
+    ] == [10]
+    # The stats of the pages parsed again are only counted once
+    assert sorted(
+        record["word"] for record in records if record["type"] == "word_event"
+    ) == sorted(f"sana{idx}" for idx in range(9))
+
+
+def test_process_pages_budget(tmpdir, monkeypatch, capsys):
+    import re
+    import wikiparse.parse
+    from wikiparse.utils import budget, stats_log
+
+    parse_page = wikiparse.parse.parse_enwiktionary_page
+
+    def pathological_parse(title, text):
+        if title == "hidas":
+            # Catastrophic backtracking stuck inside the regex engine
+            re.match(r"(a+)+$", "a" * 64 + "b")
+        elif title == "iso":
+            hog = []
+            for _ in range(1000):
+                hog.append(bytearray(1024 * 1024))
+                time.sleep(0.001)
+        elif title == "kaatuu":
+            os._exit(1)
+        return parse_page(title, text)
+
+    monkeypatch.setattr(wikiparse.parse, "parse_enwiktionary_page", pathological_parse)
+    indir = tmpdir.mkdir("pages")
+    outdir = tmpdir.mkdir("parsed")
+    titles = ["hidas", "iso", "kaatuu"] + [f"sana{idx}" for idx in range(20)]
+    write_pages(indir, {title: "Unknown." for title in titles})
+    dbfn = str(tmpdir.join("stats.db"))
+    monkeypatch.setattr(stats_log, "_stats_logger", stats_log.DbStatsLogger(dbfn))
+    budget.set_page_budget(max_seconds=1, max_rss_mb=200)
+    try:
+        process_pages(str(indir), str(outdir), processes=2)
+    finally:
+        budget.set_page_budget()
+    assert "Reused 0 pages, reparsed 23 pages (3 failed)" in capsys.readouterr().out
+    stats_log.get_stats_logger().flush()
+    word_events = [
+        record
+        for record in stats_log.iter_stats_records(dbfn)
+        if record["type"] == "word_event"
+    ]
+    # Pages of the chunks handed out again are still only counted once
+    assert sorted(record["word"] for record in word_events) == sorted(titles)
+    events = {record["word"]: record["event"] for record in word_events}
+    assert events["hidas"] == "timeout"
+    assert events["iso"] == "oom"
+    assert events["kaatuu"] == "crash"
+    assert sorted(
+        name for name in os.listdir(outdir) if not name.startswith(".")
+    ) == sorted(titles[3:])
+
+
+def test_lookup_cache_worker_lost(tmpdir, caplog):
+    from wikiparse.utils.fst_cache import PersistentLookupCache
+
+    cache = PersistentLookupCache(str(tmpdir.join("lookup-cache.json")))
+    cache.load()
+    cache.worker_lost()
+    assert "Lost the lookup cache entries of a killed worker" in caplog.text
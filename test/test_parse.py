@@ -9,7 +9,12 @@ from wikiparse.context import ParseContext
 from wikiparse.db.insert import flatten_senses
 from wikiparse.parse import parse_enwiktionary_page
 from wikiparse.parse_ety import proc_form_template
-from wikiparse.utils.wikicode import parse_nested_list
+from wikiparse.utils.wikicode import (
+    get_heading,
+    parse_nested_list,
+    slice_lang_sections,
+)
+from wikiparse.utils.fst import registry
 from wikiparse.exceptions import (
     UnknownStructureException,
     EXTRA_STRICT,
@@ -313,6 +318,42 @@ def test_stem_ending_spans_link():
     assert link.inner.form == "kohtaloksi"
 
 
+def read_lookup_partial_data():
+    with open(pjoin(cur_dir, "data", "lookup_partial.jsonl"), "rb") as inf:
+        return [orjson.loads(line) for line in inf]
+
+
+@pytest.mark.parametrize("lookup", read_lookup_partial_data())
+def test_lookup_partial_recorded(lookup):
+    """
+    Check against the outputs of the original lookup_partial, which looked
+    up prefixes with the match at start FST and then each of them with the
+    opt FST, recorded while running this module.
+    """
+    fst = registry[lookup["fst"]]
+    results = fst.lookup_partial_uncached(
+        lookup["tokens"], longest_only=lookup["longest_only"]
+    )
+    assert [[list(output), rest] for output, rest in results] == lookup["results"]
+
+
+def test_lookup_partial_cache(monkeypatch):
+    from wikiparse.utils.fst import LazyFst
+    from wikiparse.utils.fst_cache import LookupCache
+
+    cache = LookupCache(maxsize=2)
+    monkeypatch.setattr(LazyFst, "lookup_cache", cache)
+    tokens = ["transitive", "+", "partitive"]
+    expected = bit_fst.lookup_partial_uncached(tokens, longest_only=True)
+    assert bit_fst.lookup_partial(tokens, longest_only=True) == expected
+    assert bit_fst.lookup_partial(tokens, longest_only=True) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    bit_fst.lookup_partial(tokens, longest_only=False)
+    bit_fst.lookup_partial(["intransitive"], longest_only=True)
+    assert len(cache) == 2
+    assert (bit_fst.name, tuple(tokens), True) not in cache.entries
+
+
 # TODO:
 #  1. fix it so this is splits on 'in the expression'
 #  2. add test for comma ending link
@@ -341,3 +382,70 @@ def test_no_gram_for_mme():
         if tree.tree_has_gram
     ]
     assert len(results) == 0
+
+
+@pytest.mark.parametrize(
+    "text,lang",
+    [
+        ("Olin humalassa.", "fi"),
+        ("Huhu kertoo, että etsit uutta työtä.", "fi"),
+        ("Did s/he tell anything about yesterday?", "en"),
+        ("käydä", "fi"),
+        ("of", "en"),
+    ],
+)
+def test_lang_id_backends_agree(text, lang):
+    from wikiparse.utils.langid import BACKENDS
+
+    for backend_cls in BACKENDS.values():
+        assert backend_cls().detect(text) == lang
+
+
+def test_trace_selected_lemmas(tmpdir):
+    from wikiparse.utils.trace import configure_tracing, get_tracer
+
+    trace_path = str(tmpdir.join("trace.log"))
+    assert not get_tracer("wikiparse.assoc.lex").enabled
+    configure_tracing(lemmas=["kertoa"], path=trace_path)
+    try:
+        parse_enwiktionary_page("armo", read_data("armo"))
+        parse_enwiktionary_page("kertoa", read_data("kertoa"))
+    finally:
+        configure_tracing()
+    with open(trace_path) as inf:
+        lines = [line for line in inf if not line[0].isspace()]
+    assert lines
+    assert all(line.startswith("kertoa\t") for line in lines)
+    assert any("\twikiparse.assoc.lex:tokens\t" in line for line in lines)
+    assert not get_tracer("wikiparse.assoc.lex").enabled
+
+
+def full_parse_lang_sections(text):
+    parsed = parse(text, skip_style_tags=True)
+    sections = [
+        str(section)
+        for section in parsed.get_sections(levels=[2])
+        if get_heading(section) == "Finnish"
+    ]
+    return "".join(sections) or None
+
+
+@pytest.mark.parametrize(
+    "text",
+    [read_data(word) for word in sorted(os.listdir(pjoin(cur_dir, "data", "words")))]
+    + [
+        "==English==\nx\n==Finnish==\ny\n===Noun===\nz\n==Swedish==\nq\n",
+        "==Finnish== <!-- c -->\nx\n==English==\ny",
+        "==Finnish===\nx\n",
+        "==Finnish==x\ny\n",
+        "== Finnish ==\nx",
+        "=Finnish=\nx",
+        "==Finnish{{x}}==\nx\n",
+        "<!--\n==Finnish==\n-->",
+        "==Finnish==\n<nowiki>\n==English==\n</nowiki>\nz\n==Swedish==\nq",
+        "==Finnish==\n<nowiki/>\n==English==\nx",
+        "==Finnish==\na\n=Top=\nb\n==Finnish==\nc",
+    ],
+)
+def test_slice_lang_sections(text):
+    assert slice_lang_sections(text) == full_parse_lang_sections(text)
@@ -0,0 +1,43 @@
+import csv
+from collections import Counter
+import numpy as np
+from wikiparse.cmd.stats import SparseCounts
+
+
+def test_sparse_counts_csv(tmpdir):
+    counts = SparseCounts(chunk_size=3)
+    events = [
+        ("b", "got_defns"),
+        ("a", "unknown_structure"),
+        ("a", "unknown_structure / x"),
+        ("a", "unknown_structure"),
+        ("c", "defns_empty"),
+        ("b", "unknown_structure"),
+        ("a", "unknown_structure"),
+    ]
+    for word, path in events:
+        counts.add(word, path)
+    outf = str(tmpdir.join("stats.csv"))
+    weights = {"a": 0.5, "b": 0.5, "c": 1.0}
+    assert counts.write_csv(outf, weights.__getitem__) == "c"
+    with open(outf) as inf:
+        rows = list(csv.DictReader(inf))
+    assert [row["word"] for row in rows] == ["c", "b", "a"]
+    assert rows[2]["unknown_structure"] == "3"
+    assert rows[2]["unknown_structure / x"] == "1"
+    assert rows[2]["got_defns"] == ""
+    assert rows[1]["got_defns"] == "1"
+
+
+def test_sparse_counts_merge():
+    counts = SparseCounts(chunk_size=7)
+    expected: Counter = Counter()
+    for idx in range(2000):
+        word = f"w{idx * 7919 % 97}"
+        path = f"p{idx * 104729 % 13}"
+        counts.add(word, path)
+        expected[(counts.words[word] << 32) | counts.paths[path]] += 1
+    keys, key_counts = counts.merged()
+    assert list(keys) == sorted(expected)
+    assert list(key_counts) == [expected[key] for key in sorted(expected)]
+    assert key_counts.dtype == np.int64
@@ -1,13 +1,15 @@
 from typing import Optional, List, Union, Tuple
-from pprint import pprint
 
 from .models import AssocNode, PipelineResult, tree_has_gram
 from .identispan import identispan_text_rm, AssocSpan
 from ..exceptions import UnknownStructureException, ParseException, InterpretException
 from ..context import ParseContext
+from ..utils.trace import get_tracer
 
 __all__ = ["proc_assoc", "identispan_text_rm", "pipeline_span", "tree_has_gram"]
 
+trace = get_tracer(__name__)
+
 
 def is_bad_assoc(exc):
     nick = exc.log["nick"]
@@ -22,10 +24,11 @@ def pipeline_span(
     from .interpret import interpret_trees
 
     try:
-        print("pipeline_span", ctx)
+        if trace.enabled:
+            trace("pipeline_span", ctx)
         lexed = list(lex_span(ctx, span))
-        print("lexed")
-        pprint(lexed)
+        if trace.enabled:
+            trace("lexed", lexed)
         trees_iter = parse(lexed)
         interpreted_tree_iter = interpret_trees(ctx, trees_iter)
         return next(interpreted_tree_iter, (None, False))
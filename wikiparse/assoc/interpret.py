@@ -1,5 +1,6 @@
 from ..exceptions import InterpretException
 from ..context import ParseContext
+from ..utils.trace import get_tracer
 from .models import (
     AssocWord,
     AssocFrame,
@@ -18,9 +19,8 @@ from .models import (
 )
 from itertools import chain
 from typing import Callable, Optional, List, Tuple, Iterable, Iterator
-from prettyprinter import pprint, install_extras
 
-install_extras(exclude=["django", "ipython", "ipython_repr_pretty"])
+trace = get_tracer(__name__)
 
 
 def intersect_none(s1, s2):
@@ -291,19 +291,19 @@ def interpret_trees(
         if not has_gram:
             yield tree, False
             continue
-        print("PRE MERGE")
-        pprint(tree)
+        if trace.enabled:
+            trace("pre_merge", tree)
         # Step 1. Merge all AssocWordSeqs
         merged_tree = walk_merge_assoc_word_seq(tree)
-        print("merged")
-        pprint(merged_tree)
+        if trace.enabled:
+            trace("merged", merged_tree)
         # Step 1.i Find any PlusNodes with only EmptyNodes and delete them
         #  TODO: This perhaps occurs because of incorrect presidence of BarNode
         #  vs PlusNode -- an alternative would be to reparse with different
         #  precidence
         without_empty_plus = remove_empty_plusnodes(merged_tree)
-        print("without_empty_plus")
-        pprint(without_empty_plus)
+        if trace.enabled:
+            trace("without_empty_plus", without_empty_plus)
         # Step 1.ii Find any AssocWordSeqs with only simple AssocWords in them and convert to PlusNode
         synth_plus = convert_simple_asssoc_word_seq_plus(without_empty_plus)
         # Step 2. Find potential root node
@@ -327,9 +327,8 @@ def interpret_trees(
             # should use POS or inflection_bits to decide whether they get
             # merged or concatonated
         assert isinstance(root, PlusNode)
-        print("ROOT")
-        pprint(root)
-        pprint(others)
+        if trace.enabled:
+            trace("root", root, others)
         # Step 3. Merge others
         merged_others = merge_many_assoc_words(
             [
@@ -363,8 +362,8 @@ def interpret_trees(
                 if not isinstance(child, EmptyNode)
             )
         )
-        print("FINAL_ROOT")
-        pprint(final_root)
+        if trace.enabled:
+            trace("final_root", final_root)
         yield final_root, True
 
 
@@ -400,6 +399,7 @@ def flatten(node: AssocNode) -> Iterator[AssocNode]:
     elif isinstance(node, EmptyNode):
         yield AssocWord()
     else:
-        print("node", node)
+        if trace.enabled:
+            trace("node", node)
         assert isinstance(node, (AssocWord, AssocFrame))
         yield node
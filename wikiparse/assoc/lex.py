@@ -21,11 +21,15 @@ from .models import (
 from ..context import ParseContext
 from ..utils.fst import LazyFst
 from ..utils.nlp import detect_fi_en
+from ..utils.trace import get_tracer
 from ..data.gram_words import grammar_word_tokeniser
 from ..exceptions import unknown_structure
 from .identispan import AssocSpan, AssocSpanType, has_grammar_hint, has_grammar_word
 
 
+trace = get_tracer(__name__)
+
+
 def tokenise_grammar_words(bit: str) -> List[str]:
     bit_tokens = bit.split()
     return grammar_word_tokeniser.tokenize(bit_tokens)
@@ -42,8 +46,9 @@ def lex_bit_tokens(
     if not tokens:
         return
     lookup_res = fst.lookup_partial(tokens, longest_only=True)
-    print("TOKENS", tokens)
-    print("LOOKUP_RES", lookup_res)
+    if trace.enabled:
+        trace("tokens", tokens)
+        trace("lookup_res", lookup_res)
     if len(lookup_res) == 0:
         # Might be assoc -- first rule out things that can't be
         first, rest = tokens[0], tokens[1:]
@@ -63,7 +68,8 @@ def lex_bit_tokens(
     # lex_raw: Dict[str, str] = {}
     pair_iter = chunked(result, 2)
     for pair in pair_iter:
-        print("pair", pair)
+        if trace.enabled:
+            trace("pair", pair)
         assert len(pair) == 2
         tag, payload = pair
         # if tag in lex_raw and tag not in ORABLE_TAGS:
@@ -142,18 +148,20 @@ def filter_double_headword(tokens: Iterator[Token]) -> Iterator[Token]:
     saved = []
     has_sg3_headword = False
     for token in tokens:
-        print("token", token)
+        if trace.enabled:
+            trace("token", token)
         saved.append(token)
         if is_sg3_headword(token):
             has_sg3_headword = True
-    print("has_sg3_headword", has_sg3_headword)
+    if trace.enabled:
+        trace("has_sg3_headword", has_sg3_headword)
     if not has_sg3_headword:
         yield from saved
         return
     for token in saved:
-        print("token", token)
         if is_headword(token) and not is_sg3_headword(token):
-            print("unsetting", token)
+            if trace.enabled:
+                trace("unsetting", token)
             assert isinstance(token, TreeFragToken) and isinstance(
                 token.inner, AssocWord
             )
@@ -12,11 +12,11 @@ BIT = BIT SUBJ_NOM_GRAM | OBJ_NOM_GRAM | VERB_VERB_GRAM | HEADWORD_MARKER | ASSO
 Sometimes BIT can be a sequence --- if it contains ;, or if it tokenizes to multiple GRAM_WORDS
 """
 from typing import Iterator, List, Tuple, Union
-from pprint import pprint
 
 from more_itertools import peekable
 
 from ..exceptions import ParseException
+from ..utils.trace import get_tracer
 from .models import (
     Token,
     TreeFragToken,
@@ -37,6 +37,8 @@ from .models import (
 )
 
 
+trace = get_tracer(__name__)
+
 CostParseIteratorExc = Iterator[Tuple[int, Union[AssocNode, ParseException]]]
 CostParseIterator = Iterator[Tuple[int, AssocNode]]
 
@@ -151,9 +153,9 @@ def get_opt(l, idx):
 
 
 def parse_left(pos: int, lexed: List[Token], min_bp: int = 0) -> CostParseIterator:
-    print("parse_left", pos)
     tok = get_opt(lexed, pos)
-    pprint(tok)
+    if trace.enabled:
+        trace("parse_left", pos, tok)
     if tok is None or (
         isinstance(tok, BracketToken) and tok.polarity == BracketTokenPole.closer
     ):
@@ -177,7 +179,8 @@ def comb_bin(comb, left, pos, lexed, min_bp):
 
 
 def comb_poly(comb, left, pos, lexed, min_bp):
-    print("comb_poly", comb, left)
+    if trace.enabled:
+        trace("comb_poly", comb, left)
     for next_pos, right in parse_left(pos + 1, lexed, min_bp):
         children = []
         if isinstance(left, comb):
@@ -194,10 +197,9 @@ def comb_poly(comb, left, pos, lexed, min_bp):
 def parse_infix(
     left: AssocNode, pos: int, lexed: List[Token], min_bp: int = 0
 ) -> CostParseIterator:
-    print("parse_infix", pos)
-    pprint(left)
     tok = get_opt(lexed, pos)
-    pprint(tok)
+    if trace.enabled:
+        trace("parse_infix", pos, left, tok)
     if isinstance(tok, TreeFragToken):
         if isinstance(left, AssocWordSeq):
             result = AssocWordSeq(children=left.children + [tok.inner])
@@ -211,7 +213,8 @@ def parse_infix(
         yield from parse_infix(result, pos + 1, lexed, min_bp)
     elif isinstance(tok, CombToken):
         bp = infix_binding_power(tok)
-        print("bp, min_bp", bp, min_bp)
+        if trace.enabled:
+            trace("bp, min_bp", bp, min_bp)
         if bp < min_bp:
             yield pos, left
             return
@@ -0,0 +1,143 @@
+"""
+Checkpointing of parsing runs so that they can be resumed.
+
+As results come in, the main process records each finished page, and these
+records are appended to a journal in the output directory each time `sync()`
+is called. While a worker parses a page, it keeps
+the page's title in an in-flight marker file of its own, which it empties
+once the page is done. A resumed run skips the pages in the journal which
+still have valid output. Any title left in a marker was being parsed when
+the last run died, and may well be what killed it, so it is quarantined:
+it is recorded in the quarantine file and skipped by resumed runs until the
+file is deleted.
+"""
+import glob
+import os
+from os.path import join as pjoin
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import orjson
+
+# Dot-prefixed so that insert-dir skips them
+JOURNAL_NAME = ".journal.jsonl"
+QUARANTINE_NAME = ".quarantine.json"
+IN_FLIGHT_PREFIX = ".inflight.worker-"
+
+JournalRecord = Dict[str, Any]
+
+_marker_fd: Optional[int] = None
+_marker_pid: Optional[int] = None
+
+
+def in_flight_paths(outdir: str):
+    return sorted(glob.glob(pjoin(glob.escape(outdir), IN_FLIGHT_PREFIX + "*")))
+
+
+def mark_in_flight(outdir: str, title: Optional[str]):
+    """
+    Record in this worker's marker that it is parsing `title`, or if it is
+    None, that it is not parsing anything.
+    """
+    global _marker_fd, _marker_pid
+    pid = os.getpid()
+    if _marker_fd is None or _marker_pid != pid:
+        _marker_fd = os.open(
+            pjoin(outdir, f"{IN_FLIGHT_PREFIX}{pid}"), os.O_WRONLY | os.O_CREAT
+        )
+        _marker_pid = pid
+    os.ftruncate(_marker_fd, 0)
+    if title is not None:
+        os.pwrite(_marker_fd, title.encode("utf-8"), 0)
+
+
+class Checkpoint:
+    """
+    The journal of the run writing to `outdir`. Unless `resume` is set, any
+    journal, quarantine or markers left by an earlier run are removed.
+    """
+
+    def __init__(self, outdir: str, resume: bool = False):
+        self.outdir = outdir
+        self.done: Dict[str, JournalRecord] = {}
+        self.streams: Dict[int, int] = {}
+        self.quarantined: Set[str] = set()
+        self.pending: List[bytes] = []
+        os.makedirs(outdir, exist_ok=True)
+        if resume:
+            self.load()
+        else:
+            self.clear()
+        self.journal = open(pjoin(outdir, JOURNAL_NAME), "ab")
+
+    def clear(self):
+        for name in [JOURNAL_NAME, QUARANTINE_NAME]:
+            path = pjoin(self.outdir, name)
+            if os.path.exists(path):
+                os.unlink(path)
+        for path in in_flight_paths(self.outdir):
+            os.unlink(path)
+
+    def load(self):
+        quarantine_path = pjoin(self.outdir, QUARANTINE_NAME)
+        if os.path.exists(quarantine_path):
+            with open(quarantine_path, "rb") as inf:
+                self.quarantined.update(orjson.loads(inf.read()))
+        journal_path = pjoin(self.outdir, JOURNAL_NAME)
+        if os.path.exists(journal_path):
+            with open(journal_path, "rb") as inf:
+                for line in inf:
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # The last line may have been cut off
+                        continue
+                    if "stream" in record:
+                        self.streams[record["stream"]] = record["pages"]
+                    else:
+                        self.done[record["title"]] = record
+        for path in in_flight_paths(self.outdir):
+            with open(path, "rb") as inf:
+                title = inf.read().decode("utf-8")
+            if title:
+                self.quarantined.add(title)
+            os.unlink(path)
+        with open(quarantine_path, "wb") as outf:
+            outf.write(orjson.dumps(sorted(self.quarantined)))
+
+    def prune(self, is_valid: Callable[[JournalRecord], bool]):
+        """
+        Forget about finished pages for which `is_valid` says the output is
+        missing, so they are parsed again.
+        """
+        self.done = {
+            title: record for title, record in self.done.items() if is_valid(record)
+        }
+
+    def is_done(self, title: str) -> bool:
+        return title in self.done or title in self.quarantined
+
+    def record(self, title: str, output: bool, **extra):
+        record = {"title": title, "output": output, **extra}
+        self.done[title] = record
+        self.pending.append(orjson.dumps(record) + b"\n")
+
+    def record_stream(self, start: int, pages: int):
+        self.streams[start] = pages
+        self.pending.append(orjson.dumps({"stream": start, "pages": pages}) + b"\n")
+
+    def sync(self):
+        """
+        Append what has been recorded since the last call to the journal.
+        """
+        self.journal.write(b"".join(self.pending))
+        self.journal.flush()
+        self.pending = []
+
+    def close(self):
+        """
+        Close the journal after the run has finished cleanly.
+        """
+        self.sync()
+        self.journal.close()
+        for path in in_flight_paths(self.outdir):
+            os.unlink(path)
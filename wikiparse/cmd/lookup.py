@@ -1,7 +1,18 @@
 from pprint import pprint
+import sys
 import click
-from wikiparse.utils.db import get_session
+import orjson
+from wikiparse.utils.db import get_engine, get_session
+from wikiparse.db.entries import get_entries, get_entry
+from wikiparse.db.lookup import lookup_lemmas, lookup_lemmas_batch
+from wikiparse.form_index import export_form_index as export_form_index_inner
 from wikiparse.db.queries import lemma_info_query, headword_rels_counts_query, RELATED
+from wikiparse.serve import (
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_POOL_SIZE,
+    LookupServer,
+    serve as serve_lookups,
+)
 
 
 @click.group()
@@ -9,19 +20,108 @@ def lookup_group():
     pass
 
 
+def iter_lemmas(inf):
+    for line in inf:
+        lemma = line.strip()
+        if lemma:
+            yield lemma
+
+
+def lookup_batch(inf, outf, session, whole_entries=False):
+    lookup = get_entries if whole_entries else lookup_lemmas
+    for lemma, entry in lookup_lemmas_batch(session, iter_lemmas(inf), lookup=lookup):
+        if entry is None:
+            entry = {"headword": lemma, "found": False}
+        else:
+            entry = {"headword": lemma, "found": True, **entry}
+        outf.write(orjson.dumps(entry) + b"\n")
+
+
 @lookup_group.command()
-@click.argument("word")
-def lookup(word):
+@click.argument("word", required=False)
+@click.option(
+    "--batch",
+    type=click.File("r"),
+    help="Look up the lemmas in this file, one per line, or - for stdin. "
+    "Writes a JSON line per lemma, in the same order, to stdout.",
+)
+@click.option(
+    "--entry/--no-entry",
+    help="Fetch whole entries from headword_entry, filled by insert-dir "
+    "--entries, as JSON.",
+)
+def lookup(word, batch, entry):
+    if (word is None) == (batch is None):
+        raise click.UsageError("Give either WORD or --batch")
     session = get_session()
+    if batch is not None:
+        lookup_batch(batch, sys.stdout.buffer, session, whole_entries=entry)
+        return
+    if entry:
+        whole_entry = get_entry(session, word)
+        if whole_entry is None:
+            print("Not found")
+        else:
+            print(orjson.dumps(whole_entry, option=orjson.OPT_INDENT_2).decode("utf-8"))
+        return
     query = lemma_info_query([word])
     print("Counts")
+    found = False
     for row in session.execute(headword_rels_counts_query([word])):
-        if not row[0]:
-            print("Not found")
-            continue
+        found = True
         print("# " + row[0])
-        for (name, _, _), cnt in zip(RELATED, row[1:]):
+        if row[1] is None:
+            print("Not counted: run refresh-counts")
+            continue
+        for (name, *_), cnt in zip(RELATED, row[1:]):
             print(name, cnt)
+    if not found:
+        print("Not found")
     print("Senses")
     for row in session.execute(query):
         pprint(row)
+
+
+@lookup_group.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=8080)
+@click.option(
+    "--socket",
+    type=click.Path(),
+    help="Listen on this Unix socket rather than on --host and --port.",
+)
+@click.option(
+    "--cache-size",
+    type=int,
+    default=DEFAULT_CACHE_SIZE,
+    help="How many lemmas' responses to cache.",
+)
+@click.option(
+    "--pool-size",
+    type=int,
+    default=DEFAULT_POOL_SIZE,
+    help="How many database connections to keep open.",
+)
+def serve(host, port, socket, cache_size, pool_size):
+    """
+    Serve lookups over HTTP: GET /lookup/WORD for the counts and senses of a
+    lemma as JSON, GET /entry/WORD for its whole entry, if insert-dir was run
+    with --entries, and GET /stats for cache statistics and latency
+    histograms.
+    """
+    server = LookupServer(
+        get_engine(pool_size=pool_size), cache_size=cache_size, pool_size=pool_size
+    )
+    serve_lookups(server, host=host, port=port, path=socket)
+
+
+@lookup_group.command()
+@click.argument("out", type=click.Path())
+def export_form_index(out):
+    """
+    Write an index from each inflected form to the lemmas it is a form of,
+    and how it inflects them, to OUT. Read it with
+    wikiparse.form_index.FormIndex.
+    """
+    num = export_form_index_inner(get_session(), out)
+    print(f"Wrote {num} forms")
@@ -1,7 +1,7 @@
 import click
 import click_log
 import logging
-from wikiparse.utils.db import get_session
+from wikiparse.utils.db import create_tables, get_session
 
 logger = logging.getLogger(__name__)
 
@@ -22,10 +22,14 @@ def mk_cmds(get_metadata):
         pass
 
     @db.command()
-    def create():
+    @click.option(
+        "--fast-load/--no-fast-load",
+        help="Leave out secondary indexes. They are created by insert-dir --fast-load.",
+    )
+    def create(fast_load=False):
         metadata = get_metadata()
         session = get_session()
-        metadata.create_all(session().get_bind().engine)
+        create_tables(session().get_bind().engine, metadata, indexes=not fast_load)
 
     @db.command()
     def recreate():
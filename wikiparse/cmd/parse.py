@@ -2,21 +2,41 @@ import click
 import click_log
 import logging
 import orjson
+import os
 from pprint import pprint
 import subprocess
-from typing import Any, Dict, List, Optional, Tuple, TextIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TextIO
 
 from wikiparse.parse import process_dump, process_pages, parse_enwiktionary_page
+from wikiparse.multistream import find_index
+from wikiparse.db.bulk import BulkInserter, LOADERS
+from wikiparse.db.counts import refresh_rels_counts
+from wikiparse.db.entries import (
+    delete_entries,
+    entries_compressed,
+    fill_entries,
+    has_entries,
+)
+from wikiparse.db.tables import metadata
 from wikiparse.db.insert import (
+    delete_metadata,
     insert_defns,
     insert_ety_head,
-    insert_morph,
     insert_relation,
     insert_deriv,
     insert_metadata,
+    insert_source,
+    source_hash,
+)
+from wikiparse.db.update import (
+    affected_headwords,
+    delete_lemma_rows,
+    fix_headwords,
+    get_headword_ids,
+    get_source_hashes,
 )
 from wikiparse.utils.cmd import Mutex
-from wikiparse.utils.db import batch_commit, get_session
+from wikiparse.utils.db import fast_load as fast_load_ctx, get_session
 from wikiparse.utils.std import IterDirOrTar
 
 
@@ -38,6 +58,41 @@ stats_db_opt = click.option(
 )
 
 
+def set_lookup_cache(_ctx, _param, lookup_cache):
+    from wikiparse.utils.fst import LazyFst
+    from wikiparse.utils.fst_cache import PersistentLookupCache
+
+    if lookup_cache is not None:
+        LazyFst.set_lookup_cache(PersistentLookupCache(lookup_cache))
+
+
+lookup_cache_opt = click.option(
+    "--lookup-cache",
+    envvar="LOOKUP_CACHE",
+    expose_value=False,
+    callback=set_lookup_cache,
+    help="Load FST lookup results cached by earlier runs from this file and "
+    "save them back to it afterwards.",
+)
+
+
+def set_lang_id(_ctx, _param, lang_id):
+    from wikiparse.utils.langid import set_lang_id_backend
+
+    if lang_id is not None:
+        set_lang_id_backend(lang_id)
+
+
+lang_id_opt = click.option(
+    "--lang-id",
+    type=click.Choice(["fast", "langdetect"]),
+    envvar="LANG_ID",
+    expose_value=False,
+    callback=set_lang_id,
+    help="How to tell Finnish from English text. Defaults to langdetect.",
+)
+
+
 def set_mod_data_dir(_ctx, _param, mod_data):
     from wikiparse.utils.mod_data import set_jsons_path
 
@@ -74,16 +129,137 @@ fsts_dir_opt = click.option(
 )
 
 
+def split_names(names: Optional[str]) -> Optional[List[str]]:
+    if names is None:
+        return None
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def trace_opts(func):
+    from functools import wraps
+
+    @wraps(func)
+    def wrapper(*args, trace=None, trace_lemmas=None, trace_file=None, **kwargs):
+        from wikiparse.utils.trace import configure_tracing
+
+        if trace is not None or trace_lemmas is not None:
+            configure_tracing(split_names(trace), split_names(trace_lemmas), trace_file)
+        return func(*args, **kwargs)
+
+    wrapper = click.option(
+        "--trace",
+        envvar="TRACE_MODULES",
+        help="Comma separated modules or packages to trace, "
+        "e.g. wikiparse.assoc. Defaults to all when --trace-lemmas is given.",
+    )(wrapper)
+    wrapper = click.option(
+        "--trace-lemmas",
+        envvar="TRACE_LEMMAS",
+        help="Comma separated lemmas to trace. Defaults to all when --trace is given.",
+    )(wrapper)
+    return click.option(
+        "--trace-file",
+        envvar="TRACE_FILE",
+        type=click.Path(),
+        help="Append traces to this file rather than writing them to stderr.",
+    )(wrapper)
+
+
+def budget_opts(func):
+    from functools import wraps
+
+    @wraps(func)
+    def wrapper(*args, max_page_seconds=None, max_page_rss=None, **kwargs):
+        from wikiparse.utils.budget import set_page_budget
+
+        set_page_budget(max_page_seconds, max_page_rss)
+        return func(*args, **kwargs)
+
+    wrapper = click.option(
+        "--max-page-seconds",
+        type=float,
+        envvar="MAX_PAGE_SECONDS",
+        help="Abandon any page which takes longer than this to parse, "
+        "logging a timeout.",
+    )(wrapper)
+    return click.option(
+        "--max-page-rss",
+        type=int,
+        envvar="MAX_PAGE_RSS",
+        help="Abandon any page during which a worker's resident set grows by "
+        "more than this many megabytes, logging an oom.",
+    )(wrapper)
+
+
+resume_opt = click.option(
+    "--resume/--no-resume",
+    help="Carry on from where an earlier run into --outdir died, skipping the "
+    "pages it finished and any it was parsing when it died.",
+)
+
+
+def shards_opt(func):
+    func = click.option(
+        "--shards",
+        type=int,
+        help="Write output into this many shard files of newline-delimited "
+        "records rather than one file per lemma.",
+    )(func)
+    return click.option(
+        "--compress/--no-compress", help="Gzip shards when using --shards."
+    )(func)
+
+
 @parse.command()
-@click.argument("inf", type=click.File())
+@click.argument("inf", type=click.Path(allow_dash=True))
+@click.option(
+    "--index",
+    type=click.Path(exists=True),
+    help="The index of INF, a multistream bz2 dump. Found automatically "
+    "if it sits next to the dump.",
+)
 @stats_db_opt
 @mod_data_opt
 @fsts_dir_opt
+@lookup_cache_opt
+@lang_id_opt
+@trace_opts
 @click.option("--outdir")
-def parse_dump(inf, stats_db=None, outdir=None):
+@click.option("--processes", type=int)
+@shards_opt
+@resume_opt
+@budget_opts
+def parse_dump(
+    inf,
+    index=None,
+    stats_db=None,
+    outdir=None,
+    processes=None,
+    shards=None,
+    compress=False,
+    resume=False,
+):
     logging.basicConfig(filename="example.log", level=logging.DEBUG)
     # logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
-    process_dump(inf, outdir)
+    if resume and compress:
+        raise click.UsageError("--resume cannot be used with --compress")
+    if index is None and inf != "-":
+        index = find_index(inf)
+    if index is not None:
+        process_dump(
+            inf,
+            outdir,
+            processes,
+            shards=shards,
+            compress=compress,
+            index=index,
+            resume=resume,
+        )
+        return
+    with click.open_file(inf) as dump:
+        process_dump(
+            dump, outdir, processes, shards=shards, compress=compress, resume=resume
+        )
 
 
 @parse.command()
@@ -91,14 +267,47 @@ def parse_dump(inf, stats_db=None, outdir=None):
 @stats_db_opt
 @mod_data_opt
 @fsts_dir_opt
+@lookup_cache_opt
+@lang_id_opt
+@trace_opts
 @click.option("--outdir")
 @click.option("--processes", type=int)
-def parse_pages(indir, stats_db=None, outdir=None, processes=None):
-    process_pages(indir, outdir, processes)
+@click.option(
+    "--incremental/--no-incremental",
+    help="Reuse the output of pages which have not changed since the last run.",
+)
+@click.option(
+    "--prev-outdir",
+    type=click.Path(),
+    help="Output directory of the last run when using --incremental. "
+    "Defaults to --outdir.",
+)
+@shards_opt
+@resume_opt
+@budget_opts
+def parse_pages(
+    indir,
+    stats_db=None,
+    outdir=None,
+    processes=None,
+    incremental=False,
+    prev_outdir=None,
+    shards=None,
+    compress=False,
+    resume=False,
+):
+    if incremental and shards:
+        raise click.UsageError("--incremental cannot be used with --shards")
+    if resume and compress:
+        raise click.UsageError("--resume cannot be used with --compress")
+    process_pages(
+        indir, outdir, processes, incremental, prev_outdir, shards, compress, resume
+    )
 
 
 @parse.command()
 @click.argument("filename", type=click.File())
+@trace_opts
 def parse_file(filename):
     defns = parse_enwiktionary_page(filename, filename.read())
     if defns is None:
@@ -106,6 +315,108 @@ def parse_file(filename):
     pprint(defns)
 
 
+@parse.command()
+@click.argument("dump", type=click.Path(exists=True))
+@click.option(
+    "--index",
+    type=click.Path(exists=True),
+    help="The index of DUMP. Found automatically if it sits next to the dump.",
+)
+@click.option(
+    "--out", type=click.Path(), help="Defaults to DUMP with .titles.sqlite added."
+)
+@click.option("--processes", type=int)
+def index_titles(dump, index=None, out=None, processes=None):
+    """
+    Record where every Finnish page of the multistream bz2 DUMP is, so that
+    parse-title can fetch pages from it by title.
+    """
+    from wikiparse.title_index import build_title_index, default_title_index_path
+
+    if index is None:
+        index = find_index(dump)
+        if index is None:
+            raise click.UsageError("Could not find the index of DUMP, pass --index")
+    if out is None:
+        out = default_title_index_path(dump)
+    count = build_title_index(dump, index, out, processes)
+    print(f"Indexed {count} pages")
+
+
+@parse.command()
+@click.argument("dump", type=click.Path(exists=True))
+@click.argument("titles", nargs=-1)
+@click.option(
+    "--titles-file",
+    type=click.File(),
+    help="Also parse the titles in this file, one per line.",
+)
+@click.option(
+    "--title-index",
+    type=click.Path(exists=True),
+    help="Defaults to DUMP with .titles.sqlite added, as written by index-titles.",
+)
+@click.option(
+    "--outdir", help="Write results here, as parse-dump does, rather than print them."
+)
+@stats_db_opt
+@mod_data_opt
+@fsts_dir_opt
+@lookup_cache_opt
+@lang_id_opt
+@trace_opts
+def parse_title(dump, titles, titles_file=None, title_index=None, outdir=None):
+    """
+    Fetch the pages with TITLES from the multistream bz2 DUMP, which must
+    first be indexed with index-titles, and parse them.
+    """
+    from wikiparse.parse import proc_result, proc_text
+    from wikiparse.title_index import fetch_pages
+
+    titles = list(titles)
+    if titles_file is not None:
+        titles.extend(line.strip() for line in titles_file if line.strip())
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    for title, text in fetch_pages(dump, titles, title_index):
+        if text is None:
+            print(f"{title}: No Finnish page found")
+            continue
+        if outdir is not None:
+            results = proc_text(title, text)
+            if results is not None:
+                proc_result(outdir, title, results[1])
+            continue
+        defns = parse_enwiktionary_page(title, text)
+        print(f"{title}:")
+        pprint(defns)
+
+
+@parse.command()
+@mod_data_opt
+@fsts_dir_opt
+@click.argument("filenames", nargs=-1, type=click.Path(exists=True))
+def langid_agreement(filenames):
+    """
+    Parse the pages in FILENAMES with the langdetect language ID backend,
+    then compare how each backend does on the texts it was asked about.
+    """
+    import contextlib
+    import io
+    from os.path import basename
+    from wikiparse.utils.langid import compare_backends, record_lang_id_inputs
+
+    recording = record_lang_id_inputs()
+    for filename in filenames:
+        with open(filename) as inf, contextlib.redirect_stdout(io.StringIO()):
+            parse_enwiktionary_page(basename(filename), inf.read())
+    texts = list(dict.fromkeys(recording.texts))
+    for name, (agree, secs, disagreements) in compare_backends(texts).items():
+        print(f"{name}: {agree}/{len(texts)} agree with langdetect in {secs:.4f}s")
+        for text, ref, got in disagreements:
+            print(f"  {text!r}: {ref} -> {got}")
+
+
 def add_rev(metadata, key="scrape_rev"):
     try:
         rev = (
@@ -118,69 +429,137 @@ def add_rev(metadata, key="scrape_rev"):
     metadata[key] = rev
 
 
-def insert_dir_inner(db, indir: str, members: Optional[List[str]] = None):
-    headword_id_map = {}
-    all_morphs = []  # type: List[Tuple[int, Optional[Dict]]]
-    all_heads = []  # type: List[Tuple[str, Dict[str, Any]]]
-
+def insert_dir_inner(
+    db,
+    indir: str,
+    members: Optional[List[str]] = None,
+    commit_batches=True,
+    loader="insert",
+    entries=False,
+    compress_entries=False,
+):
+    inserter = LOADERS[loader](db, commit_batches=commit_batches)
     with click.progressbar(
         IterDirOrTar(indir, members), label="Inserting defns"
     ) as words:
+        insert_words(
+            db, inserter, ((lemma_name, wordf.read()) for lemma_name, wordf in words)
+        )
+    inserter.finish()
+    refresh_rels_counts(db)
+    if entries:
+        fill_entries(db, compress=compress_entries)
+    db.commit()
+
+
+def insert_words(
+    db,
+    inserter,
+    words: Iterable[Tuple[str, bytes]],
+    headword_id_map: Optional[Dict[str, int]] = None,
+    replace_metadata=False,
+):
+    """
+    Insert the parsed output in `words`, (lemma name, JSON) pairs, using
+    `inserter`. Any headwords already in `headword_id_map` are reused rather
+    than inserted.
+    """
+    if headword_id_map is None:
+        headword_id_map = {}
+    all_heads = []  # type: List[Tuple[str, Dict[str, Any]]]
 
-        def defns_batch(word_pair):
-            lemma_name, wordf = word_pair
-            # e.g. .snakemake_timestamp
-            if lemma_name.startswith("."):
-                return
-            results = orjson.loads(wordf.read())
-            if lemma_name == "__metadata__.json":
-                add_rev(results)
-                insert_metadata(db, results)
-                return
-            if "defns" in results:
-                defns = results["defns"]
-                headword_id, morphs = insert_defns(db, lemma_name, defns)
-                headword_id_map[lemma_name] = headword_id
-                all_morphs.extend(morphs)
-            if "heads" in results:
-                all_heads.extend(((lemma_name, head) for head in results["heads"]))
-
-        batch_commit(db, words, defns_batch)
-
-    with click.progressbar(all_morphs, label="Inserting inflections") as morphs:
-
-        def morph_batch(id_morph):
-            (word_sense_id, morph) = id_morph
-            insert_morph(db, word_sense_id, morph, headword_id_map)
-
-        batch_commit(db, morphs, morph_batch)
+    for lemma_name, content in words:
+        # e.g. .snakemake_timestamp
+        if lemma_name.startswith("."):
+            continue
+        results = orjson.loads(content)
+        if lemma_name == "__metadata__.json":
+            add_rev(results)
+            if replace_metadata:
+                delete_metadata(db, results.keys())
+            insert_metadata(db, results)
+            continue
+        if results.get("defns") or results.get("heads"):
+            # Only lemmas with rows of their own need their source recorded
+            insert_source(inserter, lemma_name, content, headword_id_map)
+        if "defns" in results:
+            insert_defns(inserter, lemma_name, results["defns"], headword_id_map)
+        if "heads" in results:
+            all_heads.extend(((lemma_name, head) for head in results["heads"]))
 
     all_derivs = []
 
     with click.progressbar(all_heads, label="Inserting heads") as heads:
-
-        def head_batch(lemma_head):
+        for lemma_head in heads:
             lemma, head = lemma_head
             tag = head.pop("tag")
             if tag == "etymology-heading":
-                insert_ety_head(db, lemma, head, headword_id_map)
+                insert_ety_head(inserter, lemma, head, headword_id_map)
             elif tag == "relation":
-                insert_relation(db, lemma, head, headword_id_map)
+                insert_relation(inserter, lemma, head, headword_id_map)
             elif tag == "deriv":
                 # Defer deriv since any headwords not found during insertion are treated as redlinks
                 all_derivs.append(lemma_head)
             else:
                 assert False
 
-        batch_commit(db, heads, head_batch)
-
     with click.progressbar(all_derivs, label="Inserting derivs") as derivs:
-
-        def deriv_batch(lemma_head):
-            lemma, head = lemma_head
-            insert_deriv(db, lemma, head, headword_id_map)
-
-        batch_commit(db, derivs, deriv_batch)
+        for lemma, head in derivs:
+            insert_deriv(inserter, lemma, head, headword_id_map)
+
+
+def update_dir_inner(db, indir: str):
+    headword_id_map = get_headword_ids(db)
+    prev_hashes = get_source_hashes(db)
+    changed = []
+    seen = set()
+    metadata = []
+    with click.progressbar(IterDirOrTar(indir), label="Diffing defns") as words:
+        for lemma_name, wordf in words:
+            if lemma_name.startswith("."):
+                continue
+            content = wordf.read()
+            if lemma_name == "__metadata__.json":
+                # Not a lemma, and always replaced
+                metadata.append((lemma_name, content))
+                continue
+            seen.add(lemma_name)
+            if prev_hashes.get(lemma_name) != source_hash(content):
+                changed.append((lemma_name, content))
+    changed_names = {lemma_name for lemma_name, _ in changed}
+    removed = [lemma_name for lemma_name in prev_hashes if lemma_name not in seen]
+    stale = [
+        headword_id_map[lemma_name]
+        for lemma_name in prev_hashes
+        if lemma_name in changed_names or lemma_name not in seen
+    ]
+    print(
+        "{} lemmas unchanged, {} changed or new, {} removed".format(
+            len(seen) - len(changed), len(changed), len(removed),
+        )
+    )
+    affected = affected_headwords(db, stale)
+    delete_lemma_rows(db, stale)
+    inserter = BulkInserter(db, commit_batches=False)
+    insert_words(
+        db, inserter, changed + metadata, headword_id_map, replace_metadata=True
+    )
+    inserter.finish()
+    affected |= affected_headwords(
+        db,
+        [
+            headword_id_map[lemma_name]
+            for lemma_name in changed_names
+            if lemma_name in headword_id_map
+        ],
+    )
+    names = {headword_id: name for name, headword_id in headword_id_map.items()}
+    fix_headwords(db)
+    refresh_rels_counts(db, affected)
+    if has_entries(db):
+        delete_entries(db, [names[headword_id] for headword_id in affected])
+        fill_entries(db, affected, compress=entries_compressed(db))
+    db.commit()
 
 
 def parse_filterfile(filterfile):
@@ -198,6 +577,77 @@ def parse_filterfile(filterfile):
 @parse.command()
 @click.argument("indir", type=click.Path())
 @click.argument("filterfile", type=click.File(mode="r"), required=False)
-def insert_dir(indir: str, filterfile: Optional[TextIO]):
+@click.option(
+    "--fast-load/--no-fast-load",
+    help="Defer index creation and, on SQLite, turn off journalling and syncing "
+    "while loading. Only for one-shot builds: a crash leaves a corrupt database.",
+)
+@click.option(
+    "--loader",
+    type=click.Choice(list(LOADERS.keys())),
+    default="insert",
+    help="How to write batches of rows. 'copy' uses COPY ... FROM STDIN and "
+    "needs PostgreSQL.",
+)
+@click.option(
+    "--entries/--no-entries",
+    help="Also store the whole entry of each headword as one document in "
+    "headword_entry, so it can be looked up with a single read.",
+)
+@click.option(
+    "--compress-entries/--no-compress-entries",
+    help="zlib compress the documents stored by --entries.",
+)
+def insert_dir(
+    indir: str,
+    filterfile: Optional[TextIO],
+    fast_load: bool,
+    loader: str,
+    entries: bool,
+    compress_entries: bool,
+):
     members = parse_filterfile(filterfile)
-    insert_dir_inner(get_session(), indir, members)
+    session = get_session()
+    if loader == "copy" and session.get_bind().dialect.name != "postgresql":
+        raise click.UsageError("--loader copy needs a PostgreSQL DATABASE_URL")
+    if fast_load:
+        with fast_load_ctx(session, metadata):
+            insert_dir_inner(
+                session, indir, members, commit_batches=False, loader=loader
+            )
+        # Entries are built a chunk of headwords at a time, which needs the
+        # indexes fast_load leaves out until the end
+        if entries:
+            fill_entries(session, compress=compress_entries)
+            session.commit()
+    else:
+        insert_dir_inner(
+            session,
+            indir,
+            members,
+            loader=loader,
+            entries=entries,
+            compress_entries=compress_entries,
+        )
+
+
+@parse.command()
+@click.argument("indir", type=click.Path())
+def update_dir(indir: str):
+    """
+    Update a database loaded with insert-dir to match INDIR, only replacing the
+    rows of lemmas whose parsed output has changed.
+    """
+    update_dir_inner(get_session(), indir)
+
+
+@parse.command()
+def refresh_counts():
+    """
+    Recount the rows relating to every headword into headword_rels_count, as
+    insert-dir does at the end of a load. Needed for databases loaded before
+    the counts were kept, or by an insert-dir which did not finish.
+    """
+    session = get_session()
+    refresh_rels_counts(session)
+    session.commit()
@@ -1,16 +1,24 @@
-import orjson
-from sqlitedict import SqliteDict
 import wordfreq
 from wordfreq.preprocess import preprocess_text, MULTI_DIGIT_RE
-from collections import Counter
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
 import csv
 import click
 import click_log
 from wikiparse.db.insert import insert_metadata
 from wikiparse.utils.db import get_session
+from wikiparse.utils.stats_log import iter_stats_records
 
 
+# Events logged for pages which went over their time or memory budget, or
+# which killed their worker
+BUDGET_EVENTS = ("timeout", "oom", "crash")
+
+
+@lru_cache(maxsize=None)
 def freq(word):
     if (
         word != preprocess_text(word, "fi")
@@ -22,21 +30,6 @@ def freq(word):
     return wordfreq.word_frequency(word, "fi")
 
 
-def dicts2csv(dictlist, csvfile):
-    # 1st pass: Get field names
-    fieldnames = []
-    for row in dictlist:
-        for key in row.keys():
-            if key not in fieldnames:
-                fieldnames.append(key)
-
-    # 2nd pass: Write out
-    writer = csv.DictWriter(open(csvfile, "w"), delimiter=",", fieldnames=fieldnames)
-    writer.writeheader()
-    for row in dictlist:
-        writer.writerow(row)
-
-
 def print100(df):
     with pd.option_context("display.max_rows", None, "display.max_columns", None):
         print(df[:100])
@@ -83,53 +76,142 @@ def tree_parts_from_doc(doc):
             yield (doc["event"], *nick, *doc["extra"][0])
 
 
+def merge_counts(
+    keys: np.ndarray, counts: np.ndarray, new_keys: np.ndarray, new_counts: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge two runs of sorted, unique keys and their counts into one, in time
+    linear in their sizes.
+    """
+    pos = np.searchsorted(keys, new_keys)
+    found = np.zeros(len(new_keys), dtype=bool)
+    in_range = pos < len(keys)
+    found[in_range] = keys[pos[in_range]] == new_keys[in_range]
+    np.add.at(counts, pos[found], new_counts[found])
+    added = ~found
+    return (
+        np.insert(keys, pos[added], new_keys[added]),
+        np.insert(counts, pos[added], new_counts[added]),
+    )
+
+
+class SparseCounts:
+    """
+    Counts of (word, event path) pairs. Words and paths are interned to
+    integer ids and the counts are kept as sorted sparse arrays of packed
+    (word id, path id) keys. New occurrences are sorted a chunk at a time
+    into a run, and runs of about the same size are merged, as in a
+    log-structured merge tree, so each key is only merged O(log n) times.
+    """
+
+    def __init__(self, chunk_size=1000000):
+        self.words: Dict[str, int] = {}
+        self.paths: Dict[str, int] = {}
+        self.chunk_size = chunk_size
+        self.pending = array("Q")
+        # Sorted (keys, counts) runs, from largest to smallest
+        self.runs: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    @staticmethod
+    def intern(table: Dict[str, int], key: str) -> int:
+        key_id = table.get(key)
+        if key_id is None:
+            key_id = len(table)
+            table[key] = key_id
+        return key_id
+
+    def add(self, word: str, path: str):
+        word_id = self.intern(self.words, word)
+        path_id = self.intern(self.paths, path)
+        self.pending.append((word_id << 32) | path_id)
+        if len(self.pending) >= self.chunk_size:
+            self.compact()
+
+    def compact(self):
+        if not len(self.pending):
+            return
+        keys, counts = np.unique(
+            np.frombuffer(self.pending, dtype=np.uint64), return_counts=True
+        )
+        self.runs.append((keys, counts.astype(np.int64)))
+        self.pending = array("Q")
+        while len(self.runs) >= 2:
+            (prev_keys, _), (last_keys, _) = self.runs[-2:]
+            if len(prev_keys) > 2 * len(last_keys):
+                break
+            self.merge_last_runs()
+
+    def merge_last_runs(self):
+        new_keys, new_counts = self.runs.pop()
+        keys, counts = self.runs.pop()
+        self.runs.append(merge_counts(keys, counts, new_keys, new_counts))
+
+    def merged(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All the counts as one sorted run.
+        """
+        self.compact()
+        while len(self.runs) >= 2:
+            self.merge_last_runs()
+        if not self.runs:
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        return self.runs[0]
+
+    def write_csv(self, outf, weight):
+        """
+        Write out one row per word, ordered by `weight(word)` descending.
+        """
+        keys, counts = self.merged()
+        words = list(self.words)
+        weights = np.array([weight(word) for word in words], dtype=np.float64)
+        key_words = (keys >> np.uint64(32)).astype(np.int64)
+        key_paths = (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        starts = np.searchsorted(key_words, np.arange(len(words)), side="left")
+        ends = np.searchsorted(key_words, np.arange(len(words)), side="right")
+        with open(outf, "w") as csvf:
+            writer = csv.writer(csvf)
+            writer.writerow(["word", "wf", *self.paths])
+            for word_id in np.argsort(-weights, kind="stable"):
+                row = [""] * len(self.paths)
+                for idx in range(starts[word_id], ends[word_id]):
+                    row[key_paths[idx]] = counts[idx]
+                writer.writerow([words[word_id], weights[word_id], *row])
+        return words[np.argmax(weights)] if words else None
+
+
 @stats.command()
 @click.argument("inf")
 @click.argument("outf")
 def parse_stats_agg(inf, outf):
-    word_rows = {}
+    counts = SparseCounts()
     total_count = 0
     unknown_pos_titles = set()
-    print("Loading into counters")
-    with SqliteDict(
-        inf, encode=orjson.dumps, decode=orjson.loads, journal_mode="WAL"
-    ) as db:
-        for doc in db.values():
-            if doc["type"] == "word_event":
-                word = doc["word"]
-                if word not in word_rows:
-                    word_rows[word] = Counter()
-                row = word_rows[word]
-
-                for bits in tree_parts_from_doc(doc):
-                    row[" / ".join(bits)] += 1
-
-            elif doc["type"] == "total_count":
-                total_count += doc["count"]
-            elif doc["type"] == "unknown_pos_title":
-                unknown_pos_titles.add(doc["title"])
-            else:
-                assert False
-    print("Loaded into counters")
-
-    print("Rejiggling")
-    sorted_word_rows = []
-    for word, word_row in word_rows.items():
-        new_word_row = {"word": word, "wf": freq(word)}
-        new_word_row.update(word_row)
-        sorted_word_rows.append(new_word_row)
-    print("Done regjiggling")
-
-    print("Sorting")
-    sorted_word_rows.sort(key=lambda row: row["wf"], reverse=True)
-    print("Sorted")
+    abandoned: Dict[str, int] = {event: 0 for event in BUDGET_EVENTS}
+    print("Counting")
+    for doc in iter_stats_records(inf):
+        if doc["type"] == "word_event":
+            word = doc["word"]
+            if doc["event"] in abandoned:
+                abandoned[doc["event"]] += 1
+            for bits in tree_parts_from_doc(doc):
+                counts.add(word, " / ".join(bits))
+        elif doc["type"] == "total_count":
+            total_count += doc["count"]
+        elif doc["type"] == "unknown_pos_title":
+            unknown_pos_titles.add(doc["title"])
+        else:
+            assert False
+    print("Counted")
 
     print("Total count", total_count)
     print("Unknown POS titles", unknown_pos_titles)
-    print("Rows", len(sorted_word_rows))
-    print("First", sorted_word_rows[0])
+    print("Abandoned pages", abandoned)
+    print("Rows", len(counts.words))
+    print("Columns", len(counts.paths))
 
-    dicts2csv(sorted_word_rows, outf)
+    print("Writing")
+    first = counts.write_csv(outf, freq)
+    print("First", first)
 
 
 @stats.command()
@@ -0,0 +1,174 @@
+"""
+Buffered, batched insertion for loading parsed output into the database.
+
+Primary keys are handed out client-side, starting after the current maximum
+id of each table, so that dependent rows can be built without a round-trip
+per parent row. This means an inserter needs the database to itself: any
+other writer to the same tables while it runs could be handed the same ids.
+
+Rows are buffered per table and written with one `executemany` per table per
+batch, in foreign key order. On PostgreSQL, `CopyInserter` streams each batch
+through `COPY ... FROM STDIN` instead.
+"""
+import enum
+from io import StringIO
+from typing import Any, Dict, List, Set
+
+import orjson
+from sqlalchemy import Boolean, Enum, JSON, Table
+from sqlalchemy.sql import func, select
+
+from .tables import metadata
+
+
+class BulkInserter:
+    def __init__(self, session, batch_size=10000, commit_batches=True):
+        self.session = session
+        self.batch_size = batch_size
+        self.commit_batches = commit_batches
+        self.next_ids: Dict[Table, int] = {}
+        self.buffers: Dict[Table, List[Dict[str, Any]]] = {}
+        self.buffered = 0
+
+    def _next_id(self, table: Table) -> int:
+        if table not in self.next_ids:
+            max_id = self.session.execute(select([func.max(table.c.id)])).scalar()
+            self.next_ids[table] = (max_id or 0) + 1
+        next_id = self.next_ids[table]
+        self.next_ids[table] = next_id + 1
+        return next_id
+
+    def insert(self, table: Table, **row):
+        self.buffers.setdefault(table, []).append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def insert_get_id(self, table: Table, **row) -> int:
+        row_id = self._next_id(table)
+        self.insert(table, id=row_id, **row)
+        return row_id
+
+    def _write(self, table: Table, rows: List[Dict[str, Any]]):
+        self.session.execute(table.insert(), rows)
+
+    def flush(self):
+        for table in metadata.sorted_tables:
+            rows = self.buffers.pop(table, None)
+            if rows:
+                self._write(table, rows)
+        assert not self.buffers, "Got rows for tables outside of metadata"
+        self.buffered = 0
+        if self.commit_batches:
+            self.session.commit()
+
+    def _fix_sequences(self):
+        """
+        Since ids were given out client-side, any server-side sequences need
+        to be moved past them.
+        """
+        if self.session.get_bind().dialect.name != "postgresql":
+            return
+        for table, next_id in self.next_ids.items():
+            self.session.execute(
+                "SELECT setval(pg_get_serial_sequence(:table, 'id'), :last_id)",
+                {"table": table.name, "last_id": next_id - 1},
+            )
+
+    def finish(self):
+        self.flush()
+        self._fix_sequences()
+        self.session.commit()
+
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def copy_text_value(column, value) -> str:
+    """
+    Format `value` for `column` as a field in PostgreSQL's COPY text format.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(column.type, JSON):
+        value = orjson.dumps(value).decode("utf-8")
+    elif isinstance(column.type, Enum) and isinstance(value, enum.Enum):
+        value = value.name
+    elif isinstance(column.type, Boolean):
+        value = "t" if value else "f"
+    else:
+        value = str(value)
+    return value.translate(COPY_ESCAPES)
+
+
+def copy_columns(table: Table, rows: List[Dict[str, Any]]) -> List[str]:
+    """
+    The columns of `table` to COPY `rows` into, in the order they are
+    defined: those given in any of the rows. Others, such as serial ids, are
+    left to the database.
+    """
+    given: Set[str] = set()
+    for row in rows:
+        given.update(row.keys())
+    unknown = given - set(table.c.keys())
+    if unknown:
+        raise ValueError(f"Unknown columns for {table.name}: {sorted(unknown)}")
+    return [column.name for column in table.columns if column.name in given]
+
+
+def column_default(column) -> Any:
+    default = column.default
+    if default is not None and default.is_scalar:
+        return default.arg
+    return None
+
+
+def copy_text_rows(table: Table, columns: List[str], rows: List[Dict[str, Any]]):
+    table_columns = [table.c[name] for name in columns]
+    buf = StringIO()
+    for row in rows:
+        buf.write(
+            "\t".join(
+                copy_text_value(
+                    column,
+                    row[column.name] if column.name in row else column_default(column),
+                )
+                for column in table_columns
+            )
+        )
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+
+class CopyInserter(BulkInserter):
+    """
+    A BulkInserter for PostgreSQL (psycopg2) which writes each batch with
+    `COPY ... FROM STDIN` rather than `INSERT`.
+    """
+
+    def __init__(self, session, *args, **kwargs):
+        dialect = session.get_bind().dialect.name
+        if dialect != "postgresql":
+            raise ValueError(f"CopyInserter needs PostgreSQL, not {dialect}")
+        super().__init__(session, *args, **kwargs)
+
+    def _write(self, table: Table, rows: List[Dict[str, Any]]):
+        columns = copy_columns(table, rows)
+        buf = copy_text_rows(table, columns, rows)
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN".format(
+                    table.name, ", ".join(f'"{name}"' for name in columns)
+                ),
+                buf,
+            )
+        finally:
+            cursor.close()
+
+
+LOADERS = {
+    "insert": BulkInserter,
+    "copy": CopyInserter,
+}
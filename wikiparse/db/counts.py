@@ -0,0 +1,75 @@
+"""
+The precomputed per-headword relation counts in `headword_rels_count`.
+
+Counting the rows which refer to a headword by outer joining all of the
+related tables at once multiplies them together before they are counted.
+Instead, each table is counted separately with a GROUP BY, which needs no
+indexes, so it can run at the end of a fast load. After an update, only the
+counts of the headwords which the changed rows referred to are refreshed.
+"""
+from typing import Iterable, Optional
+
+from more_itertools import chunked
+from sqlalchemy.sql import func, select
+
+from .queries import RELATED
+from .tables import (
+    headword,
+    headword_rels_count,
+)
+
+# Each headword id is bound once per related table and once more, so this
+# keeps within SQLite's limit of 999 parameters
+REFRESH_CHUNK_SIZE = 100
+
+
+def rels_counts_select(headword_ids: Optional[Iterable[int]] = None):
+    """
+    Select rows for `headword_rels_count`, for all headwords or for just
+    `headword_ids`.
+    """
+    if headword_ids is not None:
+        headword_ids = list(headword_ids)
+    from_clause = headword
+    count_cols = []
+    for _, table, col, _ in RELATED:
+        ref = getattr(table.c, col)
+        grouped = select([ref.label("headword_id"), func.count().label("cnt")])
+        if headword_ids is not None:
+            grouped = grouped.where(ref.in_(headword_ids))
+        grouped = grouped.group_by(ref).alias()
+        from_clause = from_clause.outerjoin(
+            grouped, grouped.c.headword_id == headword.c.id
+        )
+        count_cols.append(func.coalesce(grouped.c.cnt, 0))
+    query = select([headword.c.id] + count_cols).select_from(from_clause)
+    if headword_ids is not None:
+        query = query.where(headword.c.id.in_(headword_ids))
+    return query
+
+
+def insert_rels_counts(session, headword_ids: Optional[Iterable[int]] = None):
+    session.execute(
+        headword_rels_count.insert().from_select(
+            [headword_rels_count.c.headword_id]
+            + [count_col for _, _, _, count_col in RELATED],
+            rels_counts_select(headword_ids),
+        )
+    )
+
+
+def refresh_rels_counts(session, headword_ids: Optional[Iterable[int]] = None):
+    """
+    Recount the related rows of `headword_ids`, or of every headword.
+    """
+    if headword_ids is None:
+        session.execute(headword_rels_count.delete())
+        insert_rels_counts(session)
+        return
+    for chunk in chunked(sorted(headword_ids), REFRESH_CHUNK_SIZE):
+        session.execute(
+            headword_rels_count.delete().where(
+                headword_rels_count.c.headword_id.in_(chunk)
+            )
+        )
+        insert_rels_counts(session, chunk)
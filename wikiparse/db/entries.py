@@ -0,0 +1,294 @@
+"""
+Whole headword entries, denormalised into one document per headword in
+`headword_entry`.
+
+Rebuilding an entry takes a join for each kind of row which hangs off a
+headword. Since serving lemmas only ever needs whole entries, `insert-dir
+--entries` builds them all once the load is done, a chunk of headwords at a
+time, and stores each as orjson, optionally zlib compressed, under the
+headword's name. `get_entry` then fetches one with a single primary key read.
+"""
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from more_itertools import chunked
+from sqlalchemy.sql import exists, or_, select
+
+from .tables import (
+    headword,
+    headword_entry,
+    derivation,
+    derivation_seg,
+    derived_term,
+    etymology,
+    inflection_of,
+    relation,
+    word_sense,
+)
+
+# Relations bind each headword id twice, so this keeps within SQLite's limit
+# of 999 parameters
+ENTRY_CHUNK_SIZE = 400
+
+Entry = Dict[str, Any]
+
+
+def encode_entry(entry: Entry, compress: bool) -> bytes:
+    data = orjson.dumps(entry)
+    if compress:
+        data = zlib.compress(data)
+    return data
+
+
+def decode_entry(data: bytes, compressed: bool) -> Entry:
+    if compressed:
+        data = zlib.decompress(data)
+    return orjson.loads(data)
+
+
+def build_entries(session, headword_ids: List[int]) -> Dict[int, Entry]:
+    """
+    Build the entries of `headword_ids` with one query per kind of row.
+    """
+    entries: Dict[int, Entry] = {}
+    for headword_id, name, redlink in session.execute(
+        select([headword]).where(headword.c.id.in_(headword_ids))
+    ):
+        entries[headword_id] = {
+            "headword": name,
+            "redlink": bool(redlink),
+            "senses": [],
+            "etymologies": [],
+            "relations": [],
+            "derived_terms": [],
+        }
+
+    lemma = headword.alias()
+    for row in session.execute(
+        select(
+            [
+                word_sense.c.headword_id,
+                word_sense.c.sense_id,
+                word_sense.c.pos,
+                word_sense.c.etymology_index,
+                word_sense.c.sense,
+                word_sense.c.extra,
+                lemma.c.name,
+                inflection_of.c.inflection,
+            ]
+        )
+        .select_from(
+            word_sense.outerjoin(
+                inflection_of, word_sense.c.inflection_of_id == inflection_of.c.id
+            ).outerjoin(lemma, lemma.c.id == inflection_of.c.lemma_id)
+        )
+        .where(word_sense.c.headword_id.in_(headword_ids))
+        .order_by(word_sense.c.id)
+    ):
+        headword_id, sense_id, pos, ety_idx, sense, extra, lemma_name, inflection = row
+        entries[headword_id]["senses"].append(
+            {
+                "sense_id": sense_id,
+                "pos": pos,
+                "etymology_index": ety_idx,
+                "sense": sense,
+                "extra": extra,
+                "inflection_of": (
+                    {"lemma": lemma_name, "inflection": inflection}
+                    if lemma_name is not None
+                    else None
+                ),
+            }
+        )
+
+    etymologies: Dict[int, Entry] = {}
+    for ety_id, ety_idx, headword_id, poses in session.execute(
+        select([etymology])
+        .where(etymology.c.headword_id.in_(headword_ids))
+        .order_by(etymology.c.id)
+    ):
+        ety = {"etymology_index": ety_idx, "poses": poses, "derivations": []}
+        etymologies[ety_id] = ety
+        entries[headword_id]["etymologies"].append(ety)
+
+    derivations: Dict[int, Entry] = {}
+    segs_by_deriv: Dict[int, List[Entry]] = defaultdict(list)
+    seg_headword = headword.alias()
+    for deriv_id, ety_id, deriv_type, extra, seg_name, alt in session.execute(
+        select(
+            [
+                derivation.c.id,
+                derivation.c.etymology_id,
+                derivation.c.type,
+                derivation.c.extra,
+                seg_headword.c.name,
+                derivation_seg.c.alt,
+            ]
+        )
+        .select_from(
+            derivation.join(etymology, etymology.c.id == derivation.c.etymology_id)
+            .outerjoin(
+                derivation_seg, derivation_seg.c.derivation_id == derivation.c.id
+            )
+            .outerjoin(
+                seg_headword, seg_headword.c.id == derivation_seg.c.derived_seg_id
+            )
+        )
+        .where(etymology.c.headword_id.in_(headword_ids))
+        .order_by(derivation.c.id, derivation_seg.c.id)
+    ):
+        if deriv_id not in derivations:
+            deriv = {
+                "type": deriv_type.name,
+                "extra": extra,
+                "segments": segs_by_deriv[deriv_id],
+            }
+            derivations[deriv_id] = deriv
+            etymologies[ety_id]["derivations"].append(deriv)
+        if seg_name is not None:
+            segs_by_deriv[deriv_id].append({"headword": seg_name, "alt": alt})
+
+    parent = headword.alias()
+    child = headword.alias()
+    for (
+        parent_id,
+        child_id,
+        parent_name,
+        child_name,
+        rel_type,
+        extra,
+    ) in session.execute(
+        select(
+            [
+                relation.c.parent_id,
+                relation.c.child_id,
+                parent.c.name,
+                child.c.name,
+                relation.c.type,
+                relation.c.extra,
+            ]
+        )
+        .select_from(
+            relation.join(parent, parent.c.id == relation.c.parent_id).join(
+                child, child.c.id == relation.c.child_id
+            )
+        )
+        .where(
+            or_(
+                relation.c.parent_id.in_(headword_ids),
+                relation.c.child_id.in_(headword_ids),
+            )
+        )
+        # Rather than by id, which an update may change for some but not all
+        .order_by(parent.c.name, child.c.name, relation.c.id)
+    ):
+        rel = {
+            "type": rel_type.name,
+            "parent": parent_name,
+            "child": child_name,
+            "extra": extra,
+        }
+        for headword_id in {parent_id, child_id}:
+            if headword_id in entries:
+                entries[headword_id]["relations"].append(rel)
+
+    derived = headword.alias()
+    for headword_id, derived_name, disp, gloss, extra in session.execute(
+        select(
+            [
+                derived_term.c.headword_id,
+                derived.c.name,
+                derived_term.c.disp,
+                derived_term.c.gloss,
+                derived_term.c.extra,
+            ]
+        )
+        .select_from(
+            derived_term.outerjoin(derived, derived.c.id == derived_term.c.derived_id)
+        )
+        .where(derived_term.c.headword_id.in_(headword_ids))
+        .order_by(derived_term.c.id)
+    ):
+        entries[headword_id]["derived_terms"].append(
+            {"link": derived_name, "disp": disp, "gloss": gloss, "extra": extra}
+        )
+    return entries
+
+
+def fill_entries(
+    session, headword_ids: Optional[Iterable[int]] = None, compress: bool = False
+):
+    """
+    Build and insert the entries of `headword_ids`, or of every headword,
+    replacing any they already have.
+    """
+    if headword_ids is None:
+        session.execute(headword_entry.delete())
+        headword_ids = [
+            headword_id for headword_id, in session.execute(select([headword.c.id]))
+        ]
+    for chunk in chunked(sorted(headword_ids), ENTRY_CHUNK_SIZE):
+        entries = build_entries(session, chunk)
+        names = [entry["headword"] for entry in entries.values()]
+        if not names:
+            continue
+        session.execute(headword_entry.delete().where(headword_entry.c.name.in_(names)))
+        session.execute(
+            headword_entry.insert(),
+            [
+                {
+                    "name": entry["headword"],
+                    "compressed": compress,
+                    "data": encode_entry(entry, compress),
+                }
+                for entry in entries.values()
+            ],
+        )
+
+
+def has_entries(session) -> bool:
+    return session.execute(select([exists().select_from(headword_entry)])).scalar()
+
+
+def entries_compressed(session) -> bool:
+    """
+    Whether the stored entries are compressed, so updates can match them.
+    """
+    return bool(
+        session.execute(select([headword_entry.c.compressed]).limit(1)).scalar()
+    )
+
+
+def delete_entries(session, names: Iterable[str]):
+    for chunk in chunked(names, ENTRY_CHUNK_SIZE):
+        session.execute(headword_entry.delete().where(headword_entry.c.name.in_(chunk)))
+
+
+def get_entry(conn, name: str) -> Optional[Entry]:
+    """
+    The whole entry of the headword `name`, or None if it has none.
+    """
+    row = conn.execute(
+        select([headword_entry.c.compressed, headword_entry.c.data]).where(
+            headword_entry.c.name == name
+        )
+    ).fetchone()
+    if row is None:
+        return None
+    compressed, data = row
+    return decode_entry(data, compressed)
+
+
+def get_entries(conn, names: List[str]) -> Dict[str, Entry]:
+    """
+    The entries of those of `names` which have one, keyed by name, read in
+    one query. Keep `names` within the backend's limit on bound parameters.
+    """
+    return {
+        name: decode_entry(data, compressed)
+        for name, compressed, data in conn.execute(
+            select([headword_entry]).where(headword_entry.c.name.in_(names))
+        )
+    }
@@ -1,6 +1,9 @@
+import hashlib
 from . import tables
-from wikiparse.utils.db import insert_get_id, insert
-from typing import cast, Dict, List, Optional, TypeVar, Tuple, Iterator
+from .bulk import BulkInserter
+from .update import get_headword_ids
+from wikiparse.utils.db import insert
+from typing import cast, Dict, List, TypeVar, Tuple, Iterator
 from ..models import DictTree2L, DerivationType, RelationType
 from ..parse import get_ety_idx
 
@@ -35,21 +38,27 @@ def flatten_senses(
 
 
 def insert_defns(
-    session, lemma_name: str, defns: DictTree2L[List[Dict]]
-) -> Tuple[int, List[Tuple[int, Optional[Dict]]]]:
-    morphs = []  # type: List[Tuple[int, Optional[Dict]]]
-    headword_id = insert_get_id(session, tables.headword, name=lemma_name)
+    inserter, lemma_name: str, defns: DictTree2L[List[Dict]], headword_id_map
+) -> int:
+    headword_id = ensure_lemma(inserter, lemma_name, headword_id_map)
     for full_id, ety, pos, sense in flatten_senses(
         defns
     ):  # type: Tuple[str, int, str, Dict]
         stripped_defn = sense["stripped_defn"]
-        sense.pop("bi_examples", {})
-        sense.pop("fi_examples", {})
+        # Rows are written later, so leave the nested senses untouched
+        sense = {
+            k: v for k, v in sense.items() if k not in ("bi_examples", "fi_examples")
+        }
 
-        word_sense_id = insert_get_id(
-            session,
+        morph = sense.get("morph")
+        if morph and morph.get("type") == "form":
+            inflection_of_id = insert_morph(inserter, morph, headword_id_map)
+        else:
+            inflection_of_id = None
+
+        inserter.insert(
             tables.word_sense,
-            inflection_of_id=None,
+            inflection_of_id=inflection_of_id,
             headword_id=headword_id,
             etymology_index=ety,
             pos=pos,
@@ -58,40 +67,32 @@ def insert_defns(
             extra=sense,
         )
 
-        morph = sense.get("morph")
-        if morph and morph.get("type") == "form":
-            morphs.append((word_sense_id, morph))
-
-    return headword_id, morphs
+    return headword_id
 
 
-def ensure_lemma(session, lemma, headword_id_map, *, redlink=False):
+def ensure_lemma(inserter, lemma, headword_id_map, *, redlink=False):
     if lemma in headword_id_map:
         lemma_id = headword_id_map[lemma]
     else:
-        lemma_id = insert_get_id(session, tables.headword, name=lemma, redlink=redlink)
+        lemma_id = inserter.insert_get_id(tables.headword, name=lemma, redlink=redlink)
         headword_id_map[lemma] = lemma_id
     return lemma_id
 
 
-def insert_morph(session, word_sense_id, morph, headword_id_map):
+def insert_morph(inserter, morph, headword_id_map) -> int:
+    # Copy since the original is still referenced from word_sense.extra
+    morph = dict(morph)
     morph.pop("type")
     lemma = morph.pop("lemma")
-    lemma_id = ensure_lemma(session, lemma, headword_id_map)
-    inflection_of_id = insert_get_id(
-        session, tables.inflection_of, lemma_id=lemma_id, inflection=morph
-    )
-    session.execute(
-        tables.word_sense.update()
-        .where(tables.word_sense.c.id == word_sense_id)
-        .values(inflection_of_id=inflection_of_id)
+    lemma_id = ensure_lemma(inserter, lemma, headword_id_map)
+    return inserter.insert_get_id(
+        tables.inflection_of, lemma_id=lemma_id, inflection=morph
     )
 
 
-def insert_ety_head(session, lemma: str, ety_head, headword_id_map):
-    lemma_id = ensure_lemma(session, lemma, headword_id_map)
-    ety_head_id = insert_get_id(
-        session,
+def insert_ety_head(inserter, lemma: str, ety_head, headword_id_map):
+    lemma_id = ensure_lemma(inserter, lemma, headword_id_map)
+    ety_head_id = inserter.insert_get_id(
         tables.etymology,
         etymology_index=ety_head.pop("ety_idx"),
         headword_id=lemma_id,
@@ -99,17 +100,15 @@ def insert_ety_head(session, lemma: str, ety_head, headword_id_map):
     )
     etys = ety_head.pop("etys")
     for ety in etys:
-        derivation_id = insert_get_id(
-            session,
+        derivation_id = inserter.insert_get_id(
             tables.derivation,
             etymology_id=ety_head_id,
             type=DerivationType(ety.pop("type")),
             extra={"raw_frag": ety.pop("raw_frag")},
         )
         for bit in ety.pop("bits"):
-            child_lemma_id = ensure_lemma(session, bit["headword"], headword_id_map)
-            insert(
-                session,
+            child_lemma_id = ensure_lemma(inserter, bit["headword"], headword_id_map)
+            inserter.insert(
                 tables.derivation_seg,
                 derivation_id=derivation_id,
                 derived_seg_id=child_lemma_id,
@@ -117,11 +116,10 @@ def insert_ety_head(session, lemma: str, ety_head, headword_id_map):
             )
 
 
-def insert_relation(session, lemma: str, rel, headword_id_map):
-    lemma_id = ensure_lemma(session, lemma, headword_id_map)
-    parent_lemma_id = ensure_lemma(session, rel.pop("parent"), headword_id_map)
-    insert(
-        session,
+def insert_relation(inserter, lemma: str, rel, headword_id_map):
+    lemma_id = ensure_lemma(inserter, lemma, headword_id_map)
+    parent_lemma_id = ensure_lemma(inserter, rel.pop("parent"), headword_id_map)
+    inserter.insert(
         tables.relation,
         parent_id=parent_lemma_id,
         child_id=lemma_id,
@@ -130,15 +128,14 @@ def insert_relation(session, lemma: str, rel, headword_id_map):
     )
 
 
-def insert_deriv(session, lemma: str, deriv, headword_id_map):
-    lemma_id = ensure_lemma(session, lemma, headword_id_map)
+def insert_deriv(inserter, lemma: str, deriv, headword_id_map):
+    lemma_id = ensure_lemma(inserter, lemma, headword_id_map)
     link = deriv.get("link")
     if link is not None:
-        child_lemma_id = ensure_lemma(session, link, headword_id_map, redlink=True)
+        child_lemma_id = ensure_lemma(inserter, link, headword_id_map, redlink=True)
     else:
         child_lemma_id = None
-    insert(
-        session,
+    inserter.insert(
         tables.derived_term,
         headword_id=lemma_id,
         derived_id=child_lemma_id,
@@ -149,13 +146,29 @@ def insert_deriv(session, lemma: str, deriv, headword_id_map):
 
 
 def insert_defns_safe(session, lemma_name: str, defns: DictTree2L[List[Dict]]):
+    inserter = BulkInserter(session)
     try:
-        insert_defns(session, lemma_name, defns)
+        insert_defns(inserter, lemma_name, defns, get_headword_ids(session))
+        inserter.finish()
     except BaseException:
         session.rollback()
         raise
-    else:
-        session.commit()
+
+
+def source_hash(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+def insert_source(inserter, lemma_name: str, content: bytes, headword_id_map):
+    inserter.insert(
+        tables.headword_source,
+        headword_id=ensure_lemma(inserter, lemma_name, headword_id_map),
+        hash=source_hash(content),
+    )
+
+
+def delete_metadata(session, keys, table=tables.meta):
+    session.execute(table.delete().where(table.c.key.in_(list(keys))))
 
 
 def insert_metadata(session, metadata, table=tables.meta):
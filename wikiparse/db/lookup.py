@@ -0,0 +1,76 @@
+"""
+Lookups of whole lemmas: how many rows relate to each headword, and its word
+senses.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from more_itertools import chunked
+
+from .queries import (
+    RELATED,
+    WORD_SENSE_COLS,
+    prepared_headword_rels_counts_query,
+    prepared_lemma_info_query,
+)
+
+LemmaEntry = Dict[str, Any]
+
+# Most bound parameters to use in one statement on each backend. SQLite
+# before 3.32 takes at most 999 and the PostgreSQL protocol 65535. psycopg2
+# interpolates parameters itself, but this still keeps statements to a
+# sensible size.
+MAX_PARAMS = {"sqlite": 999, "postgresql": 32767}
+DEFAULT_MAX_PARAMS = 999
+
+# Plain strings since orjson will not take the str subclass SQLAlchemy uses
+WORD_SENSE_NAMES = [str(col.name) for col in WORD_SENSE_COLS]
+
+
+def lookup_lemmas(conn, lemmas: List[str]) -> Dict[str, LemmaEntry]:
+    """
+    Look up `lemmas` using `conn`, which may be a connection or a session,
+    with one query for the counts and one for the senses. Returns the entries
+    of those which were found keyed by headword name. The counts of a
+    headword are None if it has not been counted.
+    """
+    entries: Dict[str, LemmaEntry] = {}
+    if not lemmas:
+        return entries
+    for row in conn.execute(prepared_headword_rels_counts_query, {"lemmas": lemmas}):
+        counts = None
+        if row[1] is not None:
+            counts = {name: cnt for (name, *_), cnt in zip(RELATED, row[1:])}
+        entries[row[0]] = {"headword": row[0], "counts": counts, "senses": []}
+    for row in conn.execute(prepared_lemma_info_query, {"lemmas": lemmas}):
+        entries[row[0]]["senses"].append(dict(zip(WORD_SENSE_NAMES, row[1:])))
+    return entries
+
+
+def max_lemmas_per_query(conn) -> int:
+    """
+    How many lemmas fit into the IN (...) of one lookup query on the backend
+    of `conn`.
+    """
+    dialect = conn.get_bind().dialect if hasattr(conn, "get_bind") else conn.dialect
+    return MAX_PARAMS.get(dialect.name, DEFAULT_MAX_PARAMS)
+
+
+def lookup_lemmas_batch(
+    conn,
+    lemmas: Iterable[str],
+    chunk_size: Optional[int] = None,
+    lookup: Callable[[Any, List[str]], Dict[str, LemmaEntry]] = lookup_lemmas,
+) -> Iterator[Tuple[str, Optional[LemmaEntry]]]:
+    """
+    Look up `lemmas` in chunks of `chunk_size`, by default as many as the
+    backend takes in one query, yielding (lemma, entry) pairs in the order of
+    `lemmas`, where entry is None if the lemma was not found. Lemmas are only
+    read from `lemmas` one chunk at a time. Each chunk is looked up with
+    `lookup`, which could also be `wikiparse.db.entries.get_entries`.
+    """
+    if chunk_size is None:
+        chunk_size = max_lemmas_per_query(conn)
+    for chunk in chunked(lemmas, chunk_size):
+        entries = lookup(conn, list(dict.fromkeys(chunk)))
+        for lemma in chunk:
+            yield lemma, entries.get(lemma)
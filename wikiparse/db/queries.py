@@ -1,5 +1,4 @@
-from sqlalchemy.sql import func
-from sqlalchemy.sql import select, literal
+from sqlalchemy.sql import bindparam, select, literal
 from .tables import (
     headword,
     word_sense,
@@ -7,6 +6,7 @@ from .tables import (
     etymology,
     derivation_seg,
     relation,
+    headword_rels_count,
 )
 
 WORD_SENSE_COLS = [
@@ -17,13 +17,25 @@ WORD_SENSE_COLS = [
     word_sense.c.extra,
 ]
 
+# Name, table, column referencing the headword, and column of
+# headword_rels_count holding the count of rows referencing it
 RELATED = [
-    ("Inflections", inflection_of, "lemma_id"),
-    ("Etymologies", etymology, "headword_id"),
-    ("Segment in derivations", derivation_seg, "derived_seg_id"),
-    ("Parent of relation", relation, "parent_id"),
-    ("Child of relation", relation, "child_id"),
-    ("Word senses", word_sense, "headword_id"),
+    ("Inflections", inflection_of, "lemma_id", headword_rels_count.c.inflections),
+    ("Etymologies", etymology, "headword_id", headword_rels_count.c.etymologies),
+    (
+        "Segment in derivations",
+        derivation_seg,
+        "derived_seg_id",
+        headword_rels_count.c.derivation_segs,
+    ),
+    (
+        "Parent of relation",
+        relation,
+        "parent_id",
+        headword_rels_count.c.parent_relations,
+    ),
+    ("Child of relation", relation, "child_id", headword_rels_count.c.child_relations),
+    ("Word senses", word_sense, "headword_id", headword_rels_count.c.word_senses),
 ]
 
 
@@ -47,20 +59,24 @@ def lemma_info_query(lemmas):
 
 
 def headword_rels_counts_query(lemmas):
-    aliases = []
-    for name, table, col in RELATED:
-        table_alias = table.alias()
-        col_alias = getattr(table_alias.c, col)
-        aliases.append((table_alias, col_alias))
-    select_cols = [
-        headword.c.name,
-    ]
-    for table_alias, col_alias in aliases:
-        select_cols.append(func.count(col_alias))
-    from_clause = headword
-    for (name, table, col), (table_alias, col_alias) in zip(RELATED, aliases):
-        from_clause = from_clause.outerjoin(table_alias, col_alias == headword.c.id)
-    query = (
-        select(select_cols).select_from(from_clause).where(headword.c.name.in_(lemmas))
+    """
+    The counts of the headwords `lemmas`. They are NULL for any headword
+    which has not been counted by `refresh_rels_counts(...)`.
+    """
+    return (
+        select([headword.c.name] + [count_col for _, _, _, count_col in RELATED])
+        .select_from(
+            headword.outerjoin(
+                headword_rels_count, headword_rels_count.c.headword_id == headword.c.id
+            )
+        )
+        .where(headword.c.name.in_(lemmas))
     )
-    return query
+
+
+# Versions of the lookup queries with the lemmas as an expanding bind
+# parameter, so they are built and, with a compiled cache, compiled only once.
+# Execute them with {"lemmas": [...]}.
+LEMMAS_PARAM = bindparam("lemmas", expanding=True)
+prepared_lemma_info_query = lemma_info_query(LEMMAS_PARAM)
+prepared_headword_rels_counts_query = headword_rels_counts_query(LEMMAS_PARAM)
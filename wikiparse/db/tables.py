@@ -8,6 +8,7 @@ from sqlalchemy import (
     MetaData,
     Table,
     Boolean,
+    LargeBinary,
 )
 from ..enums import DerivationType, RelationType
 
@@ -22,11 +23,20 @@ headword = Table(
     Column("redlink", Boolean, default=False),
 )
 
+# Hash of the parsed output each headword's own rows were inserted from, so
+# that update-dir can tell which have changed
+headword_source = Table(
+    "headword_source",
+    metadata,
+    Column("headword_id", Integer, ForeignKey("headword.id"), primary_key=True),
+    Column("hash", String, nullable=False),
+)
+
 inflection_of = Table(
     "inflection_of",
     metadata,
     Column("id", Integer, primary_key=True),
-    Column("lemma_id", Integer, ForeignKey("headword.id"), nullable=False),
+    Column("lemma_id", Integer, ForeignKey("headword.id"), nullable=False, index=True),
     Column("inflection", JSON, nullable=False),
 )
 
@@ -63,7 +73,9 @@ derivation_seg = Table(
         nullable=False,
         index=True,
     ),
-    Column("derived_seg_id", Integer, ForeignKey("headword.id"), nullable=False),
+    Column(
+        "derived_seg_id", Integer, ForeignKey("headword.id"), nullable=False, index=True
+    ),
     Column("alt", String),
 )
 
@@ -71,8 +83,8 @@ relation = Table(
     "relation",
     metadata,
     Column("id", Integer, primary_key=True),
-    Column("parent_id", Integer, ForeignKey("headword.id"), nullable=False),
-    Column("child_id", Integer, ForeignKey("headword.id"), nullable=False),
+    Column("parent_id", Integer, ForeignKey("headword.id"), nullable=False, index=True),
+    Column("child_id", Integer, ForeignKey("headword.id"), nullable=False, index=True),
     Column("type", Enum(RelationType), nullable=False),
     Column("extra", JSON, nullable=False),
 )
@@ -81,7 +93,9 @@ derived_term = Table(
     "derived_term",
     metadata,
     Column("id", Integer, primary_key=True),
-    Column("headword_id", Integer, ForeignKey("headword.id"), nullable=False),
+    Column(
+        "headword_id", Integer, ForeignKey("headword.id"), nullable=False, index=True
+    ),
     Column("derived_id", Integer, ForeignKey("headword.id"), nullable=True),
     Column("disp", String, nullable=False),
     Column("gloss", String, nullable=False),
@@ -93,7 +107,9 @@ word_sense = Table(
     metadata,
     Column("id", Integer, primary_key=True),
     Column("inflection_of_id", Integer, ForeignKey("inflection_of.id"), nullable=True),
-    Column("headword_id", Integer, ForeignKey("headword.id"), nullable=False),
+    Column(
+        "headword_id", Integer, ForeignKey("headword.id"), nullable=False, index=True
+    ),
     Column("etymology_index", Integer, nullable=True),
     Column("pos", String, nullable=False),
     Column("sense", String, nullable=False),
@@ -101,6 +117,30 @@ word_sense = Table(
     Column("extra", JSON, nullable=False),
 )
 
+# How many rows of each kind relate to each headword, kept up to date by
+# insert-dir and update-dir, so they need not be counted at lookup time
+headword_rels_count = Table(
+    "headword_rels_count",
+    metadata,
+    Column("headword_id", Integer, ForeignKey("headword.id"), primary_key=True),
+    Column("inflections", Integer, nullable=False),
+    Column("etymologies", Integer, nullable=False),
+    Column("derivation_segs", Integer, nullable=False),
+    Column("parent_relations", Integer, nullable=False),
+    Column("child_relations", Integer, nullable=False),
+    Column("word_senses", Integer, nullable=False),
+)
+
+# Optional whole entry of each headword as orjson, which may be zlib
+# compressed, filled by insert-dir --entries
+headword_entry = Table(
+    "headword_entry",
+    metadata,
+    Column("name", String, primary_key=True),
+    Column("compressed", Boolean, nullable=False),
+    Column("data", LargeBinary, nullable=False),
+)
+
 usage_example = Table(
     "usage_example",
     metadata,
@@ -0,0 +1,168 @@
+"""
+Updating a loaded database in place from a newer parsed output directory.
+"""
+from typing import Dict, Iterable, List, Set
+
+from more_itertools import chunked
+from sqlalchemy.sql import and_, exists, not_, or_, select
+
+from .tables import (
+    headword,
+    headword_source,
+    headword_rels_count,
+    inflection_of,
+    etymology,
+    derivation,
+    derivation_seg,
+    relation,
+    derived_term,
+    word_sense,
+)
+
+# Every reference to a headword other than as the target of a derived term
+# link. A headword with none of these is a redlink.
+HEADWORD_REFS = [
+    headword_source.c.headword_id,
+    word_sense.c.headword_id,
+    inflection_of.c.lemma_id,
+    etymology.c.headword_id,
+    derivation_seg.c.derived_seg_id,
+    relation.c.parent_id,
+    relation.c.child_id,
+    derived_term.c.headword_id,
+]
+
+DELETE_CHUNK_SIZE = 500
+
+
+def get_headword_ids(session) -> Dict[str, int]:
+    return {
+        name: headword_id
+        for name, headword_id in session.execute(
+            select([headword.c.name, headword.c.id])
+        )
+    }
+
+
+def get_source_hashes(session) -> Dict[str, str]:
+    return {
+        name: source_hash
+        for name, source_hash in session.execute(
+            select([headword.c.name, headword_source.c.hash]).select_from(
+                headword.join(
+                    headword_source, headword_source.c.headword_id == headword.c.id
+                )
+            )
+        )
+    }
+
+
+def delete_lemma_rows(session, headword_ids: List[int]):
+    """
+    Delete all rows which were inserted from the parsed output of the
+    headwords `headword_ids`, leaving the headword rows themselves.
+    """
+    for chunk in chunked(headword_ids, DELETE_CHUNK_SIZE):
+        ety_ids = select([etymology.c.id]).where(etymology.c.headword_id.in_(chunk))
+        deriv_ids = select([derivation.c.id]).where(
+            derivation.c.etymology_id.in_(ety_ids)
+        )
+        session.execute(
+            derivation_seg.delete().where(derivation_seg.c.derivation_id.in_(deriv_ids))
+        )
+        session.execute(
+            derivation.delete().where(derivation.c.etymology_id.in_(ety_ids))
+        )
+        session.execute(etymology.delete().where(etymology.c.headword_id.in_(chunk)))
+        inflection_of_ids = [
+            inflection_of_id
+            for inflection_of_id, in session.execute(
+                select([word_sense.c.inflection_of_id]).where(
+                    and_(
+                        word_sense.c.headword_id.in_(chunk),
+                        word_sense.c.inflection_of_id.isnot(None),
+                    )
+                )
+            )
+        ]
+        session.execute(word_sense.delete().where(word_sense.c.headword_id.in_(chunk)))
+        for inflection_of_chunk in chunked(inflection_of_ids, DELETE_CHUNK_SIZE):
+            session.execute(
+                inflection_of.delete().where(
+                    inflection_of.c.id.in_(inflection_of_chunk)
+                )
+            )
+        session.execute(relation.delete().where(relation.c.child_id.in_(chunk)))
+        session.execute(
+            derived_term.delete().where(derived_term.c.headword_id.in_(chunk))
+        )
+        session.execute(
+            headword_source.delete().where(headword_source.c.headword_id.in_(chunk))
+        )
+
+
+def fix_headwords(session):
+    """
+    Bring the redlink flags in line with what a fresh load would give, and
+    delete headwords which are no longer referenced at all.
+    """
+    referenced = or_(*(exists().where(col == headword.c.id) for col in HEADWORD_REFS))
+    linked = exists().where(derived_term.c.derived_id == headword.c.id)
+    session.execute(
+        headword.update()
+        .where(and_(headword.c.redlink, referenced))
+        .values(redlink=False)
+    )
+    session.execute(
+        headword.update()
+        .where(and_(not_(headword.c.redlink), not_(referenced), linked))
+        .values(redlink=True)
+    )
+    unused = and_(not_(referenced), not_(linked))
+    session.execute(
+        headword_rels_count.delete().where(
+            headword_rels_count.c.headword_id.in_(select([headword.c.id]).where(unused))
+        )
+    )
+    session.execute(headword.delete().where(unused))
+
+
+def affected_headwords(session, headword_ids: Iterable[int]) -> Set[int]:
+    """
+    The headwords whose counts, entries or redlink flags depend upon the rows
+    inserted from the parsed output of `headword_ids`: those headwords
+    themselves, and the lemmas, derivation segments, relation parents and
+    derived terms those rows refer to.
+    """
+    affected = set(headword_ids)
+    for chunk in chunked(sorted(affected), DELETE_CHUNK_SIZE):
+        queries = [
+            select([inflection_of.c.lemma_id]).select_from(
+                word_sense.join(
+                    inflection_of, word_sense.c.inflection_of_id == inflection_of.c.id
+                )
+            ),
+            select([derivation_seg.c.derived_seg_id]).select_from(
+                etymology.join(
+                    derivation, derivation.c.etymology_id == etymology.c.id
+                ).join(
+                    derivation_seg, derivation_seg.c.derivation_id == derivation.c.id
+                )
+            ),
+            select([relation.c.parent_id]),
+            select([derived_term.c.derived_id]).where(
+                derived_term.c.derived_id.isnot(None)
+            ),
+        ]
+        owners = [
+            word_sense.c.headword_id,
+            etymology.c.headword_id,
+            relation.c.child_id,
+            derived_term.c.headword_id,
+        ]
+        for query, owner in zip(queries, owners):
+            affected.update(
+                headword_id
+                for headword_id, in session.execute(query.where(owner.in_(chunk)))
+            )
+    return affected
@@ -0,0 +1,168 @@
+"""
+A read-only index from inflected forms to the lemmas they are forms of, for
+lemmatising in-process without a database.
+
+The index is a sorted string table which is memory-mapped and searched by
+bisection, so opening it is instant and lookups only touch the pages they
+need. The file is laid out as:
+
+    magic                  8 bytes
+    number of forms n      uint64
+    key offsets            (n + 1) x uint64
+    value offsets          (n + 1) x uint64
+    keys                   The forms as UTF-8, sorted bytewise
+    values                 orjson [[lemma id, lemma, inflection], ...]
+
+All integers are little-endian and all offsets are from the start of the
+file.
+"""
+import mmap
+import os
+import struct
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import orjson
+from sqlalchemy.sql import select
+
+from .db.tables import headword, inflection_of, word_sense
+
+MAGIC = b"WPFORMS1"
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+# An item's offset and the next, which is where it ends
+SPAN = struct.Struct("<QQ")
+
+
+class FormLemma(NamedTuple):
+    lemma_id: int
+    lemma: str
+    inflection: Dict
+
+
+def iter_form_lemmas(session) -> Iterable[Tuple[str, FormLemma]]:
+    form = headword.alias()
+    lemma = headword.alias()
+    for form_name, lemma_id, lemma_name, inflection in session.execute(
+        select(
+            [form.c.name, lemma.c.id, lemma.c.name, inflection_of.c.inflection]
+        ).select_from(
+            word_sense.join(
+                inflection_of, word_sense.c.inflection_of_id == inflection_of.c.id
+            )
+            .join(form, form.c.id == word_sense.c.headword_id)
+            .join(lemma, lemma.c.id == inflection_of.c.lemma_id)
+        )
+    ):
+        yield form_name, FormLemma(lemma_id, lemma_name, inflection)
+
+
+def write_form_index(path: str, form_lemmas: Iterable[Tuple[str, FormLemma]]) -> int:
+    """
+    Write the (form, FormLemma) pairs of `form_lemmas` into a form index at
+    `path`, leaving out duplicates. Returns the number of forms.
+    """
+    by_form: Dict[bytes, List[FormLemma]] = defaultdict(list)
+    for form, form_lemma in form_lemmas:
+        analyses = by_form[form.encode("utf-8")]
+        if form_lemma not in analyses:
+            analyses.append(form_lemma)
+    keys = sorted(by_form)
+    values = [
+        orjson.dumps([list(form_lemma) for form_lemma in by_form[key]]) for key in keys
+    ]
+    num = len(keys)
+    pos = HEADER.size + 2 * (num + 1) * OFFSET.size
+    key_offsets = [pos]
+    for key in keys:
+        pos += len(key)
+        key_offsets.append(pos)
+    value_offsets = [pos]
+    for value in values:
+        pos += len(value)
+        value_offsets.append(pos)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as outf:
+        outf.write(HEADER.pack(MAGIC, num))
+        for offset in key_offsets + value_offsets:
+            outf.write(OFFSET.pack(offset))
+        for key in keys:
+            outf.write(key)
+        for value in values:
+            outf.write(value)
+    os.replace(tmp_path, path)
+    return num
+
+
+def export_form_index(session, path: str) -> int:
+    return write_form_index(path, iter_form_lemmas(session))
+
+
+class FormIndex:
+    """
+    Reader for a form index written by `write_form_index`.
+
+        >>> with FormIndex("forms.idx") as forms:
+        ...     forms.get("taloissa")
+        [FormLemma(lemma_id=..., lemma='talo', inflection={...})]
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as inf:
+            self.mm = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path} is not a form index")
+        self.key_offsets = HEADER.size
+        self.value_offsets = self.key_offsets + (self.num + 1) * OFFSET.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.num
+
+    def _item(self, table: int, idx: int) -> bytes:
+        start, end = SPAN.unpack_from(self.mm, table + idx * OFFSET.size)
+        return self.mm[start:end]
+
+    def _find(self, form: str) -> int:
+        """
+        The position of `form` among the keys, or -1 if it is not there.
+        """
+        key = form.encode("utf-8")
+        lo = 0
+        hi = self.num
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._item(self.key_offsets, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num and self._item(self.key_offsets, lo) == key:
+            return lo
+        return -1
+
+    def __contains__(self, form: str) -> bool:
+        return self._find(form) != -1
+
+    def get(self, form: str) -> List[FormLemma]:
+        """
+        The lemmas `form` is a form of, and how it inflects them, which is
+        empty if it is not in the index.
+        """
+        idx = self._find(form)
+        if idx == -1:
+            return []
+        value = self._item(self.value_offsets, idx)
+        return [
+            FormLemma(lemma_id, lemma, inflection)
+            for lemma_id, lemma, inflection in orjson.loads(value)
+        ]
@@ -0,0 +1,98 @@
+"""
+Support for incremental parsing runs.
+
+Each output directory can contain a manifest mapping page titles to the hash
+of the page's wikitext together with the versions of the parser and FSTs
+which produced its output. A later run can then reuse the output of any page
+for which none of these has changed instead of parsing it again.
+"""
+import hashlib
+import os
+from os.path import join as pjoin
+from shutil import copyfile
+from typing import Any, Dict, Iterable, Optional
+
+import orjson
+
+from wikiparse.utils.json import dumps
+
+# Dot-prefixed so that insert-dir skips it
+MANIFEST_NAME = ".manifest.json"
+
+Manifest = Dict[str, Dict[str, Any]]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def hash_files(paths: Iterable[str]) -> str:
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as inf:
+            digest.update(inf.read())
+    return digest.hexdigest()
+
+
+def parser_version() -> str:
+    """
+    Hash of the Python source of the wikiparse package.
+    """
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+    for dirpath, _dirnames, filenames in os.walk(pkg_dir):
+        for filename in filenames:
+            if filename.endswith(".py"):
+                paths.append(pjoin(dirpath, filename))
+    return hash_files(paths)
+
+
+def fst_version() -> Optional[str]:
+    """
+    Hash of the compiled FSTs if they are being loaded from a directory, or
+    otherwise of the module data they will be built from.
+    """
+    from wikiparse.utils.fst import LazyFst
+    from wikiparse.utils import mod_data
+
+    if LazyFst.fst_dir is not None:
+        data_dir = LazyFst.fst_dir
+        suffix = ".fst"
+    elif mod_data.jsons_path is not None:
+        data_dir = mod_data.jsons_path
+        suffix = ".json"
+    else:
+        return None
+    return hash_files(
+        pjoin(data_dir, filename)
+        for filename in os.listdir(data_dir)
+        if filename.endswith(suffix)
+    )
+
+
+def load_manifest(outdir: str) -> Manifest:
+    path = pjoin(outdir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as inf:
+        return orjson.loads(inf.read())
+
+
+def save_manifest(outdir: str, manifest: Manifest):
+    path = pjoin(outdir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as outf:
+        outf.write(dumps(manifest))
+    os.replace(tmp_path, path)
+
+
+def link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        copyfile(src, dst)
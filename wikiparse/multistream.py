@@ -0,0 +1,89 @@
+"""
+Reading of Wikimedia's multistream bz2 dumps.
+
+A `*-multistream.xml.bz2` dump is a concatenation of independent bz2 streams.
+The first holds the <siteinfo> header and each of the others (usually) 100
+pages. The accompanying `*-multistream-index.txt.bz2` has one
+`offset:page_id:title` line per page giving the byte offset of the stream
+which holds it, so streams can be decompressed and scanned independently.
+"""
+import bz2
+import os
+from typing import List, Optional, Tuple
+
+MULTISTREAM_SUFFIX = "-multistream.xml.bz2"
+INDEX_SUFFIX = "-multistream-index.txt.bz2"
+READ_SIZE = 1024 * 1024
+
+
+def find_index(dump_path: str) -> Optional[str]:
+    """
+    The path of the index which sits next to the multistream dump
+    `dump_path`, or None if it is not a multistream dump or has no index.
+    """
+    if not dump_path.endswith(MULTISTREAM_SUFFIX):
+        return None
+    index_path = dump_path[: -len(MULTISTREAM_SUFFIX)] + INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        return None
+    return index_path
+
+
+def read_stream_offsets(index_path: str) -> List[int]:
+    offsets = set()
+    with bz2.open(index_path, "rb") as index:
+        for line in index:
+            offset, _ = line.split(b":", 1)
+            offsets.add(int(offset))
+    return sorted(offsets)
+
+
+def stream_ranges(offsets: List[int], size: int) -> List[Tuple[int, int]]:
+    """
+    The (start, end) byte ranges of the indexed streams of a dump of `size`
+    bytes. The last range runs to the end of the file, so also takes in the
+    unindexed stream which closes the <mediawiki> element.
+    """
+    return list(zip(offsets, offsets[1:] + [size]))
+
+
+def read_range(dump_path: str, start: int, end: int) -> str:
+    with open(dump_path, "rb") as dump:
+        dump.seek(start)
+        data = dump.read(end - start)
+    # Decompresses every stream in the range
+    return bz2.decompress(data).decode("utf-8")
+
+
+def read_header(dump_path: str) -> str:
+    """
+    The opening <mediawiki> tag and <siteinfo> element from the first stream
+    of a multistream dump.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    chunks = []
+    with open(dump_path, "rb") as dump:
+        while not decompressor.eof:
+            data = dump.read(READ_SIZE)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+    text = b"".join(chunks).decode("utf-8")
+    end = text.find("</siteinfo>")
+    if end == -1:
+        raise ValueError(f"No <siteinfo> in the first stream of {dump_path}")
+    return text[: end + len("</siteinfo>")]
+
+
+def wrap_pages(header: str, text: str) -> str:
+    """
+    Make a complete dump document, which can be read with mwxml, out of the
+    <page> elements of the decompressed stream `text`.
+    """
+    start = text.find("<page>")
+    end = text.rfind("</page>")
+    if start == -1 or end == -1:
+        pages = ""
+    else:
+        pages = text[start : end + len("</page>")]
+    return header + "\n" + pages + "\n</mediawiki>\n"
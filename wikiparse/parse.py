@@ -2,24 +2,41 @@ from __future__ import annotations
 
 # from parsepred.monkeypatch_multiprocessing import do_monkeypatch
 # do_monkeypatch()
+import io
 import logging
+from abc import ABC, abstractmethod
 import os
 import sys
+import time
 import tblib.pickling_support
 from mwparserfromhell import parse
 from mwparserfromhell.wikicode import Wikicode
 from langdetect import DetectorFactory
 import traceback
+from collections import Counter
 from os import makedirs
 from os.path import join as pjoin
 from typing import Any, Dict, List, Union, Tuple, Iterator, Optional
 from mwxml.iteration import Dump, page as mwxml_iteration_page
-from multiprocessing import Pool
+from multiprocessing import cpu_count
 from shutil import copyfile
 
-from wikiparse.utils.wikicode import get_heading, get_lead, parse_nested_list
-from wikiparse.utils.stats_log import get_stats_logger
+from wikiparse.utils.wikicode import (
+    get_heading,
+    get_lead,
+    parse_nested_list,
+    slice_lang_sections,
+)
+from wikiparse.utils.stats_log import (
+    get_stats_logger,
+    recording_stats_logger,
+    stats_logging_enabled,
+)
 from wikiparse.utils.json import dumps
+from wikiparse.utils.std import ShardWriter
+from wikiparse.utils.fst import LazyFst, preload_fsts
+from wikiparse.utils.trace import get_tracer, set_trace_lemma
+from wikiparse.utils.worker_pool import WorkerPool, page_started, skip_page
 
 from .context import ParseContext
 from .data.gram_words import POS
@@ -32,11 +49,29 @@ from .exceptions import (
     UnknownStructureException,
     get_exception_filter,
 )
+from .incremental import (
+    content_hash,
+    fst_version,
+    link_or_copy,
+    load_manifest,
+    parser_version,
+    save_manifest,
+)
+from .checkpoint import Checkpoint, mark_in_flight
+from .multistream import (
+    read_header,
+    read_range,
+    read_stream_offsets,
+    stream_ranges,
+    wrap_pages,
+)
 from .utils.iter import orelse
 
 tblib.pickling_support.install()
 DetectorFactory.seed = 0
 
+trace = get_tracer(__name__)
+
 
 def get_ety_idx(etymology):
     return int(etymology.split(" ")[-1])
@@ -129,7 +164,9 @@ def handle_etymology_sections(
 def parse_enwiktionary_page(
     lemma: str, content: str, skip_ety: bool = False
 ) -> Tuple[Dict, List[Any]]:
-    parsed = parse(content, skip_style_tags=True)
+    set_trace_lemma(lemma)
+    # Only the Finnish section gets used so don't parse the rest
+    parsed = parse(slice_lang_sections(content) or "", skip_style_tags=True)
     defn_lists: Dict = {}
     heads = []
     got_ety_sec_head = False
@@ -246,7 +283,7 @@ def log_total(total):
     get_stats_logger().append({"type": "total_count", "count": total})
 
 
-def proc_result(outdir, lemma, results):
+def serialise_result(lemma, results) -> Optional[bytes]:
     try:
         if isinstance(results, ExceptionWrapper):
             print("Error while processing {}.".format(lemma))
@@ -254,81 +291,617 @@ def proc_result(outdir, lemma, results):
                 results.re_raise()
             except Exception:
                 traceback.print_exc(file=sys.stdout)
+            return None
         else:
-            print("Success", lemma)
-            with open(pjoin(outdir, lemma), "wb") as fp:
-                fp.write(dumps(results))
+            if trace.enabled:
+                trace("success", lemma)
+            return dumps(results)
     except:
         print("Exception while processing", lemma, results)
         raise
 
 
-class ProcessPageFile:
-    def __init__(self, outdir, entries, *args, **kwargs):
+def proc_result(outdir, lemma, results):
+    data = serialise_result(lemma, results)
+    if data is not None:
+        # Written whole or not at all, so a resumed run can trust it
+        tmp_path = pjoin(outdir, f".{lemma}.tmp")
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, pjoin(outdir, lemma))
+
+
+class PagePool(ABC):
+    """
+    Runs `__call__`, which subclasses implement, over `entries` in a pool of
+    worker processes, yielding the results as they come in. If `max_pending`
+    is given, at most that many entries are handed to the workers before
+    their results come back, so a fast producer (e.g. a decompressor) cannot
+    buffer unboundedly.
+
+    If `sharded` is set, workers send serialised results back to the main
+    process to be written to shards rather than writing them to `outdir`.
+
+    If `chunked` is set, each of `entries` is instead a list of entries which
+    is handed to a worker in one go. The time each worker spends busy is
+    then added up in `busy`, and the time the pool ran for kept in `wall`.
+
+    Workers do not log stats themselves. Instead, the records logged while
+    parsing each page are returned with its result for the main process to
+    log (see `ResultSink`), so the stats of a page are only logged once
+    whether its worker dies or it is parsed again after a crash.
+    """
+
+    def __init__(
+        self,
+        outdir,
+        entries,
+        *args,
+        max_pending=None,
+        sharded=False,
+        chunked=False,
+        **kwargs,
+    ):
         self.outdir = outdir
         self.entries = entries
+        self.max_pending = max_pending
+        self.sharded = sharded
+        self.chunked = chunked
+        self.busy: Counter = Counter()
+        self.wall = 0.0
+        self.log_stats = stats_logging_enabled()
         self.args = args
         self.kwargs = kwargs
 
     def worker_init(self):
         get_stats_logger().reopen()
+        LazyFst.lookup_cache.reopen()
 
     def __getstate__(self):
-        return {"outdir": self.outdir}
+        return {
+            "outdir": self.outdir,
+            "sharded": self.sharded,
+            "log_stats": self.log_stats,
+        }
+
+    def capture_stats(self, func, *args):
+        """
+        Call `func`, returning its result along with the stats records logged
+        while it ran, which are kept to be sent back rather than logged here,
+        or None if stats are not being logged.
+        """
+        if not self.log_stats:
+            return func(*args), None
+        with recording_stats_logger(passthrough=False) as recorder:
+            result = func(*args)
+        return result, recorder.records
+
+    def emit(self, lemma, results) -> Optional[bytes]:
+        if self.sharded:
+            return serialise_result(lemma, results)
+        proc_result(self.outdir, lemma, results)
+        return None
+
+    def call_chunk(self, chunk):
+        start = time.perf_counter()
+        results = [self(entry) for entry in chunk]
+        return os.getpid(), time.perf_counter() - start, results
+
+    def start_page(self, title) -> bool:
+        """
+        Called by `__call__` before parsing each page. Returns False if the
+        page went over its budget in an earlier attempt, in which case it is
+        given up on.
+        """
+        if skip_page(title):
+            return False
+        mark_in_flight(self.outdir, title)
+        page_started(title)
+        return True
+
+    def end_page(self):
+        mark_in_flight(self.outdir, None)
+        page_started(None)
+
+    def on_abandon(self, title, kind):
+        get_stats_logger().append(
+            {"type": "word_event", "word": title, "event": kind, "page": title}
+        )
+        LazyFst.lookup_cache.worker_lost()
 
     def __iter__(self):
-        pool = Pool(*self.args, initializer=self.worker_init, **self.kwargs)
-        try:
-            yield from pool.imap_unordered(self, self.entries)
-        finally:
-            pool.terminate()
+        # Load FSTs before forking so that the workers share one copy
+        preload_fsts()
+        pool = WorkerPool(
+            self.call_chunk if self.chunked else self,
+            *self.args,
+            initializer=self.worker_init,
+            max_pending=self.max_pending,
+            on_abandon=self.on_abandon,
+            **self.kwargs,
+        )
+        start = time.perf_counter()
+        if self.chunked:
+            for pid, busy, results in pool.imap_unordered(self.entries):
+                self.busy[pid] += busy
+                yield from results
+        else:
+            yield from pool.imap_unordered(self.entries)
+        self.wall = time.perf_counter() - start
+
+    @abstractmethod
+    def __call__(self, entry):
+        """
+        Process one entry in a worker, returning a picklable result.
+        """
+
+
+class ProcessPageFile(PagePool):
+    """
+    Parses pages from a directory of files, as output by dumpsplit. Each entry
+    is a (name, path, prev) triple, where prev is the manifest entry of the
+    page from a previous run, or None. If the page and parser are unchanged
+    since that run, its output is reused rather than reparsed.
+    """
+
+    def __init__(self, outdir, entries, *args, prev_outdir=None, **kwargs):
+        super().__init__(outdir, entries, *args, **kwargs)
+        self.prev_outdir = prev_outdir
+        self.versions = {"parser": parser_version(), "fst": fst_version()}
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["prev_outdir"] = self.prev_outdir
+        state["versions"] = self.versions
+        return state
+
+    def can_reuse(self, title, page_hash, prev):
+        return (
+            prev is not None
+            and prev["hash"] == page_hash
+            and prev["versions"] == self.versions
+            and (not prev["output"] or os.path.exists(pjoin(self.prev_outdir, title)))
+            # Events are only kept when stats are logged, so they can be replayed
+            and (prev.get("events") is not None or not self.log_stats)
+        )
 
     def __call__(self, entry):
         from urllib.parse import unquote
 
-        name, path = entry
+        name, path, prev = entry
         if name == "__metadata__.json":
+            if self.sharded:
+                with open(path, "rb") as metadata:
+                    return "metadata", name, None, metadata.read(), None
             copyfile(path, pjoin(self.outdir, "__metadata__.json"))
-            return
+            return None
         title = unquote(name)
-        results = proc_text(title, open(path).read())
+        text = open(path).read()
+        page_hash = content_hash(text)
+        if self.can_reuse(title, page_hash, prev):
+            if prev["output"]:
+                link_or_copy(pjoin(self.prev_outdir, title), pjoin(self.outdir, title))
+            # Replayed so the stats are the same as if it had been reparsed
+            return "reused", title, prev, None, prev.get("events")
+        if not self.start_page(title):
+            # Left out of the manifest so it is retried next time
+            return "failed", title, None, None, None
+        results, events = self.capture_stats(proc_text, title, text)
+        self.end_page()
+        data = None
         if results is not None:
-            proc_result(self.outdir, title, results[1])
+            data = self.emit(title, results[1])
+            if isinstance(results[1], ExceptionWrapper):
+                # Leave out of the manifest so it is retried next time
+                return "failed", title, None, None, events
+        return (
+            "parsed",
+            title,
+            {
+                "hash": page_hash,
+                "versions": self.versions,
+                "output": results is not None,
+                "events": events,
+            },
+            data,
+            events,
+        )
+
+
+class ProcessDumpPage(PagePool):
+    """
+    Parses pages from a dump. Each entry is a (title, text) pair and the
+    result is a (title, output, data, events) tuple, where output is whether
+    the page gave any results, data is the serialised results when sharded
+    and events are the stats records of the page.
+    """
+
+    def __call__(self, entry):
+        title, text = entry
+        if not self.start_page(title):
+            return title, False, None, None
+        results, events = self.capture_stats(proc_text, title, text)
+        self.end_page()
+        if results is None:
+            return title, False, None, events
+        return title, True, self.emit(title, results[1]), events
 
 
-def process_pages(indir, outdir, processes=None):
-    entries = ((dir_entry.name, dir_entry.path) for dir_entry in os.scandir(indir))
+class ProcessDumpStream(ProcessDumpPage):
+    """
+    Parses the Finnish pages of a multistream bz2 dump. Each entry is the
+    (start, end) byte range of a stream, which the worker decompresses and
+    scans itself. The result is the start of the stream, the number of pages
+    in it, a list of what ProcessDumpPage would return for each of its
+    Finnish pages other than those in `quarantined`, and the stats records of
+    the stream itself.
+    """
+
+    def __init__(
+        self, outdir, entries, *args, dump_path, header, quarantined=(), **kwargs
+    ):
+        super().__init__(outdir, entries, *args, **kwargs)
+        self.dump_path = dump_path
+        self.header = header
+        self.quarantined = frozenset(quarantined)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["dump_path"] = self.dump_path
+        state["header"] = self.header
+        state["quarantined"] = self.quarantined
+        return state
+
+    def __call__(self, entry):
+        start, end = entry
+        doc = wrap_pages(self.header, read_range(self.dump_path, start, end))
+        results, events = self.capture_stats(self.scan, doc)
+        return start, doc.count("<page>"), results, events
+
+    def scan(self, doc):
+        results = []
+        for title, text in iter_dump_finnish(Dump.from_file(io.StringIO(doc))):
+            if title not in self.quarantined:
+                results.append(super().__call__((title, text)))
+        return results
+
+
+# Chunks take this fraction of the work remaining for each worker
+GUIDED_CHUNK_FRACTION = 0.5
+# ...but are at least this big so small pages do not each cost a round trip
+MIN_CHUNK_BYTES = 64 * 1024
+
+
+def schedule_largest_first(sized_entries, processes) -> List[List[Any]]:
+    """
+    Split `sized_entries`, (size, entry) pairs, into chunks of entries, the
+    biggest first, so that huge pages do not end up running on their own at
+    the end. As in guided self-scheduling, each chunk gets a share of the
+    bytes still to be scheduled, so chunks shrink as the run goes on and the
+    workers finish at about the same time.
+    """
+    sized_entries = sorted(sized_entries, key=lambda pair: pair[0], reverse=True)
+    remaining = sum(size for size, _ in sized_entries)
+    chunks: List[List[Any]] = []
+    chunk: List[Any] = []
+    chunk_bytes = 0
+    target = 0.0
+    for size, entry in sized_entries:
+        if not chunk:
+            target = max(remaining * GUIDED_CHUNK_FRACTION / processes, MIN_CHUNK_BYTES)
+        chunk.append(entry)
+        chunk_bytes += size
+        remaining -= size
+        if chunk_bytes >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def format_utilisation(busy: Counter, wall: float) -> List[str]:
+    lines = []
+    for idx, (pid, secs) in enumerate(sorted(busy.items())):
+        pct = 100 * secs / wall if wall else 0
+        lines.append(f"Worker {idx} (pid {pid}): busy {secs:.1f}s ({pct:.0f}%)")
+    if busy and wall:
+        mean_pct = 100 * sum(busy.values()) / (len(busy) * wall)
+        lines.append(f"Mean utilisation {mean_pct:.0f}% over {wall:.1f}s")
+    return lines
+
+
+class ResultSink:
+    """
+    Takes the results of pages in the main process. The stats records of each
+    page are logged tagged with its title, its serialised results written to
+    `writer` if there is one, and it is recorded in `checkpoint`. These are
+    synced in batches of `batch_size` pages, or every `sync_interval`
+    seconds: first the stats, then the shards and then the journal. So
+    after a crash, every page in the journal has its output and stats, and a
+    resumed run drops the stats of any other page, which it parses again.
+    """
+
+    def __init__(self, checkpoint, writer, batch_size=1000, sync_interval=10):
+        self.checkpoint = checkpoint
+        self.writer = writer
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.pending: List[Tuple[str, bytes]] = []
+        self.pages = 0
+        self.last_sync = time.monotonic()
+
+    def add(self, title, output, data=None, events=None, **extra):
+        stats_logger = get_stats_logger()
+        for record in events or ():
+            stats_logger.append({**record, "page": title})
+        if data is not None:
+            self.pending.append((title, data))
+        self.checkpoint.record(title, output, **extra)
+        self.pages += 1
+        if (
+            self.pages >= self.batch_size
+            or time.monotonic() - self.last_sync >= self.sync_interval
+        ):
+            self.sync()
+
+    def add_stream(self, start, pages, events=None):
+        """
+        Record a stream once the results of all its pages have been added.
+        """
+        stats_logger = get_stats_logger()
+        for record in events or ():
+            stats_logger.append(record)
+        self.checkpoint.record_stream(start, pages)
+
+    def sync(self):
+        get_stats_logger().flush()
+        if self.writer is not None:
+            for title, data in self.pending:
+                self.writer.write(title, data)
+            self.writer.flush()
+        self.pending = []
+        self.checkpoint.sync()
+        self.pages = 0
+        self.last_sync = time.monotonic()
+
+
+def open_checkpoint(outdir, resume, writer) -> Checkpoint:
+    checkpoint = Checkpoint(outdir, resume)
+    if not resume:
+        return checkpoint
+    if writer is None:
+        checkpoint.prune(
+            lambda record: not record["output"]
+            or os.path.exists(pjoin(outdir, record["title"]))
+        )
+    else:
+        checkpoint.prune(
+            lambda record: not record["output"] or record["title"] in writer.titles
+        )
+        # Including any written just before the last run died
+        for title in writer.titles:
+            checkpoint.done.setdefault(title, {"title": title, "output": True})
+    done = checkpoint.done
+    # The totals are all logged again, as are the stats of pages parsed again
+    get_stats_logger().discard_if(
+        lambda record: record["type"] == "total_count"
+        or ("page" in record and record["page"] not in done)
+    )
+    print(
+        "Resuming with {} pages done and {} quarantined".format(
+            len(checkpoint.done), len(checkpoint.quarantined)
+        )
+    )
+    return checkpoint
+
+
+def process_pages(
+    indir,
+    outdir,
+    processes=None,
+    incremental=False,
+    prev_outdir=None,
+    shards=None,
+    compress=False,
+    resume=False,
+):
+    """
+    Parse every page file in `indir`, writing the results to `outdir` along
+    with a manifest. If `incremental` is set, the output of pages which are
+    unchanged since the run which wrote to `prev_outdir` (by default
+    `outdir`) is reused. If `shards` is given, results are written into that
+    many shard files rather than one file per page. If `resume` is set, the
+    pages finished by an earlier run into `outdir` which died are skipped.
+    """
+    from urllib.parse import unquote
+
+    if incremental and shards:
+        raise ValueError("Incremental parsing is not supported with sharded output")
+    writer = ShardWriter(outdir, shards, compress, resume) if shards else None
+    checkpoint = open_checkpoint(outdir, resume, writer)
+    sink = ResultSink(checkpoint, writer)
+    if prev_outdir is None:
+        prev_outdir = outdir
+    prev_manifest = load_manifest(prev_outdir) if incremental else {}
     total = 0
-    for _ in ProcessPageFile(outdir, entries, processes=processes):
+    counts: Counter = Counter()
+    manifest = {}
+    seen = set()
+    sized_entries = []
+    for dir_entry in os.scandir(indir):
+        title = unquote(dir_entry.name)
+        if checkpoint.is_done(title):
+            total += 1
+            record = checkpoint.done.get(title)
+            if record is not None:
+                seen.add(title)
+                if record.get("manifest") is not None:
+                    manifest[title] = record["manifest"]
+            continue
+        sized_entries.append(
+            (
+                dir_entry.stat().st_size,
+                (dir_entry.name, dir_entry.path, prev_manifest.get(title)),
+            )
+        )
+    pool = ProcessPageFile(
+        outdir,
+        schedule_largest_first(sized_entries, processes or cpu_count()),
+        processes=processes,
+        prev_outdir=prev_outdir,
+        sharded=writer is not None,
+        chunked=True,
+    )
+    for result in pool:
         total += 1
+        if result is None:
+            continue
+        status, title, manifest_entry, data, events = result
+        counts[status] += 1
+        seen.add(title)
+        if manifest_entry is not None:
+            manifest[title] = manifest_entry
+        if writer is not None:
+            output = data is not None
+        else:
+            output = manifest_entry is not None and manifest_entry["output"]
+        sink.add(title, output, data, events, manifest=manifest_entry)
+    sink.sync()
     log_total(total)
+    if writer is not None:
+        writer.close()
+    elif os.path.abspath(prev_outdir) == os.path.abspath(outdir):
+        # Remove output of pages which have since gone away
+        for title, prev in prev_manifest.items():
+            stale_path = pjoin(outdir, title)
+            if title not in seen and prev["output"] and os.path.exists(stale_path):
+                os.unlink(stale_path)
+    save_manifest(outdir, manifest)
+    checkpoint.close()
+    print(
+        "Reused {} pages, reparsed {} pages ({} failed)".format(
+            counts["reused"], counts["parsed"] + counts["failed"], counts["failed"]
+        )
+    )
+    for line in format_utilisation(pool.busy, pool.wall):
+        print(line)
 
 
-def process_dump(inf, outdir):
-    # Dict with DefnListDictTree2L, List[Any]
-    def page_info(
-        dump,
-    ) -> Iterator[Tuple[str, Union[ExceptionWrapper, Dict[str, Any]]]]:
-        get_stats_logger().reopen()
-        total = 0
-        try:
-            for page in dump.pages:
-                total += 1
-                if (
-                    page.namespace != 0
-                    or page.title.startswith("User:")
-                    or "/" in page.title
-                ):
-                    continue
-                revision = next(page)
-                if revision.text is None or "==Finnish==" not in revision.text:
-                    continue
-                res = proc_text(page.title, revision.text)
-                if res:
-                    yield res
-        finally:
-            log_total(total)
+# How many pages per worker process can be waiting in the queue
+DUMP_PENDING_PER_PROCESS = 16
 
+
+def iter_dump_finnish_positions(dump) -> Iterator[Tuple[int, str, str]]:
+    """
+    Yields (position, title, text) triples for every page in `dump` with a
+    Finnish section, where position counts all the pages of the dump and
+    text is just the Finnish sections.
+    """
+    total = 0
+    try:
+        for page in dump.pages:
+            total += 1
+            if (
+                page.namespace != 0
+                or page.title.startswith("User:")
+                or "/" in page.title
+            ):
+                continue
+            revision = next(page)
+            if revision.text is None or "==Finnish" not in revision.text:
+                continue
+            text = slice_lang_sections(revision.text)
+            if text is None:
+                continue
+            yield total - 1, page.title, text
+    finally:
+        log_total(total)
+
+
+def iter_dump_finnish(dump) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (title, text) pairs for every page in `dump` with a Finnish
+    section, where text is just the Finnish sections. This is the only work
+    done in the reader process, so it should be kept cheap.
+    """
+    for _, title, text in iter_dump_finnish_positions(dump):
+        yield title, text
+
+
+def iter_stream_results(pool, sink) -> Iterator[Tuple[str, bool, Any, Any]]:
+    for start, pages, results, events in pool:
+        yield from results
+        # Only reached once the results of the stream have been handled
+        sink.add_stream(start, pages, events)
+
+
+def process_dump(
+    inf,
+    outdir,
+    processes=None,
+    max_pending=None,
+    shards=None,
+    compress=False,
+    index=None,
+    resume=False,
+):
+    """
+    Parse every Finnish page of the dump `inf`. Usually `inf` is a file
+    object of uncompressed XML which is read in this process. If `index` is
+    given, `inf` is instead the path of a multistream bz2 dump and `index` the
+    path of its index, and the workers decompress and scan the streams too.
+    If `resume` is set, the pages finished by an earlier run into `outdir`
+    which died are skipped.
+    """
     makedirs(outdir, exist_ok=True)
-    for lemma, results in page_info(Dump.from_file(inf)):
-        proc_result(outdir, lemma, results)
+    get_stats_logger().reopen()
+    writer = ShardWriter(outdir, shards, compress, resume) if shards else None
+    checkpoint = open_checkpoint(outdir, resume, writer)
+    sink = ResultSink(checkpoint, writer)
+    if index is None:
+        if max_pending is None:
+            max_pending = DUMP_PENDING_PER_PROCESS * (processes or cpu_count())
+        results = ProcessDumpPage(
+            outdir,
+            (
+                (title, text)
+                for title, text in iter_dump_finnish(Dump.from_file(inf))
+                if not checkpoint.is_done(title)
+            ),
+            processes=processes,
+            max_pending=max_pending,
+            sharded=writer is not None,
+        )
+    else:
+        ranges = stream_ranges(read_stream_offsets(index), os.path.getsize(inf))
+        if checkpoint.streams:
+            # Count the pages of the streams which are skipped
+            log_total(sum(checkpoint.streams.values()))
+        results = iter_stream_results(
+            ProcessDumpStream(
+                outdir,
+                [
+                    (start, end)
+                    for start, end in ranges
+                    if start not in checkpoint.streams
+                ],
+                processes=processes,
+                max_pending=max_pending,
+                sharded=writer is not None,
+                dump_path=inf,
+                header=read_header(inf),
+                quarantined=checkpoint.quarantined,
+            ),
+            sink,
+        )
+    for title, output, data, events in results:
+        # Pages of part finished streams are parsed again
+        if checkpoint.is_done(title):
+            continue
+        sink.add(title, output, data, events)
+    sink.sync()
+    if writer is not None:
+        writer.close()
+    checkpoint.close()
@@ -0,0 +1,257 @@
+"""
+A long-running lemma lookup server.
+
+Starting the CLI and connecting to the database cost far more than looking
+up a lemma, so rather than running `lookup` once per word, clients can ask a
+server which stays up, over HTTP on a TCP port or a Unix socket:
+
+    GET /lookup/<lemma>  The lemma's counts and senses as JSON, or a 404 if
+                         not found
+    GET /entry/<lemma>   The lemma's whole entry from headword_entry
+    GET /stats           Cache statistics and latency histograms
+
+All lookups share one engine with a pool of connections. Queries run on a
+thread pool of the same size so as not to block the event loop, and the
+responses are kept in a bounded LRU cache.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import orjson
+
+from wikiparse.db.entries import get_entry
+from wikiparse.db.lookup import lookup_lemmas
+
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_POOL_SIZE = 8
+# Upper bounds of the latency buckets in microseconds, from 1us to about 67s
+LATENCY_BUCKETS = [2 ** exp for exp in range(27)]
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+logger = logging.getLogger(__name__)
+
+Response = Tuple[int, bytes]
+# Whether the whole entry was asked for, and the lemma
+CacheKey = Tuple[bool, str]
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in buckets which double in size.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds * 1e6)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> Optional[int]:
+        """
+        The upper bound in microseconds of the bucket holding quantile `q`.
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total * 1e6 / self.count if self.count else None,
+            "p50_us": self.quantile(0.5),
+            "p90_us": self.quantile(0.9),
+            "p99_us": self.quantile(0.99),
+            "buckets": {
+                (f"le_{bound}" if bound is not None else "inf"): count
+                for bound, count in zip(LATENCY_BUCKETS + [None], self.counts)
+                if count
+            },
+        }
+
+
+class LookupServer:
+    def __init__(
+        self, engine, cache_size=DEFAULT_CACHE_SIZE, pool_size=DEFAULT_POOL_SIZE
+    ):
+        # The lookup queries are prepared once, so with a compiled cache they
+        # are only compiled once too
+        self.engine = engine.execution_options(compiled_cache={})
+        self.executor = ThreadPoolExecutor(pool_size)
+        self.cache: "OrderedDict[CacheKey, Response]" = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        # Lookups already running, so concurrent misses on a lemma share one
+        self.in_flight: Dict[CacheKey, "asyncio.Future[Response]"] = {}
+        self.latency = {"hit": LatencyHistogram(), "miss": LatencyHistogram()}
+
+    def lookup_uncached(self, key: CacheKey) -> Response:
+        whole_entry, lemma = key
+        with self.engine.connect() as conn:
+            if whole_entry:
+                entry = get_entry(conn, lemma)
+            else:
+                entry = lookup_lemmas(conn, [lemma]).get(lemma)
+        if entry is None:
+            return 404, orjson.dumps({"headword": lemma, "error": "not found"})
+        return 200, orjson.dumps(entry)
+
+    async def lookup(self, lemma: str, whole_entry=False) -> Response:
+        start = time.perf_counter()
+        key = (whole_entry, lemma)
+        response = self.cache.get(key)
+        if response is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            self.latency["hit"].add(time.perf_counter() - start)
+            return response
+        self.misses += 1
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self.executor, self.lookup_uncached, key
+            )
+            self.in_flight[key] = future
+            try:
+                response = await future
+            finally:
+                del self.in_flight[key]
+            self.cache[key] = response
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            response = await future
+        self.latency["miss"].add(time.perf_counter() - start)
+        return response
+
+    def stats(self) -> Response:
+        return (
+            200,
+            orjson.dumps(
+                {
+                    "cache": {
+                        "size": len(self.cache),
+                        "maxsize": self.cache_size,
+                        "hits": self.hits,
+                        "misses": self.misses,
+                    },
+                    "latency": {
+                        name: histogram.as_dict()
+                        for name, histogram in self.latency.items()
+                    },
+                }
+            ),
+        )
+
+    async def route(self, method: str, target: str) -> Response:
+        if method != "GET":
+            return 405, orjson.dumps({"error": "only GET is supported"})
+        path = target.split("?", 1)[0]
+        if path.startswith("/lookup/") and len(path) > len("/lookup/"):
+            return await self.lookup(unquote(path[len("/lookup/") :]))
+        if path.startswith("/entry/") and len(path) > len("/entry/"):
+            return await self.lookup(unquote(path[len("/entry/") :]), whole_entry=True)
+        if path == "/stats":
+            return self.stats()
+        return 404, orjson.dumps({"error": f"no such path {path}"})
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    status, body = 400, orjson.dumps({"error": "bad request"})
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    try:
+                        status, body = await self.route(method, target)
+                    except Exception:
+                        logger.exception("Error handling %s %s", method, target)
+                        status, body = 500, orjson.dumps({"error": "internal error"})
+                    connection = headers.get("connection")
+                    if version == "HTTP/1.1":
+                        keep_alive = connection != "close"
+                    else:
+                        keep_alive = connection == "keep-alive"
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8080, path: Optional[str] = None):
+        """
+        Start listening on `host` and `port`, or on the Unix socket `path` if
+        given. Returns the asyncio server.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        self.executor.shutdown()
+        self.engine.dispose()
+
+
+def serve(server: LookupServer, **kwargs):
+    """
+    Run `server` until interrupted, taking the arguments of `start(...)`.
+    """
+
+    async def run():
+        async with await server.start(**kwargs) as listener:
+            sockets: List = listener.sockets or []
+            for sock in sockets:
+                print("Listening on", sock.getsockname())
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
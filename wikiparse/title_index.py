@@ -0,0 +1,111 @@
+"""
+An index of where each Finnish page is in a multistream bz2 dump.
+
+For each title it records the byte range of the bz2 stream holding the page
+and the position of the page within the stream, so that single pages can be
+fetched by decompressing one stream and reading one <page> element, rather
+than scanning the whole dump.
+"""
+import io
+import os
+from collections import defaultdict
+from functools import partial
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+from mwxml.iteration import Dump
+from sqlitedict import SqliteDict
+
+from .multistream import (
+    read_header,
+    read_range,
+    read_stream_offsets,
+    stream_ranges,
+    wrap_pages,
+)
+from .parse import iter_dump_finnish, iter_dump_finnish_positions
+
+# How many index entries to write per transaction
+COMMIT_EVERY = 10000
+
+StreamRange = Tuple[int, int]
+
+
+def default_title_index_path(dump_path: str) -> str:
+    return dump_path + ".titles.sqlite"
+
+
+def open_title_index(path: str, **kwargs) -> SqliteDict:
+    return SqliteDict(path, encode=orjson.dumps, decode=orjson.loads, **kwargs)
+
+
+def scan_stream_titles(
+    dump_path: str, header: str, stream: StreamRange
+) -> List[Tuple[str, int]]:
+    doc = wrap_pages(header, read_range(dump_path, *stream))
+    return [
+        (title, position)
+        for position, title, _ in iter_dump_finnish_positions(
+            Dump.from_file(io.StringIO(doc))
+        )
+    ]
+
+
+def build_title_index(
+    dump_path: str, index_path: str, out_path: str, processes=None
+) -> int:
+    """
+    Scan the streams of the multistream dump at `dump_path`, which has the
+    index `index_path`, in a pool of `processes` workers, writing the
+    location of every Finnish page into a title index at `out_path`. Returns
+    the number of pages indexed.
+    """
+    ranges = stream_ranges(read_stream_offsets(index_path), os.path.getsize(dump_path))
+    scan = partial(scan_stream_titles, dump_path, read_header(dump_path))
+    tmp_path = f"{out_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+    count = 0
+    with Pool(processes) as pool, open_title_index(
+        tmp_path, flag="n", autocommit=False
+    ) as title_index:
+        for stream, titles in zip(ranges, pool.imap(scan, ranges)):
+            for title, position in titles:
+                title_index[title] = [stream[0], stream[1], position]
+                count += 1
+                if count % COMMIT_EVERY == 0:
+                    title_index.commit()
+        title_index.commit()
+    os.replace(tmp_path, out_path)
+    return count
+
+
+def fetch_pages(
+    dump_path: str, titles: Iterable[str], title_index_path: Optional[str] = None
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Yields (title, text) pairs for `titles`, where text is the Finnish
+    sections of the page, or None if there is no Finnish page with that
+    title in the title index of the dump at `dump_path`. Each stream is only
+    decompressed once, however many of the titles are in it.
+    """
+    if title_index_path is None:
+        title_index_path = default_title_index_path(dump_path)
+    header = read_header(dump_path)
+    by_stream: Dict[StreamRange, List[Tuple[str, int]]] = defaultdict(list)
+    with open_title_index(title_index_path, flag="r") as title_index:
+        for title in titles:
+            location = title_index.get(title)
+            if location is None:
+                yield title, None
+                continue
+            start, end, position = location
+            by_stream[(start, end)].append((title, position))
+    for (start, end), stream_titles in by_stream.items():
+        pages = read_range(dump_path, start, end).split("<page>")
+        for title, position in stream_titles:
+            # Anything before the first <page> is not part of a page
+            doc = wrap_pages(header, "<page>" + pages[position + 1])
+            found = dict(iter_dump_finnish(Dump.from_file(io.StringIO(doc))))
+            yield title, found.get(title)
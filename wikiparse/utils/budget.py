@@ -0,0 +1,35 @@
+"""
+Per-page time and memory budgets, enforced by the watchdog of
+`wikiparse.utils.worker_pool.WorkerPool`.
+
+A page goes over its budget when it has been parsing for longer than
+`max_seconds`, or when its worker's resident set has grown by more than
+`max_rss_mb` since the page was started.
+"""
+import os
+from typing import Optional, Tuple
+
+_max_seconds: Optional[float] = None
+_max_rss: Optional[int] = None
+
+
+def set_page_budget(max_seconds=None, max_rss_mb=None):
+    global _max_seconds, _max_rss
+    _max_seconds = max_seconds
+    _max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb is not None else None
+
+
+def get_budget() -> Tuple[Optional[float], Optional[int]]:
+    """
+    The budget as (seconds, bytes), either of which may be None.
+    """
+    return _max_seconds, _max_rss
+
+
+def get_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (FileNotFoundError, ProcessLookupError):
+        # Not on Linux, or the process has just gone
+        return 0
@@ -7,5 +7,5 @@ Self = TypeVar("Self")
 
 class MergeMixin:
     def merge(self: Self, other: Self):
-        for self_field in fields(self):
+        for self_field in fields(self):  # type: ignore[arg-type]
             getattr(self, self_field.name).extend(getattr(other, self_field.name))
@@ -1,8 +1,14 @@
+from contextlib import contextmanager
 from functools import reduce
+from sqlalchemy import event, inspect
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.sql import select
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 
 def select_or_insert(session, table, insert_kwargs=None, **kwargs):
     # print('select_or_insert', session, table, insert_kwargs, kwargs)
@@ -45,17 +51,34 @@ def insert_get_id(session, table, **kwargs) -> int:
     return session.execute(table.insert().values(**kwargs)).inserted_primary_key[0]
 
 
-def get_session(db=None):
+def get_engine(db=None, pool_size=None):
+    """
+    An engine for `db`, or else $DATABASE_URL. With `pool_size`, up to that
+    many connections are kept open in a pool which can be shared between
+    threads, including for SQLite files, which otherwise reconnect each time.
+    """
     from sqlalchemy import create_engine
-    from sqlalchemy.orm import scoped_session, sessionmaker
+    from sqlalchemy.pool import QueuePool
 
     if db is None:
         db = os.getenv("DATABASE_URL")
         if db is None:
             raise RuntimeError("DATABASE_URL not set")
 
-    engine = create_engine(db)
-    session = sessionmaker(bind=engine)
+    if pool_size is None:
+        return create_engine(db)
+    kwargs = {}
+    if db.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    return create_engine(
+        db, poolclass=QueuePool, pool_size=pool_size, max_overflow=0, **kwargs
+    )
+
+
+def get_session(db=None):
+    from sqlalchemy.orm import scoped_session, sessionmaker
+
+    session = sessionmaker(bind=get_engine(db))
     return scoped_session(session)
 
 
@@ -65,3 +88,115 @@ def batch_commit(db, iter, func, batch_size=1000):
         if (idx % batch_size) == (batch_size - 1):
             db.commit()
     db.commit()
+
+
+# Unsafe settings only suitable for one-shot builds where a crash means
+# starting again from scratch
+SQLITE_FAST_LOAD_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    # Negative means KiB, so this is 1GiB
+    "cache_size": "-1048576",
+    "temp_store": "MEMORY",
+}
+
+SQLITE_SAFE_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "cache_size": "-2000",
+    "temp_store": "DEFAULT",
+}
+
+
+def set_sqlite_pragmas(dbapi_conn, pragmas):
+    cursor = dbapi_conn.cursor()
+    for key, value in pragmas.items():
+        cursor.execute(f"PRAGMA {key} = {value}")
+    cursor.close()
+
+
+def create_tables(engine, metadata, indexes=True):
+    """
+    Create all tables in `metadata`. If `indexes` is False, secondary indexes
+    are left out so they can be created after a bulk load with
+    `create_indexes(...)`.
+    """
+    if indexes:
+        metadata.create_all(engine)
+        return
+    existing = set(inspect(engine).get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name in existing:
+            continue
+        engine.execute(CreateTable(table))
+
+
+def existing_indexes(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table.name)}
+
+
+def drop_indexes(engine, metadata):
+    for table in metadata.sorted_tables:
+        existing = existing_indexes(engine, table)
+        for index in table.indexes:
+            if index.name in existing:
+                logger.info("Dropping index %s", index.name)
+                index.drop(engine)
+
+
+def create_indexes(engine, metadata):
+    for table in metadata.sorted_tables:
+        existing = existing_indexes(engine, table)
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Creating index %s", index.name)
+                index.create(engine)
+
+
+@contextmanager
+def fast_load(session, metadata):
+    """
+    Context manager for bulk loading into the tables of `metadata`. Secondary
+    indexes are dropped for the duration of the load and recreated
+    afterwards, after which the query planner statistics are refreshed. On
+    SQLite, journalling and syncing are turned off while loading.
+
+    If the load fails, it is rolled back as far as it has not been committed
+    and the indexes are still recreated before the error is passed on.
+    """
+    engine = session().get_bind().engine
+    is_sqlite = engine.dialect.name == "sqlite"
+
+    def on_connect(dbapi_conn, _conn_record):
+        set_sqlite_pragmas(dbapi_conn, SQLITE_FAST_LOAD_PRAGMAS)
+
+    drop_indexes(engine, metadata)
+    if is_sqlite:
+        event.listen(engine, "connect", on_connect)
+        set_sqlite_pragmas(session.connection().connection, SQLITE_FAST_LOAD_PRAGMAS)
+    loaded = False
+    try:
+        yield
+        loaded = True
+    finally:
+        if is_sqlite:
+            event.remove(engine, "connect", on_connect)
+        if loaded:
+            session.commit()
+        else:
+            session.rollback()
+        session.close()
+        try:
+            create_indexes(engine, metadata)
+        except Exception:
+            logger.exception(
+                "Could not recreate the secondary indexes dropped for the load. "
+                "The database is missing some of them until "
+                "wikiparse.utils.db.create_indexes(...) is run on it."
+            )
+            if loaded:
+                raise
+        with engine.connect() as conn:
+            if is_sqlite:
+                set_sqlite_pragmas(conn.connection, SQLITE_SAFE_PRAGMAS)
+            conn.execute("ANALYZE")
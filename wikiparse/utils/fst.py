@@ -1,9 +1,11 @@
 import hfst
 
 import os
-from typing import List, Tuple
+from typing import Dict, List, Optional
 from itertools import zip_longest
 
+from .fst_cache import LookupCache, LookupKey, LookupResult
+
 
 def seq(*exprs: str) -> str:
     "Sequence `exprs`"
@@ -128,7 +130,7 @@ def load(inf):
     return fst
 
 
-registry = {}
+registry: Dict[str, "LazyFst"] = {}
 
 
 def fst2tokfst(fst):
@@ -141,18 +143,24 @@ def fst2tokfst(fst):
 
 
 class LazyFst:
-    fst_dir = None
+    fst_dir: Optional[str] = None
+    lookup_cache: LookupCache = LookupCache()
 
     @classmethod
     def set_fst_dir(cls, new_fst_dir):
         cls.fst_dir = new_fst_dir
 
+    @classmethod
+    def set_lookup_cache(cls, new_lookup_cache):
+        cls.lookup_cache = new_lookup_cache
+
     def __init__(self, name, build_fst, assert_non_empty=False):
         self.name = name
         self.build_fst = build_fst
         self._bare_fst = None
         self._match_at_start_fst = None
         self._fst = None
+        self._lookup_fst = None
         self.assert_non_empty = assert_non_empty
         registry[name] = self
 
@@ -166,6 +174,7 @@ class LazyFst:
         self._save_fst(self.get_bare_fst(), "bare", fst_dir)
         self._save_fst(self.get_fst(), "opt", fst_dir)
         self._save_fst(self.get_match_at_start_fst(), "start", fst_dir)
+        self._save_fst(self.get_lookup_fst(), "ol", fst_dir)
 
     def _load_fst(self, var):
         return load(self._path(var))
@@ -217,24 +226,74 @@ class LazyFst:
             ), f"Got results for empty lookup from FST: {results!r}"
         return self._fst
 
-    def lookup_partial(
+    def build_lookup_fst(self):
+        """
+        Build a lookup-optimised (HFSTOL) version of the opt FST.
+
+        It would be nicer to have it also match prefixes, as the match at
+        start FST does, so one lookup would do. However HFSTOL lookups miss
+        some paths of transducers with a trailing [?*]:0, so prefixes are
+        looked up one at a time instead.
+        """
+        transducer = self.get_bare_fst()
+        transducer.minimize()
+        transducer.lookup_optimize()
+        return transducer
+
+    def get_lookup_fst(self):
+        if self._lookup_fst is None:
+            if self.fst_dir is not None and os.path.exists(self._path("ol")):
+                self._lookup_fst = self._load_fst("ol")
+            else:
+                # Not built or an FST directory from before lookup FSTs
+                self._lookup_fst = self.build_lookup_fst()
+            if self.assert_non_empty:
+                results = self._lookup_fst.lookup((), output="raw")
+                assert (
+                    len(results) == 0
+                ), f"Got results for empty lookup from FST: {results!r}"
+        return self._lookup_fst
+
+    def lookup_partial(self, tokens: List[str], longest_only=False) -> LookupResult:
+        key: LookupKey = (self.name, tuple(tokens), longest_only)
+        result = self.lookup_cache.get(key)
+        if result is None:
+            result = self.lookup_partial_uncached(tokens, longest_only)
+            self.lookup_cache.put(key, result)
+        return list(result)
+
+    def lookup_partial_uncached(
         self, tokens: List[str], longest_only=False
-    ) -> List[Tuple[List[str], List[str]]]:
-        results = []
+    ) -> LookupResult:
+        """
+        Look up every prefix of `tokens`, returning (output, rest) pairs,
+        where rest are the tokens after the prefix. These are ordered from
+        the shortest prefix to the longest. If `longest_only` is set, only
+        those of the longest matching prefix are returned.
+        """
         tokens_tup = tuple((tok + " " for tok in tokens))
-        match_start_res = lookup_tokens(self.get_match_at_start_fst(), tokens_tup)
-        if longest_only:
-            new_match_start_res: List[List[str]] = []
-            new_match_start_res_len = 0
-            for match_input in match_start_res:
-                match_input_len = len(match_input)
-                if match_input_len > new_match_start_res_len:
-                    new_match_start_res = []
-                    new_match_start_res_len = match_input_len
-                new_match_start_res.append(match_input)
-            match_start_res = new_match_start_res
-        for matched_input in match_start_res:
-            outputs_res = lookup_tokens(self.get_fst(), matched_input)
-            for output in outputs_res:
-                results.append((output, tokens[len(matched_input) :]))
+        lookup_fst = self.get_lookup_fst()
+        lengths = range(len(tokens), -1, -1) if longest_only else range(len(tokens) + 1)
+        results: LookupResult = []
+        for length in lengths:
+            for output in lookup_tokens(lookup_fst, tokens_tup[:length]):
+                results.append((output, tokens[length:]))
+            if longest_only and results:
+                break
         return results
+
+
+def preload_fsts():
+    """
+    Load all lookup FSTs from `LazyFst.fst_dir` and any persisted lookup
+    cache. Calling this before starting a pool of worker processes means the
+    workers inherit them and share their memory with the parent, rather than
+    each reading their own copy.
+    """
+    import wikiparse.assoc.fst  # noqa: F401
+
+    LazyFst.lookup_cache.load()
+    if LazyFst.fst_dir is None:
+        return
+    for fst in registry.values():
+        fst.get_lookup_fst()
@@ -0,0 +1,205 @@
+"""
+A bounded LRU cache for `LazyFst.lookup_partial` results.
+
+The same grammar notes turn up on a great many pages, so most lookups repeat
+ones which have been done before. The cache can be persisted to disk so the
+next run starts warm. Each pool worker writes what it has learnt into its own
+shard of the cache file when it exits, and the process which installed the
+cache merges the shards back in when it saves.
+"""
+import glob
+import logging
+import os
+import re
+from collections import OrderedDict
+from multiprocessing.util import Finalize
+from typing import Any, List, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAXSIZE = 100000
+WORKER_SHARD_RE = re.compile(r"\.worker-\d+$")
+
+LookupKey = Tuple[str, Tuple[str, ...], bool]
+LookupResult = List[Tuple[Tuple[str, ...], List[str]]]
+
+
+def worker_shard_path(path, pid):
+    return f"{path}.worker-{pid}"
+
+
+def worker_shard_paths(path):
+    return [
+        shard_path
+        for shard_path in sorted(glob.glob(glob.escape(path) + ".worker-*"))
+        if WORKER_SHARD_RE.search(shard_path)
+    ]
+
+
+def cache_version() -> Optional[str]:
+    """
+    The version of the code and FSTs the lookups come from, or None if the
+    FSTs' version cannot be known.
+    """
+    from wikiparse.incremental import fst_version, parser_version
+
+    fsts = fst_version()
+    if fsts is None:
+        return None
+    return f"{parser_version()}:{fsts}"
+
+
+class LookupCache:
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[LookupKey, LookupResult]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: LookupKey) -> Optional[LookupResult]:
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key: LookupKey, result: LookupResult):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        pass
+
+    def reopen(self):
+        pass
+
+    def worker_lost(self):
+        """
+        Called in the parent when a pool worker is killed.
+        """
+
+    def dumps(self, version: Optional[str]) -> bytes:
+        return orjson.dumps(
+            {
+                "version": version,
+                "entries": [
+                    [name, tokens, longest_only, result]
+                    for (name, tokens, longest_only), result in self.entries.items()
+                ],
+            }
+        )
+
+    def loads(self, data: bytes, version: Optional[str]) -> bool:
+        """
+        Add the entries of a dumped cache, unless it was made with a different
+        version of the code or FSTs. Returns whether the entries were added.
+        """
+        loaded: Any = orjson.loads(data)
+        if loaded["version"] != version:
+            return False
+        for name, tokens, longest_only, result in loaded["entries"]:
+            self.put(
+                (name, tuple(tokens), longest_only),
+                [(tuple(output), rest) for output, rest in result],
+            )
+        return True
+
+
+class PersistentLookupCache(LookupCache):
+    """
+    A LookupCache which is loaded from `path` when first used and saved back
+    to it when the process which created it exits. Call `load()` before
+    starting a pool so that the workers inherit the loaded entries, and
+    `reopen()` in the workers so they save their entries into their own
+    shards.
+    """
+
+    def __init__(self, path, maxsize=DEFAULT_MAXSIZE):
+        super().__init__(maxsize)
+        self.path = path
+        self.owner_pid = os.getpid()
+        self.version: Optional[str] = None
+        self.loaded = False
+
+    def load(self):
+        # Done lazily since the FST version depends on other options
+        if self.loaded:
+            return
+        self.loaded = True
+        self.version = cache_version()
+        if self.version is None:
+            logger.warning(
+                "Not persisting lookup cache %s since the FSTs are neither loaded "
+                "from a directory nor built from module data",
+                self.path,
+            )
+            return
+        for load_path in [self.path] + worker_shard_paths(self.path):
+            self.load_file(load_path)
+        self.finalizer = Finalize(self, self.save, exitpriority=10)
+
+    def get(self, key: LookupKey) -> Optional[LookupResult]:
+        if not self.loaded:
+            self.load()
+        return super().get(key)
+
+    def load_file(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as inf:
+            if not self.loads(inf.read(), self.version):
+                logger.info(
+                    "Discarding lookup cache %s made with other code or FSTs", path
+                )
+
+    def reopen(self):
+        self.hits = 0
+        self.misses = 0
+        if self.loaded and self.version is not None:
+            # Pool workers do not inherit the parent's finalizers
+            self.finalizer = Finalize(self, self.save, exitpriority=10)
+
+    def worker_lost(self):
+        if self.loaded and self.version is not None:
+            logger.warning(
+                "Lost the lookup cache entries of a killed worker which were "
+                "not yet saved to %s",
+                self.path,
+            )
+
+    def save(self):
+        logger.info(
+            "Lookup cache: %d hits, %d misses, %d entries",
+            self.hits,
+            self.misses,
+            len(self),
+        )
+        pid = os.getpid()
+        if pid == self.owner_pid:
+            shard_paths = worker_shard_paths(self.path)
+            for shard_path in shard_paths:
+                self.load_file(shard_path)
+            path = self.path
+        else:
+            shard_paths = []
+            path = worker_shard_path(self.path, pid)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as outf:
+            outf.write(self.dumps(self.version))
+        os.replace(tmp_path, path)
+        for shard_path in shard_paths:
+            os.unlink(shard_path)
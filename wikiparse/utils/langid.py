@@ -0,0 +1,228 @@
+"""
+Backends for telling apart Finnish and English text.
+
+The default "langdetect" backend is a thin wrapper around
+`langdetect.detect_langs`, which samples n-grams at random until its estimate
+converges. The opt-in "fast" backend first tries looking the words up in the
+`wordfreq` frequency lists, and otherwise scores every n-gram of the text once
+against langdetect's own language profiles, which are loaded once per
+process. It is much quicker, but does not always agree with langdetect, so
+check with `langid-agreement` before switching to it.
+"""
+import re
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+import numpy as np
+
+OUR_LANGS = ("en", "fi")
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+class LangIdBackend(ABC):
+    @abstractmethod
+    def detect(self, content: str) -> Optional[str]:
+        """
+        The language of `content` out of OUR_LANGS, or None if unsure.
+        """
+
+
+class LangdetectBackend(LangIdBackend):
+    def detect(self, content: str) -> Optional[str]:
+        from langdetect import detect_langs
+        from langdetect.lang_detect_exception import LangDetectException
+
+        try:
+            langs = detect_langs(content)
+        except LangDetectException:
+            return None
+        for lang in langs:
+            if lang.lang in OUR_LANGS:
+                return lang.lang
+        return None
+
+
+class LexiconLangId:
+    """
+    Decides on a language when every word of the text is at least `margin`
+    more frequent (on the Zipf scale) in that language's `wordfreq` list than
+    in the other's. Otherwise it has no opinion.
+    """
+
+    def __init__(self, margin=2.0, max_words=3):
+        self.margin = margin
+        self.max_words = max_words
+
+    def detect(self, content: str) -> Optional[str]:
+        from wordfreq import zipf_frequency
+
+        words = WORD_RE.findall(content)
+        if not words or len(words) > self.max_words:
+            return None
+        decided = None
+        for word in words:
+            fi = zipf_frequency(word, "fi")
+            en = zipf_frequency(word, "en")
+            if fi - en >= self.margin:
+                lang = "fi"
+            elif en - fi >= self.margin:
+                lang = "en"
+            else:
+                return None
+            if decided is not None and lang != decided:
+                return None
+            decided = lang
+        return decided
+
+
+class NgramLangId:
+    """
+    A deterministic version of langdetect's naive Bayes classifier: rather
+    than repeatedly sampling n-grams until the estimate converges, it adds
+    up the smoothed log probabilities of all the n-grams of the text at once
+    using a dense matrix built from langdetect's profiles.
+    """
+
+    ALPHA = 0.5
+    BASE_FREQ = 10000
+    PROB_THRESHOLD = 0.1
+
+    def __init__(self):
+        from langdetect import DetectorFactory
+        from langdetect.detector_factory import PROFILES_DIRECTORY
+
+        # A factory of our own, rather than the one langdetect keeps globally
+        factory = DetectorFactory()
+        factory.load_profile(PROFILES_DIRECTORY)
+        self.langs: List[str] = list(factory.langlist)
+        self.ngram_idxs: Dict[str, int] = {}
+        probs = np.empty(
+            (len(factory.word_lang_prob_map), len(self.langs)), dtype=np.float32
+        )
+        for idx, (ngram, lang_probs) in enumerate(factory.word_lang_prob_map.items()):
+            self.ngram_idxs[ngram] = idx
+            probs[idx] = lang_probs
+        self.log_probs = np.log(probs + self.ALPHA / self.BASE_FREQ)
+
+    def extract_ngrams(self, content: str) -> List[int]:
+        from langdetect.utils.ngram import NGram
+
+        idxs = []
+        ngram = NGram()
+        for ch in NGram.normalize_vi(content):
+            ngram.add_char(ch)
+            if ngram.capitalword:
+                continue
+            for n in range(1, NGram.N_GRAM + 1):
+                if len(ngram.grams) < n:
+                    break
+                gram = ngram.grams[-n:]
+                if gram != " " and gram in self.ngram_idxs:
+                    idxs.append(self.ngram_idxs[gram])
+        return idxs
+
+    def detect(self, content: str) -> Optional[str]:
+        idxs = self.extract_ngrams(content)
+        if not idxs:
+            return None
+        scores = self.log_probs[idxs].sum(axis=0, dtype=np.float64)
+        probs = np.exp(scores - scores.max())
+        probs /= probs.sum()
+        for lang_idx in np.argsort(-probs):
+            if probs[lang_idx] <= self.PROB_THRESHOLD:
+                break
+            if self.langs[lang_idx] in OUR_LANGS:
+                return self.langs[lang_idx]
+        return None
+
+
+_ngram_lang_id: Optional[NgramLangId] = None
+
+
+def get_ngram_lang_id() -> NgramLangId:
+    global _ngram_lang_id
+    if _ngram_lang_id is None:
+        _ngram_lang_id = NgramLangId()
+    return _ngram_lang_id
+
+
+class FastBackend(LangIdBackend):
+    def __init__(self):
+        self.lexicon = LexiconLangId()
+
+    def detect(self, content: str) -> Optional[str]:
+        lang = self.lexicon.detect(content)
+        if lang is not None:
+            return lang
+        return get_ngram_lang_id().detect(content)
+
+
+BACKENDS: Dict[str, Type[LangIdBackend]] = {
+    "langdetect": LangdetectBackend,
+    "fast": FastBackend,
+}
+
+_backend: LangIdBackend = LangdetectBackend()
+
+
+def set_lang_id_backend(name: str):
+    global _backend
+    _backend = BACKENDS[name]()
+    cached_detect.cache_clear()
+
+
+@lru_cache(maxsize=65536)
+def cached_detect(content: str) -> Optional[str]:
+    return _backend.detect(content)
+
+
+class RecordingBackend(LangIdBackend):
+    """
+    Passes texts through to another backend while keeping a copy of them.
+    """
+
+    def __init__(self, inner: LangIdBackend):
+        self.inner = inner
+        self.texts: List[str] = []
+
+    def detect(self, content: str) -> Optional[str]:
+        self.texts.append(content)
+        return self.inner.detect(content)
+
+
+def record_lang_id_inputs(name="langdetect") -> RecordingBackend:
+    global _backend
+    recording = RecordingBackend(BACKENDS[name]())
+    _backend = recording
+    cached_detect.cache_clear()
+    return recording
+
+
+def compare_backends(
+    texts: Iterable[str], reference="langdetect"
+) -> Dict[str, Tuple[int, float, List[Tuple[str, Optional[str], Optional[str]]]]]:
+    """
+    Run every backend over `texts`, returning for each the number of results
+    which agree with the `reference` backend, the time taken (excluding
+    loading) and the disagreeing results.
+    """
+    texts = list(texts)
+    results: Dict[str, List[Optional[str]]] = {}
+    times: Dict[str, float] = {}
+    for name, backend_cls in BACKENDS.items():
+        backend = backend_cls()
+        backend.detect("warm up")
+        start = time.perf_counter()
+        results[name] = [backend.detect(text) for text in texts]
+        times[name] = time.perf_counter() - start
+    comparison = {}
+    for name, got_results in results.items():
+        disagreements = [
+            (text, ref, got)
+            for text, ref, got in zip(texts, results[reference], got_results)
+            if ref != got
+        ]
+        comparison[name] = (len(texts) - len(disagreements), times[name], disagreements)
+    return comparison
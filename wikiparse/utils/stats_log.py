@@ -1,33 +1,154 @@
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
 from uuid import uuid4
 from sqlitedict import SqliteDict
+import glob
 import orjson
+import os
+import re
+import time
+
+
+WORKER_SHARD_RE = re.compile(r"\.worker-\d+$")
+
+
+def worker_shard_path(dbfn, pid):
+    return f"{dbfn}.worker-{pid}"
+
+
+def open_stats_db(dbfn, **kwargs):
+    return SqliteDict(
+        dbfn, encode=orjson.dumps, decode=orjson.loads, journal_mode="WAL", **kwargs
+    )
 
 
 class DbStatsLogger:
-    def __init__(self, dbfn):
+    """
+    Logs records into a SqliteDict. Records are buffered and written in a
+    single transaction when `batch_size` records have built up, when
+    `flush_interval` seconds have passed since the last write, or at exit.
+
+    Any process other than the one which created the logger, e.g. a pool
+    worker, gets its own shard of the database after calling `reopen()`, so
+    that workers do not contend for the same database. `iter_stats_records`
+    reads the main database and all its shards.
+    """
+
+    def __init__(self, dbfn, batch_size=1000, flush_interval=10):
         self.dbfn = dbfn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.owner_pid = os.getpid()
+        self.db = None
+        self.db_pid = None
         self.reopen()
 
     def reopen(self):
-        self.db = SqliteDict(
-            self.dbfn,
-            encode=orjson.dumps,
-            decode=orjson.loads,
-            autocommit=True,
-            journal_mode="WAL",
-        )
+        pid = os.getpid()
+        if self.db is not None and self.db_pid == pid:
+            self.finalizer()
+        # Otherwise this is a forked copy: leave the parent's database alone
+        if pid == self.owner_pid:
+            path = self.dbfn
+        else:
+            path = worker_shard_path(self.dbfn, pid)
+        self.buffer = {}
+        self.last_flush = time.monotonic()
+        self.db = open_stats_db(path, autocommit=False)
+        self.db_pid = pid
+        # Pool workers exit without running atexit handlers, but do run these
+        self.finalizer = Finalize(self, self.close, exitpriority=10)
 
     def append(self, record):
-        self.db[uuid4().bytes] = record
+        self.buffer[uuid4().bytes] = record
+        if (
+            len(self.buffer) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.db.update(self.buffer)
+            self.db.commit()
+            self.buffer = {}
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def discard(self, record_type):
+        """
+        Delete all records of `record_type` from the database and its shards.
+        """
+        self.discard_if(lambda record: record["type"] == record_type)
+
+    def discard_if(self, predicate):
+        """
+        Delete all records for which `predicate` is true from the database
+        and its shards.
+        """
+        self.flush()
+        for path in stats_db_paths(self.dbfn):
+            if path == self.dbfn:
+                db = self.db
+            else:
+                db = open_stats_db(path, autocommit=False)
+            keys = [key for key, record in db.items() if predicate(record)]
+            for key in keys:
+                del db[key]
+            db.commit()
+            if db is not self.db:
+                db.close()
 
 
 class NullStatsLogger:
     def reopen(self):
         pass
 
+    def discard(self, record_type):
+        pass
+
+    def discard_if(self, predicate):
+        pass
+
     def append(self, record):
         pass
 
+    def flush(self):
+        pass
+
+
+class RecordingStatsLogger:
+    """
+    Keeps a copy of records, passing them through to another logger if
+    `passthrough` is set.
+    """
+
+    def __init__(self, inner, passthrough=True):
+        self.inner = inner
+        self.passthrough = passthrough
+        self.records = []
+
+    def reopen(self):
+        self.inner.reopen()
+
+    def discard(self, record_type):
+        self.discard_if(lambda record: record["type"] == record_type)
+
+    def discard_if(self, predicate):
+        self.records = [record for record in self.records if not predicate(record)]
+        self.inner.discard_if(predicate)
+
+    def append(self, record):
+        self.records.append(record)
+        if self.passthrough:
+            self.inner.append(record)
+
+    def flush(self):
+        self.inner.flush()
+
 
 _stats_logger = NullStatsLogger()
 
@@ -36,6 +157,42 @@ def get_stats_logger():
     return _stats_logger
 
 
+def stats_logging_enabled():
+    return not isinstance(_stats_logger, NullStatsLogger)
+
+
 def install_db_stats_logger(dbfn):
     global _stats_logger
     _stats_logger = DbStatsLogger(dbfn)
+
+
+@contextmanager
+def recording_stats_logger(passthrough=True):
+    """
+    Record what is logged within. Unless `passthrough` is set, the records
+    are only kept, e.g. so that they can be sent to another process to log.
+    """
+    global _stats_logger
+    inner = _stats_logger
+    _stats_logger = RecordingStatsLogger(inner, passthrough)
+    try:
+        yield _stats_logger
+    finally:
+        _stats_logger = inner
+
+
+def stats_db_paths(dbfn):
+    """
+    The paths of the stats database `dbfn` and all its worker shards.
+    """
+    paths = [dbfn]
+    for path in sorted(glob.glob(glob.escape(dbfn) + ".worker-*")):
+        if WORKER_SHARD_RE.search(path):
+            paths.append(path)
+    return paths
+
+
+def iter_stats_records(dbfn):
+    for path in stats_db_paths(dbfn):
+        with open_stats_db(path, flag="r") as db:
+            yield from db.values()
@@ -1,6 +1,16 @@
 from tarfile import TarFile
+from io import BytesIO
 from os.path import join as pjoin, isdir, basename
+from typing import IO, List, Set, cast
+import gzip
+import orjson
 import os
+import zlib
+
+# Sharded output is a directory of files with one line per lemma, consisting
+# of the title, a tab and then the JSON of the parse results
+SHARD_PREFIX = "shard-"
+SHARD_INDEX = ".shards.json"
 
 
 def merge_dl(into, frm):
@@ -9,7 +19,104 @@ def merge_dl(into, frm):
             into[k].extend(frm[k])
 
 
+class ShardWriter:
+    """
+    Writes parse results into `num_shards` files in `outdir`, choosing the
+    shard from the title so that writes are large and sequential.
+
+    If `resume` is set, existing shards are appended to, after cutting off
+    any partly written last line, and their titles are put in `titles`. Any
+    other shards in `outdir`, e.g. from an earlier run with more shards, are
+    deleted.
+    """
+
+    def __init__(
+        self, outdir: str, num_shards: int, compress: bool = False, resume=False
+    ):
+        if resume and compress:
+            raise ValueError("Cannot resume writing compressed shards")
+        os.makedirs(outdir, exist_ok=True)
+        self.outdir = outdir
+        self.counts = [0] * num_shards
+        self.titles: Set[str] = set()
+        suffix = ".jsonl.gz" if compress else ".jsonl"
+        self.names = [f"{SHARD_PREFIX}{idx:04d}{suffix}" for idx in range(num_shards)]
+        for name in os.listdir(outdir):
+            if name.startswith(SHARD_PREFIX) and name not in self.names:
+                os.unlink(pjoin(outdir, name))
+        self.shards: List[IO[bytes]] = []
+        for idx, name in enumerate(self.names):
+            path = pjoin(outdir, name)
+            if compress:
+                shard = gzip.open(path, "wb", compresslevel=6)
+                self.shards.append(cast(IO[bytes], shard))
+            elif resume and os.path.exists(path):
+                self.shards.append(self.reopen_shard(idx, path))
+            else:
+                self.shards.append(open(path, "wb"))
+
+    def reopen_shard(self, idx: int, path: str) -> IO[bytes]:
+        shard = open(path, "r+b")
+        end = 0
+        for line in shard:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            self.titles.add(line.split(b"\t", 1)[0].decode("utf-8"))
+            self.counts[idx] += 1
+        shard.seek(end)
+        shard.truncate()
+        return shard
+
+    def write(self, title: str, data: bytes):
+        assert "\t" not in title and "\n" not in title
+        idx = zlib.crc32(title.encode("utf-8")) % len(self.shards)
+        self.shards[idx].write(title.encode("utf-8") + b"\t" + data + b"\n")
+        self.counts[idx] += 1
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        with open(pjoin(self.outdir, SHARD_INDEX), "wb") as index:
+            index.write(orjson.dumps({"counts": self.counts, "shards": self.names}))
+
+
+def shard_paths(indir: str) -> List[str]:
+    with open(pjoin(indir, SHARD_INDEX), "rb") as index:
+        names = orjson.loads(index.read()).get("shards")
+    if names is not None:
+        return [pjoin(indir, name) for name in names]
+    # Written before the index listed the shards
+    return sorted(
+        pjoin(indir, name)
+        for name in os.listdir(indir)
+        if name.startswith(SHARD_PREFIX)
+    )
+
+
+def is_sharded(indir: str) -> bool:
+    return isdir(indir) and os.path.exists(pjoin(indir, SHARD_INDEX))
+
+
+def iter_shard(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as shard:
+        for line in shard:
+            title, data = line.rstrip(b"\n").split(b"\t", 1)
+            yield title.decode("utf-8"), data
+
+
 class IterDirOrTar(object):
+    """
+    Iterates over (lemma, file-like) pairs of parse results, from either a
+    directory with one file per lemma, a tar file of such a directory, or a
+    directory of shards written by ShardWriter.
+    """
+
     def __init__(self, indir, members=None):
         self.indir = indir
         self.members = members
@@ -17,6 +124,9 @@ class IterDirOrTar(object):
     def __len__(self):
         if self.members is not None:
             return len(self.members)
+        if is_sharded(self.indir):
+            with open(pjoin(self.indir, SHARD_INDEX), "rb") as index:
+                return sum(orjson.loads(index.read())["counts"])
         if isdir(self.indir):
             return len(os.listdir(self.indir))
         else:
@@ -31,7 +141,12 @@ class IterDirOrTar(object):
         )
 
     def __iter__(self):
-        if isdir(self.indir):
+        if is_sharded(self.indir):
+            for path in shard_paths(self.indir):
+                for word, data in iter_shard(path):
+                    if self.word_included(word):
+                        yield word, BytesIO(data)
+        elif isdir(self.indir):
             for word in os.listdir(self.indir):
                 if not self.word_included(word):
                     continue
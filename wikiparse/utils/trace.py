@@ -0,0 +1,113 @@
+"""
+Named trace points for debugging the parser.
+
+Each module gets a tracer with `trace = get_tracer(__name__)`, and trace
+points are written guarded so that nothing is formatted, or even passed,
+when tracing is off:
+
+    if trace.enabled:
+        trace("lexed", lexed)
+
+Tracing is switched on for some modules (or their parent packages), for
+some lemmas, or both with `configure_tracing`, e.g. from the --trace,
+--trace-lemmas and --trace-file options of the parse commands.
+"""
+import os
+import sys
+from typing import Dict, Optional, Set, TextIO
+
+_modules: Optional[Set[str]] = None
+_lemmas: Optional[Set[str]] = None
+_active = False
+_current_lemma: Optional[str] = None
+_path: Optional[str] = None
+_outf: Optional[TextIO] = None
+_outf_pid: Optional[int] = None
+_tracers: Dict[str, "Tracer"] = {}
+
+
+def _format(value) -> str:
+    from prettyprinter import install_extras, pformat
+
+    if not getattr(_format, "installed", False):
+        install_extras(exclude=["django", "ipython", "ipython_repr_pretty"])
+        setattr(_format, "installed", True)
+    if isinstance(value, str):
+        return value
+    return pformat(value)
+
+
+def _get_outf() -> TextIO:
+    global _outf, _outf_pid
+    if _path is None:
+        return sys.stderr
+    # Forked workers open the file again rather than share a buffer
+    if _outf is None or _outf_pid != os.getpid():
+        _outf = open(_path, "a")
+        _outf_pid = os.getpid()
+    return _outf
+
+
+class Tracer:
+    def __init__(self, module: str):
+        self.module = module
+        self.enabled = False
+        self.update()
+
+    def update(self):
+        self.enabled = (
+            _active
+            and (
+                _modules is None
+                or any(
+                    self.module == module or self.module.startswith(module + ".")
+                    for module in _modules
+                )
+            )
+            and (_lemmas is None or _current_lemma in _lemmas)
+        )
+
+    def __call__(self, point: str, *values):
+        if not self.enabled:
+            return
+        outf = _get_outf()
+        # Indent continuation lines so each record starts a new line
+        text = " ".join(_format(value) for value in values).replace("\n", "\n\t")
+        outf.write("{}\t{}:{}\t{}\n".format(_current_lemma, self.module, point, text))
+        outf.flush()
+
+
+def get_tracer(module: str) -> Tracer:
+    if module not in _tracers:
+        _tracers[module] = Tracer(module)
+    return _tracers[module]
+
+
+def _update_tracers():
+    for tracer in _tracers.values():
+        tracer.update()
+
+
+def configure_tracing(modules=None, lemmas=None, path=None):
+    """
+    Turn on tracing for `modules` and `lemmas`, iterables of names, either of
+    which can be None to mean all of them. Traces are appended to the file
+    `path`, or written to stderr if it is None. If both `modules` and
+    `lemmas` are None, tracing is turned off.
+    """
+    global _modules, _lemmas, _active, _path, _outf
+    _modules = set(modules) if modules is not None else None
+    _lemmas = set(lemmas) if lemmas is not None else None
+    _active = modules is not None or lemmas is not None
+    if _outf is not None and _outf_pid == os.getpid():
+        _outf.close()
+    _outf = None
+    _path = path
+    _update_tracers()
+
+
+def set_trace_lemma(lemma: Optional[str]):
+    global _current_lemma
+    _current_lemma = lemma
+    if _lemmas is not None:
+        _update_tracers()
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+from bisect import bisect_right
+from mwparserfromhell.definitions import PARSER_BLACKLIST
 from mwparserfromhell.nodes import Tag
 from mwparserfromhell.wikicode import Template, Wikicode
 from mwparserfromhell import parse
 from more_itertools import peekable
 from typing import List, Iterator, Tuple, Optional
 from dataclasses import dataclass
+import re
 
 INLINE_TEMPLATES = ["link", "l", "mention", "m", "qualifier", "gloss"]
 
@@ -108,3 +111,63 @@ def double_strip(wikicode: Wikicode) -> str:
 
 def block_templates(contents: Wikicode) -> List[Template]:
     return [t for t in contents.filter_templates() if t.name not in INLINE_TEMPLATES]
+
+
+# Spans of wikitext in which mwparserfromhell does not look for headings
+UNPARSED_RE = re.compile(
+    r"<!--.*?(?:-->|\Z)|<({})\b[^>]*(?<!/)>.*?</\1\s*>".format(
+        "|".join(PARSER_BLACKLIST)
+    ),
+    re.DOTALL | re.IGNORECASE,
+)
+LINE_COMMENT_RE = re.compile(r"<!--.*?(?:-->|$)")
+HEADING_LINE_RE = re.compile(r"^=[^\n]*", re.MULTILINE)
+TITLE_END_RE = re.compile(r"<|\{\{|\[\[")
+
+
+def scan_headings(text: str) -> Iterator[Tuple[int, int, str]]:
+    """
+    Find the headings in raw wikitext without parsing it, yielding their
+    (offset, level, title). Headings inside comments and tags whose contents
+    are not parsed, such as <nowiki>, are skipped. Headings inside multiline
+    templates are not, unlike in mwparserfromhell.
+    """
+    unparsed = [match.span() for match in UNPARSED_RE.finditer(text)]
+    unparsed_starts = [start for start, _ in unparsed]
+    for match in HEADING_LINE_RE.finditer(text):
+        offset = match.start()
+        idx = bisect_right(unparsed_starts, offset) - 1
+        if idx >= 0 and unparsed[idx][1] > offset:
+            continue
+        line = LINE_COMMENT_RE.sub("", match.group())
+        left = len(line) - len(line.lstrip("="))
+        # The heading ends at the last run of =s, anything after is text
+        last = line.rfind("=") + 1
+        right = last - len(line[:last].rstrip("="))
+        if last <= left:
+            continue
+        level = min(left, right, 6)
+        yield offset, level, line[level : last - level]
+
+
+def slice_lang_sections(text: str, lang: str = "Finnish") -> Optional[str]:
+    """
+    Cut the level 2 sections headed `lang` out of the raw wikitext of a page,
+    so that only they need to be parsed. Returns None if there are none.
+    """
+    slices = []
+    start = None
+    for offset, level, title in scan_headings(text):
+        if level > 2:
+            continue
+        if start is not None:
+            slices.append(text[start:offset])
+            start = None
+        # Like get_heading(...) == lang, which compares the first node only
+        if level == 2 and TITLE_END_RE.split(title, 1)[0] == lang:
+            start = offset
+    if start is not None:
+        slices.append(text[start:])
+    if not slices:
+        return None
+    return "".join(slices)
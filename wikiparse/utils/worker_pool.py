@@ -0,0 +1,275 @@
+"""
+A process pool which can abandon pages that go over their budget.
+
+`multiprocessing.Pool` cannot time out a task: a worker stuck on one page,
+whether in Python or inside a C extension, stalls it for good, and a worker
+which dies takes its task with it so the pool waits forever. Here each worker
+has a pipe of its own, over which it gets one task at a time and tells the
+parent which page it is on. The parent acts as a watchdog: when a page runs
+for too long, or its worker's resident set grows too much while parsing it,
+the worker is killed and replaced, and its task is handed out again with
+that page to be skipped.
+"""
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing import Pipe, Process, cpu_count
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional
+
+from wikiparse.utils.budget import get_budget, get_rss
+
+POLL_INTERVAL = 0.05
+# How many entries are read ahead of the workers when not given
+PENDING_PER_PROCESS = 2
+
+_conn = None
+_skip: FrozenSet[str] = frozenset()
+
+
+def page_started(title: Optional[str]):
+    """
+    Tell the parent which page this worker is now parsing, or with None, that
+    it is between pages. Does nothing outside of a WorkerPool.
+    """
+    if _conn is not None:
+        _conn.send(("page", title))
+
+
+def skip_page(title: str) -> bool:
+    """
+    Whether `title` went over budget in an earlier attempt at the current
+    task, and so should be given up on.
+    """
+    return title in _skip
+
+
+def worker_main(conn, func, initializer):
+    global _conn, _skip
+    _conn = conn
+    if initializer is not None:
+        initializer()
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        entry, _skip = task
+        try:
+            result = (True, func(entry))
+        except Exception as exc:
+            result = (False, exc)
+        try:
+            conn.send(("done", result))
+        except Exception as exc:
+            conn.send(("done", (False, RuntimeError(repr(exc)))))
+    conn.close()
+
+
+class Worker:
+    def __init__(self, func, initializer):
+        self.conn, child_conn = Pipe()
+        self.process = Process(
+            target=worker_main, args=(child_conn, func, initializer), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.task: Optional[Any] = None
+        self.skip: FrozenSet[str] = frozenset()
+        self.page: Optional[str] = None
+        self.page_started = 0.0
+        self.page_rss = 0
+
+    def send(self, entry, skip: FrozenSet[str]):
+        self.task = entry
+        self.skip = skip
+        self.conn.send((entry, skip))
+
+    def start_page(self, title: Optional[str]):
+        self.page = title
+        if title is not None:
+            self.page_started = time.monotonic()
+            self.page_rss = get_rss(self.process.pid)
+
+    def over_budget(self) -> Optional[str]:
+        max_seconds, max_rss = get_budget()
+        if self.page is None:
+            return None
+        if (
+            max_seconds is not None
+            and time.monotonic() - self.page_started > max_seconds
+        ):
+            return "timeout"
+        if max_rss is not None and get_rss(self.process.pid) - self.page_rss > max_rss:
+            return "oom"
+        return None
+
+    def kill(self):
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Runs `func` over entries in `processes` forked workers, yielding the
+    results in the order they finish. `initializer` is run in each worker
+    when it starts. At most `max_pending` entries are read ahead of the
+    workers, so a slow consumer does not make a fast producer buffer
+    unboundedly.
+
+    A worker brackets each page of a task with `page_started(title)` and
+    `page_started(None)`, and gives up on any page for which `skip_page`
+    is true. When a page goes over the budget from `set_page_budget`, or
+    its worker dies, `on_abandon(title, kind)` is called in the parent, where
+    kind is "timeout", "oom" or "crash".
+
+    The whole task is then handed out again, so the pages before the
+    abandoned one are processed a second time. `func` should therefore only
+    have effects which are the same however many times a page is processed,
+    e.g. overwriting its output, and return anything else, such as stats, for
+    the parent to handle once the task is done. Whatever the killed worker
+    kept in memory, e.g. unsaved cache entries, is lost.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[Any], Any],
+        processes: Optional[int] = None,
+        initializer: Optional[Callable[[], None]] = None,
+        max_pending: Optional[int] = None,
+        on_abandon: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.func = func
+        self.processes = processes or cpu_count()
+        self.initializer = initializer
+        self.max_pending = max_pending or PENDING_PER_PROCESS * self.processes
+        self.on_abandon = on_abandon
+
+    def spawn(self) -> Worker:
+        return Worker(self.func, self.initializer)
+
+    def read_ahead(self, entries: Iterable[Any], buffer: queue.Queue, stop):
+        try:
+            for entry in entries:
+                while not stop.is_set():
+                    try:
+                        buffer.put((True, entry), timeout=POLL_INTERVAL)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            buffer.put((False, None))
+        except BaseException as exc:
+            buffer.put((False, exc))
+
+    def abandon(self, worker: Worker, kind: str) -> Optional[Any]:
+        """
+        Kill `worker` and return its task with the page it was on skipped.
+        """
+        title = worker.page
+        worker.kill()
+        if title is None:
+            raise RuntimeError(
+                f"Worker {worker.process.pid} died outside of a page "
+                f"with exit code {worker.process.exitcode}"
+            )
+        if self.on_abandon is not None:
+            self.on_abandon(title, kind)
+        return worker.task, worker.skip | {title}
+
+    def imap_unordered(self, entries: Iterable[Any]) -> Iterator[Any]:
+        buffer: queue.Queue = queue.Queue(self.max_pending)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=self.read_ahead, args=(entries, buffer, stop), daemon=True
+        )
+        reader.start()
+        workers = [self.spawn() for _ in range(self.processes)]
+        retries: List[Any] = []
+        exhausted = False
+        try:
+            while True:
+                for worker in workers:
+                    if worker.task is not None:
+                        continue
+                    if retries:
+                        worker.send(*retries.pop())
+                        continue
+                    if exhausted:
+                        continue
+                    try:
+                        # Only block when there is nothing else to wait on
+                        more, entry = buffer.get(
+                            block=all(w.task is None for w in workers),
+                        )
+                    except queue.Empty:
+                        break
+                    if not more:
+                        exhausted = True
+                        if entry is not None:
+                            raise entry
+                        continue
+                    worker.send(entry, frozenset())
+                busy = [worker for worker in workers if worker.task is not None]
+                if not busy:
+                    if exhausted and not retries:
+                        break
+                    continue
+                ready = wait(
+                    [worker.conn for worker in busy]
+                    + [worker.process.sentinel for worker in busy],
+                    timeout=POLL_INTERVAL,
+                )
+                by_object: Dict[Any, Worker] = {}
+                for worker in busy:
+                    by_object[worker.conn] = worker
+                    by_object[worker.process.sentinel] = worker
+                for worker in {by_object[obj] for obj in ready}:
+                    for result in self.receive(worker, workers, retries):
+                        yield result
+                for idx, worker in enumerate(workers):
+                    if worker.task is None:
+                        continue
+                    kind = worker.over_budget()
+                    if kind is not None:
+                        retries.append(self.abandon(worker, kind))
+                        workers[idx] = self.spawn()
+            for worker in workers:
+                worker.conn.send(None)
+            # Let workers exit cleanly so they flush their stats
+            for worker in workers:
+                worker.process.join()
+                worker.conn.close()
+        finally:
+            stop.set()
+            for worker in workers:
+                if worker.process.is_alive():
+                    worker.kill()
+
+    def receive(self, worker: Worker, workers: List[Worker], retries: List[Any]):
+        try:
+            while worker.conn.poll():
+                kind, payload = worker.conn.recv()
+                if kind == "page":
+                    worker.start_page(payload)
+                    continue
+                ok, result = payload
+                worker.task = None
+                worker.start_page(None)
+                if not ok:
+                    raise result
+                yield result
+                return
+        except (EOFError, OSError):
+            pass
+        if worker.process.is_alive():
+            return
+        # It died while working on its task
+        exitcode = worker.process.exitcode
+        kind = "oom" if exitcode == -signal.SIGKILL else "crash"
+        retries.append(self.abandon(worker, kind))
+        workers[workers.index(worker)] = self.spawn()